@@ -1,5 +1,6 @@
 import os
 import json
+import asyncio
 from datetime import datetime, time
 from typing import Optional
 from contextlib import asynccontextmanager
@@ -11,9 +12,19 @@ from pydantic import BaseModel
 import time as time_module
 
 from notion.processor import NotionProcessor
+from notion.rate_limiter import notion_scheduler, notion_priority, Priority
 from send_token.processor import TokenProcessor
 from logger import logger, log_api_request, log_api_response, log_check_result
 from telegram_bot.bot import TelegramProcessor
+from utils import token_processor
+from telegram_bot.ingest import IngestWorker, TELEGRAM_INGEST_MODE, TELEGRAM_WEBHOOK_SECRET
+from slack_bot.bot import SlackBot
+from media.evidence import EvidenceCollector
+from llm.gemini import AsyncGeminiProcessor
+from llm.response_cache import llm_response_cache
+from llm.resilience import llm_resilience
+from llm.instrumentation import llm_call_recorder
+from media.preprocess import get_preprocess_stats
 
 
 class ScheduleConfig(BaseModel):
@@ -24,6 +35,8 @@ class ScheduleConfig(BaseModel):
 # Default check times
 MORNING_CHECK_TIME = ScheduleConfig(hour=7, minute=0, second=00)  # 7:00 AM
 EVENING_CHECK_TIME = ScheduleConfig(hour=23, minute=59, second=59)  # 11:59 PM
+# Warm-up jobs prefetch the evening check data this many minutes before the deadline
+WARMUP_LEAD_MINUTES = int(os.getenv('WARMUP_LEAD_MINUTES', 5))
 scheduler = BackgroundScheduler()
 current_morning_schedule = MORNING_CHECK_TIME
 current_evening_schedule = EVENING_CHECK_TIME
@@ -31,12 +44,44 @@ current_evening_schedule = EVENING_CHECK_TIME
 # Initialize processors
 notion_processor = NotionProcessor()
 telegram_processor = TelegramProcessor()
+# the worker runs on the app's event loop, with its own bot session and LLM client
+ingest_worker = IngestWorker(TelegramProcessor(async_gemini_processor=AsyncGeminiProcessor())) if TELEGRAM_INGEST_MODE != 'off' else None
+# checks stop polling once the worker receives the updates, in webhook mode only after the webhook is registered
+telegram_processor.streaming = TELEGRAM_INGEST_MODE == 'polling'
+# Slack is an evidence source once a bot token is configured, its images go through the same media pipeline
+evidence_collector = EvidenceCollector(
+    [telegram_processor] + ([SlackBot(pipeline=telegram_processor.pipeline)] if os.getenv('SLACK_BOT_TOKEN') else [])
+)
+
+def shift_schedule(config: ScheduleConfig, minutes: int) -> ScheduleConfig:
+    """Move a schedule earlier by a number of minutes, wrapping around midnight"""
+    total_seconds = (config.hour * 3600 + config.minute * 60 + config.second - minutes * 60) % (24 * 3600)
+    return ScheduleConfig(hour=total_seconds // 3600, minute=total_seconds % 3600 // 60, second=total_seconds % 60)
+
+def add_evening_warmup_jobs(config: ScheduleConfig):
+    """Schedule the warm-up jobs that stage data for the evening checks"""
+    warmup = shift_schedule(config, WARMUP_LEAD_MINUTES)
+    scheduler.add_job(
+        notion_processor.warm_up,
+        CronTrigger(hour=warmup.hour, minute=warmup.minute, second=warmup.second),
+        id='evening_task_warmup',
+        replace_existing=True
+    )
+    scheduler.add_job(
+        telegram_processor.sync_warm_up,
+        CronTrigger(hour=warmup.hour, minute=warmup.minute, second=warmup.second),
+        id='evening_workout_warmup',
+        replace_existing=True
+    )
+    logger.info(f"Scheduled evening warm-up for {warmup.hour:02d}:{warmup.minute:02d}:{warmup.second:02d}")
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # Startup: Start the scheduler
     logger.info("Starting Task Supervisor Agent")
     scheduler.start()
+    # runs once right away, so that the first punishment does not wait for the nonce
+    scheduler.add_job(token_processor.sync_nonce, id='nonce_sync')
     
     # Add morning check job (7:00 AM)
     scheduler.add_job(
@@ -55,7 +100,7 @@ async def lifespan(app: FastAPI):
     logger.info(f"Scheduled evening check for {current_evening_schedule.hour:02d}:{current_evening_schedule.minute:02d}:{current_evening_schedule.second:02d}")
     
     scheduler.add_job(
-        telegram_processor.sync_check_morning_images,
+        evidence_collector.sync_check_morning_images,
         CronTrigger(hour=current_morning_schedule.hour, minute=current_morning_schedule.minute, second=current_morning_schedule.second),
         id='morning_images_check'
     )
@@ -68,11 +113,26 @@ async def lifespan(app: FastAPI):
         id='evening_workout_check'
     )
     logger.info(f"Scheduled evening workout check for {current_evening_schedule.hour:02d}:{current_evening_schedule.minute:02d}:{current_evening_schedule.second:02d}")
+
+    add_evening_warmup_jobs(current_evening_schedule)
+
+    ingest_task = None
+    if TELEGRAM_INGEST_MODE == 'polling':
+        ingest_task = asyncio.create_task(ingest_worker.run_polling())
+    elif TELEGRAM_INGEST_MODE == 'webhook':
+        telegram_processor.streaming = await ingest_worker.register_webhook()
         
     yield
     
     # Shutdown: Stop the scheduler
     logger.info("Shutting down Task Supervisor Agent")
+    if ingest_task is not None:
+        ingest_task.cancel()
+    if telegram_processor.streaming and TELEGRAM_INGEST_MODE == 'webhook':
+        await ingest_worker.delete_webhook()
+        telegram_processor.streaming = False
+    if ingest_worker is not None:
+        await ingest_worker.stop()
     scheduler.shutdown()
 
 app = FastAPI(title="Task Supervisor Agent", lifespan=lifespan)
@@ -153,6 +213,7 @@ async def update_evening_schedule(config: ScheduleConfig):
         CronTrigger(hour=config.hour, minute=config.minute),
         id='evening_task_check'
     )
+    add_evening_warmup_jobs(config)
     
     logger.info(f"Evening check schedule updated to {config.hour:02d}:{config.minute:02d}")
     return {"message": f"Evening check schedule updated to {config.hour:02d}:{config.minute:02d}"}
@@ -162,7 +223,9 @@ async def check_morning_now():
     """Manually trigger morning task check"""
     logger.info("Manual morning task check triggered")
     try:
-        result = notion_processor.check_tasks_existence()
+        # run in a worker thread: the check drives its own event loop for the Notion tree fetch
+        with notion_priority(Priority.ADHOC):
+            result = await asyncio.to_thread(notion_processor.check_tasks_existence)
         log_check_result("morning", "PASS", "Morning task check completed successfully", result=result)
         return {"message": "Morning task check completed", "result": result}
     except Exception as e:
@@ -175,7 +238,9 @@ async def check_evening_now():
     """Manually trigger evening task check"""
     logger.info("Manual evening task check triggered")
     try:
-        result = notion_processor.check_tasks_completion()
+        # run in a worker thread: the check drives its own event loop for the Notion tree fetch
+        with notion_priority(Priority.ADHOC):
+            result = await asyncio.to_thread(notion_processor.check_tasks_completion)
         log_check_result("evening", "PASS", "Evening task check completed successfully", result=result)
         return {"message": "Evening task check completed", "result": result}
     except Exception as e:
@@ -183,6 +248,58 @@ async def check_evening_now():
         log_check_result("evening", "FAIL", f"Evening task check failed: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/telegram/webhook")
+async def telegram_webhook(request: Request):
+    """Receive a Telegram update, its image is evaluated in the background"""
+    if TELEGRAM_INGEST_MODE != 'webhook':
+        raise HTTPException(status_code=404, detail="Webhook ingest is disabled")
+    if TELEGRAM_WEBHOOK_SECRET and request.headers.get("X-Telegram-Bot-Api-Secret-Token") != TELEGRAM_WEBHOOK_SECRET:
+        raise HTTPException(status_code=403, detail="Invalid secret token")
+    await ingest_worker.handle_webhook(await request.json())
+    return {"ok": True}
+
+@app.get("/evidence")
+async def get_evidence(day: Optional[str] = None):
+    """Collect the evidence of a day (YYYY-MM-DD, today by default) from every source"""
+    try:
+        day_obj = datetime.strptime(day, "%Y-%m-%d").date() if day else None
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid day format")
+    # run in a worker thread: the sources are shared with the scheduled checks, which drive their own event loops
+    return await asyncio.to_thread(asyncio.run, evidence_collector.collect(day_obj))
+
+@app.get("/metrics/evidence")
+async def get_evidence_metrics():
+    """Get per-source evidence collection statistics"""
+    return evidence_collector.get_stats()
+
+@app.get("/metrics/ingest")
+async def get_ingest_metrics():
+    """Get Telegram ingest worker statistics"""
+    return ingest_worker.get_stats() if ingest_worker is not None else {"mode": "off"}
+
+@app.get("/metrics/notion")
+async def get_notion_metrics():
+    """Get Notion request scheduler statistics"""
+    return notion_scheduler.get_stats()
+
+@app.get("/metrics/llm")
+async def get_llm_metrics():
+    """Get LLM response cache, call resilience and image preprocessing statistics"""
+    return {"cache": llm_response_cache.get_stats(), "calls": llm_resilience.get_stats(), "images": get_preprocess_stats()}
+
+@app.get("/metrics/llm/usage")
+async def get_llm_usage(check: Optional[str] = None, window_seconds: Optional[int] = None):
+    """Get per-check LLM token, request byte and latency histograms"""
+    return llm_call_recorder.get_stats(check, window_seconds)
+
+@app.get("/metrics/llm/prompts")
+async def get_llm_prompts(limit: int = 10, by: str = "prompt_tokens", window_seconds: Optional[int] = None):
+    """Get the most expensive LLM prompts"""
+    if by not in ("prompt_tokens", "candidate_tokens", "image_tokens", "request_bytes", "wall_seconds"):
+        raise HTTPException(status_code=400, detail=f"Unknown field: {by}")
+    return llm_call_recorder.top_prompts(limit, by, window_seconds)
+
 
 if __name__ == "__main__":
     import uvicorn
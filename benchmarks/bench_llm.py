@@ -0,0 +1,115 @@
+"""
+Offline benchmark of the Gemini-backed checks against FakeGeminiClient.
+
+Drives the real NotionProcessor.check_task_content, TelegramProcessor.check_workout_images and
+TelegramProcessor.check_morning_images code paths (with FakeNotionClient and FakeTelegramBot) and
+reports the p50/p95/p99 latency, the LLM calls and the prompt tokens per check. The response cache
+is disabled and every check gets its own budgets, hedging and circuit breakers.
+
+    python -m benchmarks.bench_llm --latency 1.5 --sigma 0.5 --error-rate 0.02 --runs 50
+"""
+import os
+import time
+import asyncio
+import argparse
+import tempfile
+import statistics
+from typing import List, Callable, Dict, Any
+
+from llm.fake_client import FakeGeminiClient
+from llm.gemini import GeminiProcessor, AsyncGeminiProcessor
+from llm.resilience import ResilientCaller
+from llm.instrumentation import CallRecorder
+from notion.fake_client import FakeNotionClient
+from notion.processor import NotionProcessor
+from telegram_bot.bot import TelegramProcessor
+from telegram_bot.fake_bot import make_day_bot
+from telegram_bot.update_store import UpdateStore
+from media.store import MediaStore
+
+
+NOTE = 'Woke up at 6, wrote down the plan for today. "Discipline is choosing what you want most over what you want now."'
+
+
+def percentile(samples: List[float], p: float) -> float:
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(p * len(samples)))]
+
+
+def bench_check(name: str, check: Callable[[], Any], client: FakeGeminiClient, recorder: CallRecorder, runs: int) -> Dict[str, Any]:
+    timings, failures = [], 0
+    calls_before = client.total_calls
+    for _ in range(runs):
+        start = time.perf_counter()
+        try:
+            result = check()
+            if getattr(result, 'status', 'PASS') == 'FAIL':
+                failures += 1
+        except Exception:
+            failures += 1
+        timings.append((time.perf_counter() - start) * 1000)
+    return {
+        'check': name,
+        'p50': statistics.median(timings),
+        'p95': percentile(timings, 0.95),
+        'p99': percentile(timings, 0.99),
+        'calls': (client.total_calls - calls_before) / runs,
+        'tokens': sum(record.prompt_tokens for record in recorder.get_records()) / runs,
+        'errored': failures,
+    }
+
+
+def run(latency: float, sigma: float, error_rate: float, runs: int, hedge: bool, fallback_model: str, bot_latency: float,
+        workouts: int) -> None:
+    print(f'latency={latency * 1000:.0f}ms sigma={sigma} error_rate={error_rate} hedge={hedge} runs={runs} (times in ms)')
+    header = f"{'check':<16} {'p50':>9} {'p95':>9} {'p99':>9} {'calls/run':>10} {'tokens/run':>11} {'errored':>8}"
+    print(header)
+    print('-' * len(header))
+
+    def processors(seed: int):
+        client = FakeGeminiClient(latency=latency, sigma=sigma, error_rate=error_rate, seed=seed)
+        resilience = ResilientCaller(hedge_enabled=hedge)
+        recorder = CallRecorder()
+        gemini = GeminiProcessor(client=client, cache=None, resilience=resilience, recorder=recorder)
+        async_gemini = AsyncGeminiProcessor(client=client, cache=None, resilience=resilience, recorder=recorder)
+        gemini.fallback_model = async_gemini.fallback_model = fallback_model
+        return client, recorder, gemini, async_gemini
+
+    client, recorder, gemini, _ = processors(seed=1)
+    notion_processor = NotionProcessor(client=FakeNotionClient(), scheduler=None, llm=gemini)
+    rows = [bench_check('task_content', lambda: notion_processor.check_task_content(NOTE), client, recorder, runs)]
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        def cold_check(processor: TelegramProcessor, name: str) -> Callable[[], Any]:
+            def check():
+                # an empty media store, so that every image is downloaded and sent to the LLM again
+                processor.pipeline.media_store = MediaStore(os.path.join(tmp_dir, f'media-{time.perf_counter_ns()}.sqlite3'))
+                return asyncio.run(getattr(processor, name)())
+            return check
+
+        client, recorder, gemini, async_gemini = processors(seed=2)
+        telegram_processor = TelegramProcessor(bot=make_day_bot(bot_latency, n_workouts=workouts), async_gemini_processor=async_gemini,
+                                               update_store=UpdateStore(f'{tmp_dir}/workout_updates.sqlite3'))
+        rows.append(bench_check('workout', cold_check(telegram_processor, 'check_workout_images'), client, recorder, runs))
+
+        client, recorder, gemini, async_gemini = processors(seed=3)
+        telegram_processor = TelegramProcessor(bot=make_day_bot(bot_latency), async_gemini_processor=async_gemini,
+                                               update_store=UpdateStore(f'{tmp_dir}/morning_updates.sqlite3'))
+        rows.append(bench_check('morning_images', cold_check(telegram_processor, 'check_morning_images'), client, recorder, runs))
+
+    for row in rows:
+        print(f"{row['check']:<16} {row['p50']:>9.1f} {row['p95']:>9.1f} {row['p99']:>9.1f} {row['calls']:>10.2f} {row['tokens']:>11.0f} {row['errored']:>8}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the Gemini-backed checks offline')
+    parser.add_argument('--latency', type=float, default=1.0, help='Median seconds per fake Gemini call')
+    parser.add_argument('--sigma', type=float, default=0.5, help='Spread of the log-normal call latency')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Probability that a fake call fails with a 503')
+    parser.add_argument('--runs', type=int, default=30, help='Runs per check')
+    parser.add_argument('--no-hedge', dest='hedge', action='store_false', help='Disable hedged requests')
+    parser.add_argument('--fallback-model', default='', help='Fallback model name, empty for none')
+    parser.add_argument('--bot-latency', type=float, default=0.0, help='Seconds per fake Telegram call')
+    parser.add_argument('--workouts', type=int, default=2, help='Workout screenshots sent during the day')
+    args = parser.parse_args()
+    run(args.latency, args.sigma, args.error_rate, args.runs, args.hedge, args.fallback_model, args.bot_latency, args.workouts)
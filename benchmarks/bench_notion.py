@@ -0,0 +1,79 @@
+"""
+Offline benchmark of the Notion task path against FakeNotionClient.
+
+Times the sequential parse, the concurrent tree fetch (cold and from the block cache) and the
+tree evaluation for synthetic days of 10, 100 and 1,000 tasks at several nesting depths.
+
+    python -m benchmarks.bench_notion --latency 0.05 --concurrency 3
+"""
+import time
+import asyncio
+import argparse
+import tempfile
+import statistics
+from typing_extensions import List
+
+from notion.blocks import parse_toggle_block
+from notion.block_cache import BlockCache
+from notion.tree_fetcher import AsyncTreeFetcher
+from notion.fake_client import FakeNotionClient, AsyncFakeNotionClient, generate_day_tree
+from notion.task_tree import TaskNode, evaluate_tree
+
+
+SIZES = [10, 100, 1000]
+DEPTHS = [0, 1, 2]
+CACHE_VERSION = '2025-06-01T00:00:00.000Z'
+
+
+def time_call(func, repeat: int) -> float:
+    """Median wall time of func over repeat runs, in milliseconds"""
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append((time.perf_counter() - start) * 1000)
+    return statistics.median(timings)
+
+
+def run(latency: float, jitter: float, concurrency: int, repeat: int, sizes: List[int], depths: List[int]) -> None:
+    header = f"{'tasks':>6} {'depth':>5} {'calls':>5} {'sequential':>11} {'concurrent':>11} {'cached':>8} {'evaluate':>9}"
+    print(f'latency={latency * 1000:.0f}ms jitter={jitter * 1000:.0f}ms concurrency={concurrency} (times in ms)')
+    print(header)
+    print('-' * len(header))
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for n_tasks in sizes:
+            for depth in depths:
+                root, children = generate_day_tree('01/06/2025', n_tasks, depth)
+
+                sync_client = FakeNotionClient(children, latency=latency, jitter=jitter)
+                start = time.perf_counter()
+                sequential_tree = parse_toggle_block(sync_client, root)
+                sequential_ms = (time.perf_counter() - start) * 1000
+
+                async_client = AsyncFakeNotionClient(children, latency=latency, jitter=jitter)
+                fetcher = AsyncTreeFetcher(client=async_client, max_concurrency=concurrency, scheduler=None)
+                start = time.perf_counter()
+                concurrent_tree = asyncio.run(fetcher.fetch_tree(root))
+                concurrent_ms = (time.perf_counter() - start) * 1000
+                assert concurrent_tree == sequential_tree, 'concurrent fetch differs from the sequential parse'
+
+                cache = BlockCache(f'{tmp_dir}/blocks-{n_tasks}-{depth}.sqlite3')
+                cached_fetcher = AsyncTreeFetcher(client=async_client, max_concurrency=concurrency, cache=cache, scheduler=None)
+                asyncio.run(cached_fetcher.fetch_tree(root, CACHE_VERSION))
+                cached_ms = time_call(lambda: asyncio.run(cached_fetcher.fetch_tree(root, CACHE_VERSION)), repeat)
+
+                evaluate_ms = time_call(lambda: evaluate_tree(TaskNode.from_dict(sequential_tree)), repeat)
+
+                print(f'{n_tasks:>6} {depth:>5} {sync_client.total_calls:>5} {sequential_ms:>11.1f} {concurrent_ms:>11.1f} {cached_ms:>8.2f} {evaluate_ms:>9.3f}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the Notion fetch and evaluation path offline')
+    parser.add_argument('--latency', type=float, default=0.05, help='Seconds per fake API call')
+    parser.add_argument('--jitter', type=float, default=0.0, help='Extra random seconds per fake API call')
+    parser.add_argument('--concurrency', type=int, default=3, help='Concurrency limit of the async fetcher')
+    parser.add_argument('--repeat', type=int, default=20, help='Runs per timing of the cheap stages')
+    parser.add_argument('--sizes', type=int, nargs='+', default=SIZES)
+    parser.add_argument('--depths', type=int, nargs='+', default=DEPTHS)
+    args = parser.parse_args()
+    run(args.latency, args.jitter, args.concurrency, args.repeat, args.sizes, args.depths)
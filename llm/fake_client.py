@@ -0,0 +1,125 @@
+import json
+import time
+import random
+import asyncio
+import threading
+from typing import Optional, List, Dict, Any, Callable
+
+from google.genai import errors, types
+
+# Gemini bills 258 tokens per 768px image tile, the fake counts every image as a single tile
+TOKENS_PER_IMAGE = 258
+
+
+def _text_parts(contents: List[Any]) -> List[str]:
+    return [part for part in contents if isinstance(part, str)]
+
+
+def count_images(contents: List[Any]) -> int:
+    return sum(1 for part in contents if not isinstance(part, str))
+
+
+def count_criteria(contents: List[Any]) -> int:
+    return sum(1 for part in _text_parts(contents) if part.startswith('Criteria'))
+
+
+def scripted_response(model: str, contents: List[Any], config: Any) -> str:
+    """
+    Answer shaped like the real model's for each request the checks make: batched image
+    verdicts, workout infos, note checks (PASS / FAIL) and single image checks (true / false)
+    """
+    system_prompt = getattr(config, 'system_instruction', None) or ''
+    if getattr(config, 'response_schema', None) is not None:
+        # batched verdicts, one per criteria part
+        return json.dumps([
+            {'index': i, 'passed': True, 'reason': 'Matches the criteria'} for i in range(count_criteria(contents))
+        ])
+    if 'workout' in system_prompt:
+        return json.dumps({
+            'date': time.strftime('%d/%m/%Y'),
+            'distance': '3.2 km',
+            'duration': '00:21:40',
+            'velocity': '8.9 km/h'
+        })
+    if any('"PASS"' in part for part in _text_parts(contents)):
+        return 'PASS'
+    return 'true'
+
+
+def estimate_usage(contents: List[Any], text: Optional[str]) -> types.GenerateContentResponseUsageMetadata:
+    """
+    Usage metadata shaped like the real one, about 4 characters per text token
+    """
+    text_tokens = sum(len(part) for part in _text_parts(contents)) // 4 + 1
+    image_tokens = TOKENS_PER_IMAGE * count_images(contents)
+    candidate_tokens = len(text or '') // 4 + 1
+    return types.GenerateContentResponseUsageMetadata(
+        prompt_token_count=text_tokens + image_tokens,
+        candidates_token_count=candidate_tokens,
+        total_token_count=text_tokens + image_tokens + candidate_tokens,
+        prompt_tokens_details=[
+            types.ModalityTokenCount(modality=types.MediaModality.TEXT, token_count=text_tokens),
+            types.ModalityTokenCount(modality=types.MediaModality.IMAGE, token_count=image_tokens),
+        ]
+    )
+
+
+class _Response:
+    def __init__(self, text: Optional[str], contents: List[Any]) -> None:
+        self.text = text
+        self.usage_metadata = estimate_usage(contents, text)
+
+
+class _Endpoint:
+    pass
+
+
+class FakeGeminiClient:
+    """
+    In-memory stand-in for genai.Client implementing models.generate_content and
+    aio.models.generate_content, with scripted answers and injectable latency and errors.
+    Counts every call per model.
+    """
+    def __init__(self, responder: Callable[[str, List[Any], Any], Optional[str]] = scripted_response, latency: float = 0.0,
+                 sigma: float = 0.0, error_rate: float = 0.0, seed: int = 0) -> None:
+        """
+        Args:
+            responder: Builds the answer text from (model, contents, config)
+            latency: Median seconds of a call
+            sigma: Spread of the log-normal latency distribution, 0 makes every call take exactly latency
+            error_rate: Probability that a call fails with a 503 server error
+        """
+        self.responder = responder
+        self.latency = latency
+        self.sigma = sigma
+        self.error_rate = error_rate
+        self.rng = random.Random(seed)
+        self.calls: Dict[str, int] = {}
+        self._lock = threading.Lock() # sync calls come from the resilience thread pool
+
+        self.models = _Endpoint()
+        self.models.generate_content = self._generate_content
+        self.aio = _Endpoint()
+        self.aio.models = _Endpoint()
+        self.aio.models.generate_content = self._agenerate_content
+
+    @property
+    def total_calls(self) -> int:
+        return sum(self.calls.values())
+
+    def _delay(self, model: str) -> float:
+        with self._lock:
+            self.calls[model] = self.calls.get(model, 0) + 1
+            failed = self.error_rate and self.rng.random() < self.error_rate
+            delay = self.latency * self.rng.lognormvariate(0, self.sigma) if self.sigma else self.latency
+        if failed:
+            raise errors.ServerError(503, {'error': {'code': 503, 'message': 'Unavailable (FakeGeminiClient)', 'status': 'UNAVAILABLE'}})
+        return delay
+
+    def _generate_content(self, model: str, contents: List[Any], config: Any = None) -> _Response:
+        time.sleep(self._delay(model))
+        return _Response(self.responder(model, contents, config), contents)
+
+    async def _agenerate_content(self, model: str, contents: List[Any], config: Any = None) -> _Response:
+        await asyncio.sleep(self._delay(model))
+        return _Response(self.responder(model, contents, config), contents)
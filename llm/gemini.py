@@ -1,31 +1,39 @@
 import os
 import pdb
+import time
+import asyncio
+from dataclasses import dataclass
+from typing import Optional, List, Tuple, Callable, Any
 from google import genai
 from google.genai import types
+from pydantic import BaseModel, TypeAdapter, ValidationError
 
-class GeminiProcessor:
-    def __init__(self) -> None:
-        api_key = os.getenv('GEMINI_API_KEY')
-        self.client = genai.Client(api_key=api_key)
-    
+from llm.response_cache import ResponseCache, llm_response_cache
+from llm.resilience import ResilientCaller, llm_resilience, LLM_DEFAULT_BUDGET_SECONDS, LLM_CHECK_BUDGETS
+from llm.instrumentation import CallRecorder, llm_call_recorder
 
-    def llm_request(self, system_prompt:str, user_prompt:str, images:list = []):
-        response = self.client.models.generate_content(
-            model="gemini-2.0-flash",
-            contents=[user_prompt] + images,
-            config=types.GenerateContentConfig(
-                temperature=0,
-                system_instruction=system_prompt
-            )
-        )
-        # with open('test.txt', 'w') as f:
-        #     f.write(user_prompt)
-        # pdb.set_trace()
-        return response.text
-    
+GEMINI_MODEL = os.getenv('GEMINI_MODEL', 'gemini-2.0-flash')
+GEMINI_MAX_CONCURRENCY = int(os.getenv('GEMINI_MAX_CONCURRENCY', 4))
+# Tried when the primary model fails or its circuit breaker is open, empty to disable
+GEMINI_FALLBACK_MODEL = os.getenv('GEMINI_FALLBACK_MODEL', '')
+# Abandoned (timed out or hedged) requests still end at the transport timeout
+GEMINI_HTTP_TIMEOUT_MS = int(1000 * max([LLM_DEFAULT_BUDGET_SECONDS] + list(LLM_CHECK_BUDGETS.values())))
 
-    def get_workout_info(self, image):
-        sys_prompt = """
+BATCH_VERDICT_PROMPT = """
+You're an expert image content analyzer.
+You will be provided with several numbered images, each followed by the criteria it must meet.
+Check every image against its own criteria only, ignoring the answer format the criteria ask for.
+Return one verdict per image, with the image index, whether it meets its criteria and a short reason.
+"""
+
+CRITERIA_VERDICT_PROMPT = """
+You're an expert image content analyzer.
+You will be provided with one image followed by several numbered criteria.
+Check the image against every criteria separately, ignoring the answer format the criteria ask for.
+Return one verdict per criteria, with the criteria index, whether the image meets it and a short reason.
+"""
+
+WORKOUT_INFO_PROMPT = """
 You're an expert in reading information from images.
 You will be provided with a screenshot that summarize a workout exercise. Your task is to extract all required information from the provided image and return it in this JSON format:
 {
@@ -36,6 +44,327 @@ You will be provided with a screenshot that summarize a workout exercise. Your t
 }
 Please respond ONLY with the JSON object, nothing else. Ensure that the JSON object is valid.
 """
+
+
+def is_false_verdict(response: Optional[str]) -> bool:
+    """
+    Check if a 'true' / 'false' classification answer is 'false', ignoring case, quotes and whitespace
+    """
+    return response is not None and response.strip().strip('"\'.').strip().lower() == 'false'
+
+
+def to_content(image: Any) -> Any:
+    """
+    Encoded images (e.g. media.preprocess.PreparedImage) are sent as is, the SDK would
+    re-encode a PIL image as PNG
+    """
+    data = getattr(image, 'data', None)
+    mime_type = getattr(image, 'mime_type', None)
+    if isinstance(data, (bytes, bytearray)) and mime_type:
+        return types.Part.from_bytes(data=bytes(data), mime_type=mime_type)
+    return image
+
+
+class ImageVerdict(BaseModel):
+    index: int
+    passed: bool
+    reason: str
+
+
+# the SDK only converts builtin generics, not typing.List
+VERDICTS_SCHEMA = list[ImageVerdict]
+_verdicts_adapter = TypeAdapter(VERDICTS_SCHEMA)
+
+
+def parse_verdicts(response: Optional[str], count: int) -> List[ImageVerdict]:
+    """
+    Parse a batched verdict answer into one verdict per image, in image order.
+
+    Raises:
+        ValueError: If the answer is not valid JSON for the schema or does not cover every image exactly once
+    """
+    if response is None:
+        raise ValueError('Empty verdict response')
+    try:
+        verdicts = _verdicts_adapter.validate_json(response)
+    except ValidationError as e:
+        raise ValueError(f'Invalid verdict response: {e}') from e
+    by_index = {verdict.index: verdict for verdict in verdicts}
+    if len(verdicts) != count or sorted(by_index) != list(range(count)):
+        raise ValueError(f'Expected verdicts for images 0..{count - 1}, got {[verdict.index for verdict in verdicts]}')
+    return [by_index[i] for i in range(count)]
+
+
+def build_batch_request(criteria: List[Tuple[str, Any]]) -> Tuple[str, list]:
+    """
+    Lay out (criteria, image) pairs as one prompt, each image followed by its criteria
+    """
+    user_prompt = f'Check these {len(criteria)} images, indexed from 0.'
+    parts = []
+    for i, (prompt, image) in enumerate(criteria):
+        parts.extend([f'Image {i}:', image, f'Criteria of image {i}:\n{prompt}'])
+    return user_prompt, parts
+
+
+def build_criteria_request(image: Any, prompts: List[str]) -> Tuple[str, list]:
+    """
+    Lay out one image and several criteria as one prompt, the image is sent once
+    """
+    user_prompt = f'Check this image against these {len(prompts)} criteria, indexed from 0.'
+    return user_prompt, [image] + [f'Criteria {i}:\n{prompt}' for i, prompt in enumerate(prompts)]
+
+
+def make_client() -> genai.Client:
+    return genai.Client(api_key=os.getenv('GEMINI_API_KEY'), http_options=types.HttpOptions(timeout=GEMINI_HTTP_TIMEOUT_MS))
+
+
+def make_config(system_prompt: Optional[str], response_schema: Optional[Any] = None) -> types.GenerateContentConfig:
+    if response_schema is None:
+        return types.GenerateContentConfig(temperature=0, system_instruction=system_prompt)
+    return types.GenerateContentConfig(
+        temperature=0,
+        system_instruction=system_prompt,
+        response_mime_type='application/json',
+        response_schema=response_schema
+    )
+
+
+@dataclass
+class ClassificationResult:
+    passed: bool
+    responses: List[Optional[str]] # None for requests cancelled after the first failure
+    failed_index: Optional[int] = None
+    verdicts: Optional[List[ImageVerdict]] = None # set by batched classifications
+
+
+class GeminiProcessor:
+    def __init__(self, client: Optional[Any] = None, cache: Optional[ResponseCache] = llm_response_cache,
+                 resilience: ResilientCaller = llm_resilience, recorder: CallRecorder = llm_call_recorder) -> None:
+        """
+        Args:
+            client: A genai.Client by default (e.g. a FakeGeminiClient for offline runs)
+            cache: Response cache, None to always call the model
+            resilience: Budgets, hedging and circuit breakers the calls go through
+            recorder: Where the tokens, bytes and wall time of every call are recorded
+        """
+        self.client = client if client is not None else make_client()
+        self.model = GEMINI_MODEL
+        self.fallback_model = GEMINI_FALLBACK_MODEL
+        self.cache = cache
+        self.resilience = resilience
+        self.recorder = recorder
+    
+
+    def llm_request(self, system_prompt:Optional[str] = None, user_prompt:str = '', images:list = [], use_cache:bool = True,
+                    response_schema:Optional[Any] = None, check_name:str = 'default'):
+        """
+        Send a prompt and images to the model. With temperature 0 the answer is deterministic enough
+        that identical requests are served from the response cache.
+        Text parts may be mixed in with the images, and a response_schema asks for a JSON answer of that type.
+        The call runs within the latency budget of check_name, and raises LLMUnavailableError past it.
+        """
+        start = time.perf_counter()
+        contents = [user_prompt] + [to_content(image) for image in images]
+        key = None
+        if use_cache and self.cache is not None:
+            key = self.cache.make_key(self.model, system_prompt, user_prompt, images, response_schema)
+            cached = self.cache.get(key)
+            if cached is not None:
+                self.recorder.record_call(check_name, system_prompt, user_prompt, contents, time.perf_counter() - start, cached=True)
+                return cached
+
+        config = make_config(system_prompt, response_schema)
+        try:
+            response, model = self.resilience.call(
+                lambda model: self.client.models.generate_content(model=model, contents=contents, config=config),
+                [self.model, self.fallback_model],
+                check_name
+            )
+        except Exception:
+            self.recorder.record_call(check_name, system_prompt, user_prompt, contents, time.perf_counter() - start, failed=True)
+            raise
+        self.recorder.record_call(check_name, system_prompt, user_prompt, contents, time.perf_counter() - start, model, response)
+        text = response.text
+        # with open('test.txt', 'w') as f:
+        #     f.write(user_prompt)
+        # pdb.set_trace()
+        # answers of the fallback model are not cached under the primary model's key
+        if key is not None and text is not None and model == self.model:
+            self.cache.put(key, text)
+        return text
+    
+
+    def get_workout_info(self, image):
         user_prompt = f'Please extract the information from this image'
-        result = self.llm_request(sys_prompt, user_prompt, [image])
-        return result
\ No newline at end of file
+        result = self.llm_request(WORKOUT_INFO_PROMPT, user_prompt, [image], check_name='workout')
+        return result
+
+
+class AsyncGeminiProcessor:
+    """
+    Async counterpart of GeminiProcessor built on the SDK's async client (client.aio),
+    sharing the same response cache
+    """
+    def __init__(self, client: Optional[Any] = None, cache: Optional[ResponseCache] = llm_response_cache,
+                 max_concurrency: int = GEMINI_MAX_CONCURRENCY, resilience: ResilientCaller = llm_resilience,
+                 recorder: CallRecorder = llm_call_recorder) -> None:
+        self._client = client
+        self._client_loop = None
+        self._owns_client = client is None
+        self.model = GEMINI_MODEL
+        self.fallback_model = GEMINI_FALLBACK_MODEL
+        self.cache = cache
+        self.max_concurrency = max_concurrency
+        self.resilience = resilience
+        self.recorder = recorder
+
+
+    def _get_client(self) -> Any:
+        # the async transport is bound to the event loop it was first used in, and every check runs its own loop
+        loop = asyncio.get_running_loop()
+        if self._owns_client and (self._client is None or self._client_loop is not loop):
+            self._client = make_client()
+            self._client_loop = loop
+        return self._client
+
+
+    async def llm_request(self, system_prompt:Optional[str] = None, user_prompt:str = '', images:list = [], use_cache:bool = True,
+                    response_schema:Optional[Any] = None, check_name:str = 'default'):
+        start = time.perf_counter()
+        contents = [user_prompt] + [to_content(image) for image in images]
+        key = None
+        if use_cache and self.cache is not None:
+            key = self.cache.make_key(self.model, system_prompt, user_prompt, images, response_schema)
+            cached = await asyncio.to_thread(self.cache.get, key)
+            if cached is not None:
+                self.recorder.record_call(check_name, system_prompt, user_prompt, contents, time.perf_counter() - start, cached=True)
+                return cached
+
+        client = self._get_client()
+        config = make_config(system_prompt, response_schema)
+
+        def generate(model: str):
+            return client.aio.models.generate_content(model=model, contents=contents, config=config)
+
+        try:
+            response, model = await self.resilience.acall(generate, [self.model, self.fallback_model], check_name)
+        except Exception:
+            self.recorder.record_call(check_name, system_prompt, user_prompt, contents, time.perf_counter() - start, failed=True)
+            raise
+        self.recorder.record_call(check_name, system_prompt, user_prompt, contents, time.perf_counter() - start, model, response)
+        text = response.text
+        if key is not None and text is not None and model == self.model:
+            await asyncio.to_thread(self.cache.put, key, text)
+        return text
+
+
+    async def classify_all(self, requests: List[Tuple[str, list]], is_failure: Callable[[Optional[str]], bool] = is_false_verdict,
+                           system_prompt: Optional[str] = None, check_name: str = 'default') -> ClassificationResult:
+        """
+        Run several (user prompt, images) classifications concurrently, at most max_concurrency at a time.
+        Stops at the first failing answer and cancels the requests still pending.
+
+        Args:
+            requests: (user prompt, images) pairs
+            is_failure: Tells if an answer fails the check
+            system_prompt: System prompt shared by every request
+            check_name: Latency budget and metrics bucket of every request
+
+        Returns:
+            Whether every answer passed, the answers in request order and the index of the first failure
+        """
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+
+        async def classify(prompt: str, images: list) -> Optional[str]:
+            async with semaphore:
+                return await self.llm_request(system_prompt=system_prompt, user_prompt=prompt, images=images, check_name=check_name)
+
+        tasks = [asyncio.ensure_future(classify(prompt, images)) for prompt, images in requests]
+        responses: List[Optional[str]] = [None] * len(tasks)
+        pending = set(tasks)
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    index = tasks.index(task)
+                    responses[index] = task.result()
+                    if is_failure(responses[index]):
+                        return ClassificationResult(passed=False, responses=responses, failed_index=index)
+            return ClassificationResult(passed=True, responses=responses)
+        finally:
+            for task in pending:
+                task.cancel()
+            if pending:
+                await asyncio.gather(*pending, return_exceptions=True)
+
+
+    async def classify_batch(self, criteria: List[Tuple[str, Any]], fallback: bool = True,
+                             check_name: str = 'default') -> ClassificationResult:
+        """
+        Classify several images in a single request, each against its own criteria, with a typed verdict per image.
+        If the answer does not match the schema, falls back to one classify_all request per image.
+
+        Args:
+            criteria: (criteria prompt, image) pairs
+            fallback: Whether to fall back to the per-call path on a malformed answer
+            check_name: Latency budget and metrics bucket of the requests
+
+        Returns:
+            Whether every image passed, 'true' / 'false' answers in image order, the first failure and the verdicts
+        """
+        user_prompt, parts = build_batch_request(criteria)
+        return await self._classify_verdicts(
+            BATCH_VERDICT_PROMPT, user_prompt, parts, [(prompt, [image]) for prompt, image in criteria], fallback, check_name
+        )
+
+
+    async def classify_image(self, image: Any, prompts: List[str], fallback: bool = True,
+                             check_name: str = 'default') -> ClassificationResult:
+        """
+        Check one image against several criteria in a single request, with a typed verdict per criteria.
+        Unlike classify_batch, a failing criteria does not stop the others on the per-call fallback.
+
+        Args:
+            image: The image to check
+            prompts: Criteria prompts
+            fallback: Whether to fall back to the per-call path on a malformed answer
+            check_name: Latency budget and metrics bucket of the requests
+
+        Returns:
+            Whether every criteria passed, 'true' / 'false' answers in criteria order, the first failure and the verdicts
+        """
+        user_prompt, parts = build_criteria_request(image, prompts)
+        return await self._classify_verdicts(
+            CRITERIA_VERDICT_PROMPT, user_prompt, parts, [(prompt, [image]) for prompt in prompts], fallback, check_name,
+            is_failure=lambda response: False
+        )
+
+
+    async def get_workout_info(self, image, check_name: str = 'workout') -> Optional[str]:
+        user_prompt = f'Please extract the information from this image'
+        return await self.llm_request(WORKOUT_INFO_PROMPT, user_prompt, [image], check_name=check_name)
+
+
+    async def _classify_verdicts(self, system_prompt: str, user_prompt: str, parts: list, requests: List[Tuple[str, list]],
+                                 fallback: bool, check_name: str,
+                                 is_failure: Callable[[Optional[str]], bool] = is_false_verdict) -> ClassificationResult:
+        try:
+            response = await self.llm_request(system_prompt, user_prompt, parts, response_schema=VERDICTS_SCHEMA,
+                                              check_name=check_name)
+            verdicts = parse_verdicts(response, len(requests))
+        except ValueError as e:
+            if not fallback:
+                raise
+            print(f'Batched verdicts failed, falling back to one request each: {e}')
+            result = await self.classify_all(requests, is_failure=is_failure, check_name=check_name)
+            # is_failure only decides when to stop, the verdicts are still 'true' / 'false' answers
+            failed = [i for i, response in enumerate(result.responses) if is_false_verdict(response)]
+            return ClassificationResult(passed=not failed, responses=result.responses, failed_index=failed[0] if failed else None)
+
+        failed = [verdict.index for verdict in verdicts if not verdict.passed]
+        return ClassificationResult(
+            passed=not failed,
+            responses=[str(verdict.passed).lower() for verdict in verdicts],
+            failed_index=failed[0] if failed else None,
+            verdicts=verdicts
+        )
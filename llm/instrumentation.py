@@ -0,0 +1,196 @@
+import os
+import time
+import hashlib
+import threading
+from collections import deque
+from dataclasses import dataclass, field, asdict
+from typing import Optional, List, Dict, Any, Tuple
+
+from logger import logger
+
+
+# Calls older than the window, or beyond the most recent LLM_METRICS_MAX_CALLS, are dropped
+LLM_METRICS_WINDOW_SECONDS = int(os.getenv('LLM_METRICS_WINDOW_SECONDS', 7 * 24 * 3600))
+LLM_METRICS_MAX_CALLS = int(os.getenv('LLM_METRICS_MAX_CALLS', 20000))
+
+# Upper bounds of the histogram buckets of every measured field, the last bucket is unbounded
+HISTOGRAM_BUCKETS = {
+    'wall_seconds': [0.25, 0.5, 1, 2, 4, 8, 15, 30, 60],
+    'prompt_tokens': [128, 256, 512, 1024, 2048, 4096, 8192, 16384],
+    'candidate_tokens': [8, 32, 128, 512, 2048],
+    'image_tokens': [258, 516, 1032, 2064, 4128],
+    'request_bytes': [4 << 10, 64 << 10, 256 << 10, 1 << 20, 4 << 20, 16 << 20],
+}
+
+
+@dataclass
+class CallRecord:
+    check_name: str
+    model: Optional[str] # None for calls served from the response cache
+    prompt_id: str
+    prompt_preview: str
+    wall_seconds: float
+    prompt_tokens: int = 0
+    candidate_tokens: int = 0
+    image_tokens: int = 0
+    request_bytes: int = 0
+    cached: bool = False
+    failed: bool = False
+    timestamp: float = field(default_factory=time.time)
+
+
+def content_bytes(contents: List[Any]) -> int:
+    """
+    Bytes of the text and inline image parts of a request, PIL images are not counted
+    """
+    total = 0
+    for part in contents:
+        if isinstance(part, str):
+            total += len(part.encode())
+            continue
+        data = getattr(getattr(part, 'inline_data', None), 'data', None)
+        if isinstance(data, (bytes, bytearray)):
+            total += len(data)
+    return total
+
+
+def read_usage(response: Any) -> Tuple[int, int, int]:
+    """
+    (prompt, candidate, image) token counts of a generate_content response, zeros when missing
+    """
+    usage = getattr(response, 'usage_metadata', None)
+    if usage is None:
+        return 0, 0, 0
+    image_tokens = 0
+    for detail in getattr(usage, 'prompt_tokens_details', None) or []:
+        modality = getattr(detail, 'modality', None)
+        if getattr(modality, 'value', modality) == 'IMAGE':
+            image_tokens += detail.token_count or 0
+    return usage.prompt_token_count or 0, usage.candidates_token_count or 0, image_tokens
+
+
+def prompt_fingerprint(system_prompt: Optional[str], user_prompt: str) -> Tuple[str, str]:
+    """
+    Short id and readable preview of a prompt, calls with the same prompts share the id
+    """
+    text = f'{system_prompt or ""}\0{user_prompt}'
+    preview = ' '.join((system_prompt or user_prompt).split())[:80]
+    return hashlib.sha256(text.encode()).hexdigest()[:12], preview
+
+
+def histogram(values: List[float], bounds: List[float]) -> Dict[str, Any]:
+    if not values:
+        return {'count': 0}
+    values = sorted(values)
+    counts = [0] * (len(bounds) + 1)
+    for value in values:
+        counts[next((i for i, bound in enumerate(bounds) if value <= bound), len(bounds))] += 1
+
+    def percentile(p: float) -> float:
+        return values[min(len(values) - 1, int(p * len(values)))]
+
+    return {
+        'count': len(values),
+        'sum': sum(values),
+        'mean': sum(values) / len(values),
+        'p50': percentile(0.5),
+        'p95': percentile(0.95),
+        'p99': percentile(0.99),
+        'max': values[-1],
+        'buckets': [{'le': bound, 'count': count} for bound, count in zip(bounds + ['inf'], counts)],
+    }
+
+
+class CallRecorder:
+    """
+    Rolling record of every LLM call: tokens, request bytes, wall time and the calling check.
+    Aggregated into per-check histograms on demand, and logged one structured line per call.
+    """
+    def __init__(self, window_seconds: int = LLM_METRICS_WINDOW_SECONDS, max_calls: int = LLM_METRICS_MAX_CALLS) -> None:
+        self.window_seconds = window_seconds
+        self._records = deque(maxlen=max_calls)
+        self._lock = threading.Lock()
+
+
+    def record_call(self, check_name: str, system_prompt: Optional[str], user_prompt: str, contents: List[Any],
+                    wall_seconds: float, model: Optional[str] = None, response: Any = None,
+                    cached: bool = False, failed: bool = False) -> CallRecord:
+        """
+        Record one llm_request. Nothing is sent for cached calls, so they carry no tokens or bytes.
+        """
+        prompt_id, preview = prompt_fingerprint(system_prompt, user_prompt)
+        prompt_tokens, candidate_tokens, image_tokens = read_usage(response)
+        record = CallRecord(
+            check_name=check_name,
+            model=model,
+            prompt_id=prompt_id,
+            prompt_preview=preview,
+            wall_seconds=wall_seconds,
+            prompt_tokens=prompt_tokens,
+            candidate_tokens=candidate_tokens,
+            image_tokens=image_tokens,
+            request_bytes=0 if cached else content_bytes(contents),
+            cached=cached,
+            failed=failed
+        )
+        with self._lock:
+            self._records.append(record)
+        logger.info(f"LLM call: {check_name} {'cached' if cached else model} {wall_seconds:.2f}s", **asdict(record))
+        return record
+
+
+    def get_records(self, check_name: Optional[str] = None, window_seconds: Optional[int] = None) -> List[CallRecord]:
+        since = time.time() - min(window_seconds or self.window_seconds, self.window_seconds)
+        with self._lock:
+            return [record for record in self._records
+                    if record.timestamp >= since and (check_name is None or record.check_name == check_name)]
+
+
+    def get_stats(self, check_name: Optional[str] = None, window_seconds: Optional[int] = None) -> Dict[str, Any]:
+        """
+        Per-check call counts, token totals and histograms of every measured field
+        """
+        by_check: Dict[str, List[CallRecord]] = {}
+        for record in self.get_records(check_name, window_seconds):
+            by_check.setdefault(record.check_name, []).append(record)
+
+        checks = {}
+        for name, records in by_check.items():
+            sent = [record for record in records if not record.cached and not record.failed]
+            checks[name] = {
+                'calls': len(records),
+                'cached': sum(record.cached for record in records),
+                'failed': sum(record.failed for record in records),
+                'prompt_tokens': sum(record.prompt_tokens for record in sent),
+                'candidate_tokens': sum(record.candidate_tokens for record in sent),
+                'image_tokens': sum(record.image_tokens for record in sent),
+                'request_bytes': sum(record.request_bytes for record in sent),
+                'histograms': {
+                    field_name: histogram([getattr(record, field_name) for record in (records if field_name == 'wall_seconds' else sent)], bounds)
+                    for field_name, bounds in HISTOGRAM_BUCKETS.items()
+                },
+            }
+        return {'window_seconds': window_seconds or self.window_seconds, 'checks': checks}
+
+
+    def top_prompts(self, limit: int = 10, by: str = 'prompt_tokens', window_seconds: Optional[int] = None) -> List[Dict[str, Any]]:
+        """
+        The prompts with the highest total of a field (prompt_tokens, candidate_tokens, image_tokens,
+        request_bytes or wall_seconds) over the window
+        """
+        prompts: Dict[str, Dict[str, Any]] = {}
+        for record in self.get_records(window_seconds=window_seconds):
+            prompt = prompts.setdefault(record.prompt_id, {
+                'prompt_id': record.prompt_id,
+                'preview': record.prompt_preview,
+                'check_name': record.check_name,
+                'calls': 0,
+                by: 0,
+            })
+            prompt['calls'] += 1
+            prompt[by] += getattr(record, by)
+        return sorted(prompts.values(), key=lambda prompt: prompt[by], reverse=True)[:limit]
+
+
+# Shared by every Gemini processor in the process
+llm_call_recorder = CallRecorder()
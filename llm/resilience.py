@@ -0,0 +1,365 @@
+import os
+import time
+import asyncio
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import Optional, List, Dict, Any, Callable, Awaitable, Tuple, TypeVar
+
+from logger import logger
+
+
+T = TypeVar('T')
+
+# Seconds a whole LLM call may take per check, fallback model included. LLM_BUDGET_<CHECK> overrides one check.
+LLM_DEFAULT_BUDGET_SECONDS = float(os.getenv('LLM_DEFAULT_BUDGET_SECONDS', 60))
+LLM_CHECK_BUDGETS = {
+    'morning_images': 90.0, # every morning image in one request
+    'workout': 45.0,
+    'task_content': 30.0,
+}
+# A duplicate request is sent once the first one is slower than this percentile of recent latencies
+LLM_HEDGE_PERCENTILE = float(os.getenv('LLM_HEDGE_PERCENTILE', 0.95))
+LLM_HEDGE_MIN_SAMPLES = int(os.getenv('LLM_HEDGE_MIN_SAMPLES', 20))
+LLM_HEDGE_DEFAULT_DELAY = float(os.getenv('LLM_HEDGE_DEFAULT_DELAY', 15)) # until enough latencies are recorded
+LLM_HEDGE_MIN_DELAY = float(os.getenv('LLM_HEDGE_MIN_DELAY', 1))
+LLM_HEDGE_ENABLED = os.getenv('LLM_HEDGE_ENABLED', 'true').lower() == 'true'
+LLM_BREAKER_FAILURES = int(os.getenv('LLM_BREAKER_FAILURES', 5))
+LLM_BREAKER_RESET_SECONDS = float(os.getenv('LLM_BREAKER_RESET_SECONDS', 60))
+LLM_MAX_WORKERS = int(os.getenv('LLM_MAX_WORKERS', 8))
+
+
+class LLMUnavailableError(Exception):
+    """No model answered within the check's budget"""
+
+
+class LLMTimeoutError(LLMUnavailableError):
+    pass
+
+
+class CircuitOpenError(LLMUnavailableError):
+    pass
+
+
+def get_budget(check_name: str) -> float:
+    value = os.getenv(f'LLM_BUDGET_{check_name.upper()}')
+    if value is not None:
+        return float(value)
+    return LLM_CHECK_BUDGETS.get(check_name, LLM_DEFAULT_BUDGET_SECONDS)
+
+
+class LatencyTracker:
+    """
+    Rolling window of the latencies of successful calls
+    """
+    def __init__(self, window: int = 200) -> None:
+        self._samples = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def record(self, seconds: float) -> None:
+        with self._lock:
+            self._samples.append(seconds)
+
+    def __len__(self) -> int:
+        return len(self._samples)
+
+    def percentile(self, p: float) -> Optional[float]:
+        with self._lock:
+            samples = sorted(self._samples)
+        if not samples:
+            return None
+        return samples[min(len(samples) - 1, int(p * len(samples)))]
+
+
+class CircuitBreaker:
+    """
+    Opens after failure_threshold consecutive failures and rejects calls for reset_seconds,
+    then lets a single trial call through: a success closes it, a failure opens it again.
+    A trial that never reports back (cancelled, or lost) is replaced by another one after reset_seconds.
+    """
+    def __init__(self, failure_threshold: int = LLM_BREAKER_FAILURES, reset_seconds: float = LLM_BREAKER_RESET_SECONDS) -> None:
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.state = 'closed'
+        self.trips = 0
+        self._failures = 0
+        self._opened_at = 0.0
+        self._trial_at = 0.0
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.state == 'closed':
+                return True
+            now = time.monotonic()
+            if (self.state == 'open' and now - self._opened_at >= self.reset_seconds) or (
+                self.state == 'half_open' and now - self._trial_at >= self.reset_seconds
+            ):
+                self.state = 'half_open'
+                self._trial_at = now
+                return True
+            return False # open, or half open with the trial call in flight
+
+    def release_trial(self) -> None:
+        """
+        Give up the trial call without an outcome (e.g. it was cancelled), the next call becomes the trial
+        """
+        with self._lock:
+            if self.state == 'half_open':
+                self.state = 'open'
+
+    def record_success(self) -> None:
+        with self._lock:
+            self.state = 'closed'
+            self._failures = 0
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self._failures += 1
+            if self.state == 'half_open' or self._failures >= self.failure_threshold:
+                if self.state != 'open':
+                    self.trips += 1
+                    logger.warning(f"LLM circuit breaker opened after {self._failures} failures")
+                self.state = 'open'
+                self._opened_at = time.monotonic()
+
+
+class ResilientCaller:
+    """
+    Runs LLM calls within a per-check latency budget. A slow call is hedged with a duplicate
+    request, each model has its own circuit breaker, and a fallback model is tried when the
+    primary one fails or its breaker is open. Outcomes are counted per check.
+    """
+    def __init__(self, max_workers: int = LLM_MAX_WORKERS, hedge_enabled: bool = LLM_HEDGE_ENABLED) -> None:
+        self.hedge_enabled = hedge_enabled
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='llm')
+        self._breakers: Dict[str, CircuitBreaker] = {}
+        self._latencies: Dict[str, LatencyTracker] = {}
+        self._counters: Dict[str, Dict[str, int]] = {}
+        self._lock = threading.Lock()
+
+
+    def _breaker(self, model: str) -> CircuitBreaker:
+        with self._lock:
+            return self._breakers.setdefault(model, CircuitBreaker())
+
+
+    def _tracker(self, model: str) -> LatencyTracker:
+        with self._lock:
+            return self._latencies.setdefault(model, LatencyTracker())
+
+
+    def _count(self, check_name: str, outcome: str) -> None:
+        with self._lock:
+            counters = self._counters.setdefault(check_name, {})
+            counters[outcome] = counters.get(outcome, 0) + 1
+
+
+    def hedge_delay(self, model: str) -> float:
+        if not self.hedge_enabled:
+            return float('inf')
+        tracker = self._tracker(model)
+        if len(tracker) < LLM_HEDGE_MIN_SAMPLES:
+            return LLM_HEDGE_DEFAULT_DELAY
+        return max(LLM_HEDGE_MIN_DELAY, tracker.percentile(LLM_HEDGE_PERCENTILE))
+
+
+    def _on_result(self, model: str, check_name: str, started_at: float, hedged: bool) -> None:
+        self._tracker(model).record(time.monotonic() - started_at)
+        self._count(check_name, 'hedge_wins' if hedged else 'successes')
+
+
+    def _call_hedged(self, func: Callable[[str], T], model: str, budget: float, check_name: str) -> T:
+        start = time.monotonic()
+        deadline = start + budget
+        hedge_at = start + self.hedge_delay(model)
+        futures = {self._executor.submit(func, model): (start, False)}
+        pending = set(futures)
+        error = None
+        # losing or timed out requests cannot be interrupted, they finish in the background
+        while pending:
+            now = time.monotonic()
+            timeout = deadline - now
+            if len(futures) == 1:
+                timeout = min(timeout, hedge_at - now)
+            done, pending = wait(pending, timeout=max(timeout, 0), return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    self._on_result(model, check_name, *futures[future])
+                    return future.result()
+                error = future.exception()
+            if not pending:
+                break
+            now = time.monotonic()
+            if now >= deadline:
+                raise LLMTimeoutError(f'{model} did not answer within {budget:.1f}s')
+            if len(futures) == 1 and now >= hedge_at:
+                self._count(check_name, 'hedges')
+                hedge = self._executor.submit(func, model)
+                futures[hedge] = (now, True)
+                pending.add(hedge)
+        raise error
+
+
+    async def _acall_hedged(self, func: Callable[[str], Awaitable[T]], model: str, budget: float, check_name: str) -> T:
+        start = time.monotonic()
+        deadline = start + budget
+        hedge_at = start + self.hedge_delay(model)
+        tasks = {asyncio.ensure_future(func(model)): (start, False)}
+        pending = set(tasks)
+        error = None
+        try:
+            while pending:
+                now = time.monotonic()
+                timeout = deadline - now
+                if len(tasks) == 1:
+                    timeout = min(timeout, hedge_at - now)
+                done, pending = await asyncio.wait(pending, timeout=max(timeout, 0), return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        self._on_result(model, check_name, *tasks[task])
+                        return task.result()
+                    error = task.exception()
+                if not pending:
+                    break
+                now = time.monotonic()
+                if now >= deadline:
+                    raise LLMTimeoutError(f'{model} did not answer within {budget:.1f}s')
+                if len(tasks) == 1 and now >= hedge_at:
+                    self._count(check_name, 'hedges')
+                    hedge = asyncio.ensure_future(func(model))
+                    tasks[hedge] = (now, True)
+                    pending.add(hedge)
+            raise error
+        finally:
+            for task in pending:
+                task.cancel()
+            if pending:
+                await asyncio.gather(*pending, return_exceptions=True)
+
+
+    def _candidates(self, models: List[Optional[str]]) -> List[str]:
+        return list(dict.fromkeys(model for model in models if model))
+
+
+    def _allow(self, model: str, check_name: str) -> bool:
+        # asked right before the call, a half open breaker lets its single trial through
+        if self._breaker(model).allow():
+            return True
+        self._count(check_name, 'breaker_open')
+        return False
+
+
+    def _on_failure(self, model: str, check_name: str, e: Exception) -> None:
+        self._breaker(model).record_failure()
+        self._count(check_name, 'timeouts' if isinstance(e, LLMTimeoutError) else 'errors')
+        logger.warning(f"LLM call of {check_name} on {model} failed: {str(e)}")
+
+
+    def call(self, func: Callable[[str], T], models: List[Optional[str]], check_name: str = 'default',
+             budget: Optional[float] = None) -> Tuple[T, str]:
+        """
+        Call func(model) on the first model that answers within the check's budget.
+
+        Args:
+            func: Makes the request to the given model
+            models: The primary model then the fallbacks, empty entries are skipped
+            check_name: Selects the budget and the metrics bucket
+            budget: Seconds for the whole call, defaults to the check's budget
+
+        Returns:
+            The answer and the model that gave it
+
+        Raises:
+            LLMUnavailableError: If the budget ran out, every breaker is open or every model failed
+        """
+        budget = get_budget(check_name) if budget is None else budget
+        deadline = time.monotonic() + budget
+        error: Optional[Exception] = None
+        attempted = False
+        for model in self._candidates(models):
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            if not self._allow(model, check_name):
+                continue
+            attempted = True
+            try:
+                result = self._call_hedged(func, model, remaining, check_name)
+            except Exception as e:
+                self._on_failure(model, check_name, e)
+                error = e
+                continue
+            except BaseException:
+                self._breaker(model).release_trial()
+                raise
+            self._breaker(model).record_success()
+            if model != models[0]:
+                self._count(check_name, 'fallbacks')
+            return result, model
+        return self._raise_unavailable(attempted, check_name, error)
+
+
+    async def acall(self, func: Callable[[str], Awaitable[T]], models: List[Optional[str]], check_name: str = 'default',
+                    budget: Optional[float] = None) -> Tuple[T, str]:
+        """
+        Async version of call, func(model) returns an awaitable
+        """
+        budget = get_budget(check_name) if budget is None else budget
+        deadline = time.monotonic() + budget
+        error: Optional[Exception] = None
+        attempted = False
+        for model in self._candidates(models):
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            if not self._allow(model, check_name):
+                continue
+            attempted = True
+            try:
+                result = await self._acall_hedged(func, model, remaining, check_name)
+            except Exception as e:
+                self._on_failure(model, check_name, e)
+                error = e
+                continue
+            except BaseException:
+                # cancelled, a half open breaker must not wait forever for this trial
+                self._breaker(model).release_trial()
+                raise
+            self._breaker(model).record_success()
+            if model != models[0]:
+                self._count(check_name, 'fallbacks')
+            return result, model
+        return self._raise_unavailable(attempted, check_name, error)
+
+
+    def _raise_unavailable(self, attempted: bool, check_name: str, error: Optional[Exception]):
+        if not attempted:
+            raise CircuitOpenError(f'Circuit breaker open for every model of {check_name}')
+        if isinstance(error, LLMUnavailableError):
+            raise error
+        raise LLMUnavailableError(f'Every model failed for {check_name}: {str(error)}') from error
+
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            checks = {name: dict(counters) for name, counters in self._counters.items()}
+            models = list(self._breakers)
+        return {
+            'checks': {name: dict(counters, budget_seconds=get_budget(name)) for name, counters in checks.items()},
+            'models': {
+                model: {
+                    'breaker': self._breaker(model).state,
+                    'breaker_trips': self._breaker(model).trips,
+                    'samples': len(self._tracker(model)),
+                    'p50_seconds': self._tracker(model).percentile(0.5),
+                    'p95_seconds': self._tracker(model).percentile(0.95),
+                    'hedge_delay_seconds': self.hedge_delay(model) if self.hedge_enabled else None,
+                }
+                for model in models
+            },
+        }
+
+
+# Shared by every Gemini processor in the process
+llm_resilience = ResilientCaller()
@@ -0,0 +1,134 @@
+import os
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Optional, List, Any, Dict
+
+from PIL import Image
+
+from storage import data_path, sqlite_connection
+
+
+LLM_CACHE_TTL_SECONDS = int(os.getenv('LLM_CACHE_TTL_SECONDS', 24 * 3600))
+LLM_CACHE_MEMORY_ENTRIES = int(os.getenv('LLM_CACHE_MEMORY_ENTRIES', 256)) # 0 disables the in-memory layer
+LLM_CACHE_DISK_ENTRIES = int(os.getenv('LLM_CACHE_DISK_ENTRIES', 5000))
+
+
+def hash_image(image: Any) -> bytes:
+    """
+    Digest of an image passed to the model: raw bytes as is, PIL images by mode, size and pixels
+    """
+    if isinstance(image, str): # text parts laid out between images
+        return hashlib.sha256(b'text:' + image.encode()).digest()
+    if isinstance(image, (bytes, bytearray)):
+        return hashlib.sha256(image).digest()
+    if isinstance(image, Image.Image):
+        h = hashlib.sha256(f'{image.mode}:{image.size}'.encode())
+        h.update(image.tobytes())
+        return h.digest()
+    # encoded images (e.g. a PreparedImage) or a types.Part holding inline bytes
+    data = getattr(image, 'data', None)
+    if data is None:
+        data = getattr(getattr(image, 'inline_data', None), 'data', None)
+    if isinstance(data, (bytes, bytearray)):
+        return hashlib.sha256(data).digest()
+    return hashlib.sha256(repr(image).encode()).digest()
+
+
+class ResponseCache:
+    """
+    Content-addressed cache of model responses, keyed by a hash of the model, the prompts and the image contents.
+    An in-memory LRU sits in front of an SQLite store, both expire entries after a TTL.
+    """
+    def __init__(self, path: Optional[str] = None, ttl_seconds: int = LLM_CACHE_TTL_SECONDS,
+                 memory_entries: int = LLM_CACHE_MEMORY_ENTRIES, disk_entries: int = LLM_CACHE_DISK_ENTRIES) -> None:
+        self.path = path or data_path('llm_cache.sqlite3')
+        self.ttl_seconds = ttl_seconds
+        self.memory_entries = memory_entries
+        self.disk_entries = disk_entries
+        self._memory: 'OrderedDict[str, tuple]' = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {'memory_hits': 0, 'disk_hits': 0, 'misses': 0}
+        with sqlite_connection(self.path) as conn:
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS responses ('
+                'key TEXT PRIMARY KEY, response TEXT NOT NULL, created_at REAL NOT NULL, accessed_at REAL NOT NULL)'
+            )
+            conn.execute('CREATE INDEX IF NOT EXISTS responses_accessed_at ON responses (accessed_at)')
+
+
+    def make_key(self, model: str, system_prompt: Optional[str], user_prompt: str, images: List[Any],
+                 response_schema: Optional[Any] = None) -> str:
+        h = hashlib.sha256()
+        for part in (model, system_prompt or '', user_prompt):
+            h.update(part.encode())
+            h.update(b'\0')
+        for image in images:
+            h.update(hash_image(image))
+        if response_schema is not None:
+            h.update(repr(response_schema).encode())
+        return h.hexdigest()
+
+
+    def get(self, key: str) -> Optional[str]:
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None and now - entry[1] <= self.ttl_seconds:
+                self._memory.move_to_end(key)
+                self._stats['memory_hits'] += 1
+                return entry[0]
+
+        with sqlite_connection(self.path) as conn:
+            row = conn.execute(
+                'SELECT response, created_at FROM responses WHERE key = ? AND created_at >= ?', (key, now - self.ttl_seconds)
+            ).fetchone()
+            if row is not None:
+                conn.execute('UPDATE responses SET accessed_at = ? WHERE key = ?', (now, key))
+
+        with self._lock:
+            if row is None:
+                self._stats['misses'] += 1
+                return None
+            self._stats['disk_hits'] += 1
+            self._remember(key, row[0], row[1])
+        return row[0]
+
+
+    def put(self, key: str, response: str) -> None:
+        now = time.time()
+        with self._lock:
+            self._remember(key, response, now)
+        with sqlite_connection(self.path) as conn:
+            conn.execute(
+                'INSERT OR REPLACE INTO responses (key, response, created_at, accessed_at) VALUES (?, ?, ?, ?)',
+                (key, response, now, now)
+            )
+            # expire old entries and keep only the most recently used ones
+            conn.execute('DELETE FROM responses WHERE created_at < ?', (now - self.ttl_seconds,))
+            conn.execute(
+                'DELETE FROM responses WHERE key NOT IN (SELECT key FROM responses ORDER BY accessed_at DESC LIMIT ?)',
+                (self.disk_entries,)
+            )
+
+
+    def _remember(self, key: str, response: str, created_at: float) -> None:
+        if self.memory_entries <= 0:
+            return
+        self._memory[key] = (response, created_at)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self._stats, memory_entries=len(self._memory))
+        lookups = stats['memory_hits'] + stats['disk_hits'] + stats['misses']
+        stats['hit_rate'] = (stats['memory_hits'] + stats['disk_hits']) / lookups if lookups else 0.0
+        return stats
+
+
+# Shared by every GeminiProcessor in the process
+llm_response_cache = ResponseCache()
@@ -0,0 +1,123 @@
+import os
+import time
+import heapq
+import asyncio
+from dataclasses import dataclass
+from datetime import datetime, date
+from typing import Optional, List, Dict, Any
+
+from logger import logger
+from llm.resilience import LLMUnavailableError
+from media.pipeline import MediaPipeline, BANGKOK_TZ
+from media.store import MediaResult
+from utils import TaskCheckResponse, check_and_punish
+
+# A source slower than this is left out of the collected evidence, and fails the morning check
+EVIDENCE_SOURCE_TIMEOUT = int(os.getenv('EVIDENCE_SOURCE_TIMEOUT', 120))
+
+
+@dataclass
+class Evidence:
+    """
+    One message received by a source, with the result of its image if it has one
+    """
+    source: str # e.g. 'telegram', 'slack'
+    message_id: str
+    sent_at: datetime # timezone-aware
+    text: Optional[str] = None
+    media: Optional[MediaResult] = None
+
+
+class EvidenceCollector:
+    """
+    Collects the evidence of a day from every source at the same time and merges it by time.
+    A source is any object with a name and an async collect(day) returning its Evidence.
+    """
+    def __init__(self, sources: List[Any], pipeline: Optional[MediaPipeline] = None, timeout: float = EVIDENCE_SOURCE_TIMEOUT) -> None:
+        """
+        Args:
+            sources: The evidence sources, e.g. a TelegramProcessor and a SlackBot
+            pipeline: Judges the morning images, the first source's pipeline by default
+            timeout: Seconds a source is waited for
+        """
+        self.sources = sources
+        self.pipeline = pipeline if pipeline is not None else sources[0].pipeline
+        self.timeout = timeout
+        self._stats: Dict[str, Dict[str, Any]] = {
+            source.name: {'collections': 0, 'errors': 0, 'last_seconds': None, 'last_count': None} for source in sources
+        }
+
+
+    async def _collect_source(self, source: Any, day: date, strict: bool = False) -> List[Evidence]:
+        stats = self._stats[source.name]
+        start = time.perf_counter()
+        try:
+            evidence = await asyncio.wait_for(source.collect(day), self.timeout)
+        except LLMUnavailableError:
+            stats['errors'] += 1
+            raise
+        except Exception as e:
+            stats['errors'] += 1
+            logger.error(f"Error collecting {source.name} evidence of {day}: {str(e)}")
+            if strict:
+                raise
+            # the other sources still count
+            return []
+        stats['collections'] += 1
+        stats['last_seconds'] = round(time.perf_counter() - start, 3)
+        stats['last_count'] = len(evidence)
+        return sorted(evidence, key=lambda item: item.sent_at)
+
+
+    async def collect(self, day: Optional[date] = None, strict: bool = False) -> List[Evidence]:
+        """
+        Evidence of a local (Bangkok) day from every source, oldest first. The sources are queried
+        concurrently, so the slowest source alone sets the collection time.
+
+        Args:
+            day: Local day, today by default
+            strict: Raise when a source fails or times out instead of leaving its evidence out
+
+        Raises:
+            LLMUnavailableError: A source could not evaluate its images
+        """
+        day = day or datetime.now(BANGKOK_TZ).date()
+        collected = await asyncio.gather(*(self._collect_source(source, day, strict) for source in self.sources), return_exceptions=True)
+        for evidence in collected:
+            if isinstance(evidence, BaseException):
+                raise evidence
+        return list(heapq.merge(*collected, key=lambda item: item.sent_at))
+
+
+    async def check_morning_images(self) -> TaskCheckResponse:
+        today = datetime.now(BANGKOK_TZ).date()
+        try:
+            # a missing source could hide the morning images, so it fails the check rather than the task
+            evidence = await self.collect(today, strict=True)
+        except LLMUnavailableError as e:
+            return TaskCheckResponse(result='PASS', message=f'Could not classify images: {str(e)}', status='FAIL')
+        except Exception as e:
+            return TaskCheckResponse(result='PASS', message=f'Could not collect evidence: {str(e)}', status='FAIL')
+
+        # the last messages of the day on a source are its morning images, one per criteria in order,
+        # the task is done when they are all sent on one of the sources
+        responses = []
+        for source in self.sources:
+            last = [item for item in evidence if item.source == source.name][-len(self.pipeline.morning_prompts):]
+            for item in last:
+                if item.text:
+                    logger.info(f"Text ({item.source}): {item.text}")
+            response = self.pipeline.judge_morning_images([item.media for item in last if item.media is not None], today)
+            if response.result == 'PASS':
+                return response
+            responses.append(response)
+        return responses[0]
+
+
+    @check_and_punish('check_morning_images')
+    def sync_check_morning_images(self):
+        return asyncio.run(self.check_morning_images())
+
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {name: dict(stats) for name, stats in self._stats.items()}
@@ -0,0 +1,343 @@
+import io
+import struct
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from typing import Optional, Union, Dict, Any, BinaryIO, Tuple, List
+
+from logger import logger
+
+
+# TIFF tags read from the EXIF block
+TAG_MAKE = 0x010F
+TAG_MODEL = 0x0110
+TAG_ORIENTATION = 0x0112
+TAG_EXIF_IFD = 0x8769
+TAG_DATE_TIME_ORIGINAL = 0x9003
+TAG_OFFSET_TIME_ORIGINAL = 0x9011
+TAG_PIXEL_X_DIMENSION = 0xA002
+TAG_PIXEL_Y_DIMENSION = 0xA003
+
+# Byte size of the TIFF field types that can be read: BYTE, ASCII, SHORT, LONG, UNDEFINED
+TIFF_TYPE_SIZES = {1: 1, 2: 1, 3: 2, 4: 4, 7: 1}
+# JPEG start of frame markers, the others in C0-CF are DHT, JPG and DAC
+JPEG_SOF_MARKERS = set(range(0xC0, 0xD0)) - {0xC4, 0xC8, 0xCC}
+HEIF_BRANDS = {b'heic', b'heix', b'heim', b'heis', b'hevc', b'hevx', b'mif1', b'msf1', b'avif'}
+
+
+@dataclass
+class ImageMetadata:
+    """
+    What the file header tells about an image, read without decoding any pixel
+    """
+    format: str # 'jpeg', 'png' or 'heif'
+    width: Optional[int] = None
+    height: Optional[int] = None
+    capture_time: Optional[datetime] = None # EXIF DateTimeOriginal, timezone-aware when the camera wrote the offset
+    orientation: Optional[int] = None # EXIF orientation, 6 and 8 mean width and height are swapped on display
+    make: Optional[str] = None
+    model: Optional[str] = None
+
+    @property
+    def camera(self) -> Optional[str]:
+        parts = [part for part in (self.make, self.model) if part]
+        return ' '.join(parts) if parts else None
+
+
+def _read_exact(f: BinaryIO, size: int) -> bytes:
+    data = f.read(size)
+    if len(data) != size:
+        raise ValueError('Truncated image header')
+    return data
+
+
+def _text(value: Any) -> Optional[str]:
+    if not isinstance(value, (bytes, bytearray)):
+        return None
+    text = value.split(b'\x00', 1)[0].decode('ascii', errors='ignore').strip()
+    return text or None
+
+
+def parse_exif_time(value: Optional[str], offset: Optional[str] = None) -> Optional[datetime]:
+    """
+    Parse an EXIF 'YYYY:MM:DD HH:MM:SS' time, with its '+HH:MM' offset tag if there is one
+    """
+    if not value:
+        return None
+    try:
+        dt = datetime.strptime(value, '%Y:%m:%d %H:%M:%S')
+    except ValueError:
+        return None
+    if offset and len(offset) == 6 and offset[0] in '+-' and offset[3] == ':':
+        try:
+            delta = timedelta(hours=int(offset[1:3]), minutes=int(offset[4:6]))
+            dt = dt.replace(tzinfo=timezone(delta if offset[0] == '+' else -delta))
+        except ValueError:
+            pass
+    return dt
+
+
+def _read_ifd(tiff: bytes, offset: int, endian: str) -> Dict[int, Any]:
+    """
+    Read the entries of one TIFF image file directory, only the field types ImageMetadata needs
+    """
+    entries = {}
+    (count,) = struct.unpack_from(endian + 'H', tiff, offset)
+    for i in range(count):
+        tag, field_type, n = struct.unpack_from(endian + 'HHI', tiff, offset + 2 + i * 12)
+        size = TIFF_TYPE_SIZES.get(field_type)
+        if size is None:
+            continue
+        value_offset = offset + 10 + i * 12
+        if size * n > 4:
+            (value_offset,) = struct.unpack_from(endian + 'I', tiff, value_offset)
+        raw = tiff[value_offset:value_offset + size * n]
+        if len(raw) != size * n:
+            continue
+        if field_type in (3, 4):
+            values = struct.unpack(endian + ('H' if field_type == 3 else 'I') * n, raw)
+            entries[tag] = values[0] if n == 1 else values
+        else:
+            entries[tag] = raw
+    return entries
+
+
+def parse_exif(tiff: bytes, metadata: ImageMetadata) -> None:
+    """
+    Fill the capture time, orientation, camera and (when the header has none) dimensions from a TIFF EXIF block
+    """
+    if tiff[:2] == b'II':
+        endian = '<'
+    elif tiff[:2] == b'MM':
+        endian = '>'
+    else:
+        raise ValueError('Not a TIFF EXIF block')
+    (ifd0_offset,) = struct.unpack_from(endian + 'I', tiff, 4)
+    ifd0 = _read_ifd(tiff, ifd0_offset, endian)
+    metadata.make = _text(ifd0.get(TAG_MAKE))
+    metadata.model = _text(ifd0.get(TAG_MODEL))
+    if isinstance(ifd0.get(TAG_ORIENTATION), int):
+        metadata.orientation = ifd0[TAG_ORIENTATION]
+    if isinstance(ifd0.get(TAG_EXIF_IFD), int):
+        exif_ifd = _read_ifd(tiff, ifd0[TAG_EXIF_IFD], endian)
+        metadata.capture_time = parse_exif_time(
+            _text(exif_ifd.get(TAG_DATE_TIME_ORIGINAL)), _text(exif_ifd.get(TAG_OFFSET_TIME_ORIGINAL))
+        )
+        if metadata.width is None and isinstance(exif_ifd.get(TAG_PIXEL_X_DIMENSION), int):
+            metadata.width = exif_ifd[TAG_PIXEL_X_DIMENSION]
+        if metadata.height is None and isinstance(exif_ifd.get(TAG_PIXEL_Y_DIMENSION), int):
+            metadata.height = exif_ifd[TAG_PIXEL_Y_DIMENSION]
+
+
+def _parse_jpeg(f: BinaryIO, metadata: ImageMetadata) -> None:
+    # walk the marker segments after SOI until the image data starts
+    f.seek(2)
+    while True:
+        byte = _read_exact(f, 1)
+        if byte != b'\xff':
+            raise ValueError('Corrupt JPEG marker')
+        marker = _read_exact(f, 1)[0]
+        while marker == 0xFF: # fill bytes
+            marker = _read_exact(f, 1)[0]
+        if marker == 0x01 or 0xD0 <= marker <= 0xD8: # no length
+            continue
+        if marker in (0xD9, 0xDA): # end of image, start of scan
+            return
+        (length,) = struct.unpack('>H', _read_exact(f, 2))
+        if length < 2:
+            raise ValueError('Corrupt JPEG segment length')
+        if marker == 0xE1 and metadata.capture_time is None:
+            segment = _read_exact(f, length - 2)
+            if segment[:6] == b'Exif\x00\x00':
+                parse_exif(segment[6:], metadata)
+        elif marker in JPEG_SOF_MARKERS:
+            segment = _read_exact(f, length - 2)
+            metadata.height, metadata.width = struct.unpack_from('>HH', segment, 1)
+        else:
+            f.seek(length - 2, io.SEEK_CUR)
+
+
+def _parse_png(f: BinaryIO, metadata: ImageMetadata) -> None:
+    # chunks are skipped with a seek, the pixel data (IDAT) is never read
+    f.seek(8)
+    while True:
+        header = f.read(8)
+        if len(header) < 8:
+            return
+        length, chunk_type = struct.unpack('>I4s', header)
+        if chunk_type == b'IHDR':
+            metadata.width, metadata.height = struct.unpack('>II', _read_exact(f, 8))
+            f.seek(length - 8 + 4, io.SEEK_CUR)
+        elif chunk_type == b'eXIf':
+            parse_exif(_read_exact(f, length), metadata)
+            f.seek(4, io.SEEK_CUR)
+        elif chunk_type == b'IEND':
+            return
+        else:
+            f.seek(length + 4, io.SEEK_CUR)
+
+
+def _iter_boxes(data: bytes, start: int = 0, end: Optional[int] = None):
+    """
+    Yield (type, payload start, payload end) of the ISO BMFF boxes in data[start:end]
+    """
+    end = len(data) if end is None else end
+    offset = start
+    while offset + 8 <= end:
+        size, box_type = struct.unpack_from('>I4s', data, offset)
+        header = 8
+        if size == 1:
+            (size,) = struct.unpack_from('>Q', data, offset + 8)
+            header = 16
+        elif size == 0:
+            size = end - offset
+        if size < header:
+            raise ValueError('Corrupt box size')
+        yield box_type, offset + header, min(offset + size, end)
+        offset += size
+
+
+def _read_uint(data: bytes, offset: int, size: int) -> Tuple[int, int]:
+    if size == 0:
+        return 0, offset
+    value = int.from_bytes(data[offset:offset + size], 'big')
+    return value, offset + size
+
+
+def _parse_iloc(data: bytes, start: int) -> Dict[int, List[Tuple[int, int]]]:
+    version = data[start]
+    offset_size, length_size = data[start + 4] >> 4, data[start + 4] & 0x0F
+    base_offset_size = data[start + 5] >> 4
+    index_size = data[start + 5] & 0x0F if version in (1, 2) else 0
+    pos = start + 6
+    count, pos = _read_uint(data, pos, 2 if version < 2 else 4)
+    locations = {}
+    for _ in range(count):
+        item_id, pos = _read_uint(data, pos, 2 if version < 2 else 4)
+        construction_method = 0
+        if version in (1, 2):
+            construction_method, pos = _read_uint(data, pos, 2)
+            construction_method &= 0x0F
+        pos += 2 # data reference index
+        base_offset, pos = _read_uint(data, pos, base_offset_size)
+        extent_count, pos = _read_uint(data, pos, 2)
+        extents = []
+        for _ in range(extent_count):
+            _, pos = _read_uint(data, pos, index_size)
+            extent_offset, pos = _read_uint(data, pos, offset_size)
+            extent_length, pos = _read_uint(data, pos, length_size)
+            extents.append((base_offset + extent_offset, extent_length))
+        if construction_method == 0: # file offsets, the only method used for EXIF items
+            locations[item_id] = extents
+    return locations
+
+
+def _parse_heif(f: BinaryIO, metadata: ImageMetadata) -> None:
+    # only the meta box is read: item types (iinf), locations (iloc) and the primary item's size (ispe)
+    f.seek(0)
+    meta = None
+    while meta is None:
+        header = f.read(8)
+        if len(header) < 8:
+            return
+        size, box_type = struct.unpack('>I4s', header)
+        header_size = 8
+        if size == 1:
+            (size,) = struct.unpack('>Q', _read_exact(f, 8))
+            header_size = 16
+        if box_type == b'meta':
+            meta = _read_exact(f, size - header_size)
+        elif size == 0:
+            return
+        else:
+            f.seek(size - header_size, io.SEEK_CUR)
+
+    primary_item, exif_items, locations, properties, associations = None, [], {}, [], {}
+    for box_type, start, end in _iter_boxes(meta, 4): # meta is a full box
+        if box_type == b'pitm':
+            primary_item, _ = _read_uint(meta, start + 4, 2 if meta[start] == 0 else 4)
+        elif box_type == b'iinf':
+            entry_start = start + 4 + (2 if meta[start] == 0 else 4)
+            for entry_type, entry, entry_end in _iter_boxes(meta, entry_start, end):
+                if entry_type != b'infe' or meta[entry] < 2:
+                    continue
+                item_id, pos = _read_uint(meta, entry + 4, 2 if meta[entry] == 2 else 4)
+                if meta[pos + 2:pos + 6] == b'Exif':
+                    exif_items.append(item_id)
+        elif box_type == b'iloc':
+            locations = _parse_iloc(meta, start)
+        elif box_type == b'iprp':
+            for child_type, child, child_end in _iter_boxes(meta, start, end):
+                if child_type == b'ipco':
+                    properties = [(t, s) for t, s, _ in _iter_boxes(meta, child, child_end)]
+                elif child_type == b'ipma':
+                    version, flags = meta[child], int.from_bytes(meta[child + 1:child + 4], 'big')
+                    count, pos = _read_uint(meta, child + 4, 4)
+                    for _ in range(count):
+                        item_id, pos = _read_uint(meta, pos, 2 if version < 1 else 4)
+                        n, pos = _read_uint(meta, pos, 1)
+                        indexes = []
+                        for _ in range(n):
+                            value, pos = _read_uint(meta, pos, 2 if flags & 1 else 1)
+                            indexes.append(value & (0x7FFF if flags & 1 else 0x7F))
+                        associations[item_id] = indexes
+
+    for index in associations.get(primary_item, []):
+        if 0 < index <= len(properties) and properties[index - 1][0] == b'ispe':
+            metadata.width, metadata.height = struct.unpack_from('>II', meta, properties[index - 1][1] + 4)
+    for item_id in exif_items:
+        extents = locations.get(item_id)
+        if not extents:
+            continue
+        f.seek(extents[0][0])
+        data = _read_exact(f, extents[0][1])
+        # the item starts with the offset of the TIFF header
+        (tiff_offset,) = struct.unpack_from('>I', data, 0)
+        parse_exif(data[4 + tiff_offset:], metadata)
+        return
+
+
+def sniff_format(head: bytes) -> Optional[str]:
+    if head[:3] == b'\xff\xd8\xff':
+        return 'jpeg'
+    if head[:8] == b'\x89PNG\r\n\x1a\n':
+        return 'png'
+    if head[4:8] == b'ftyp' and head[8:12] in HEIF_BRANDS:
+        return 'heif'
+    return None
+
+
+def read_metadata(source: Union[str, bytes, bytearray, BinaryIO]) -> Optional[ImageMetadata]:
+    """
+    Read the capture time, dimensions and camera of a JPEG, PNG or HEIC/HEIF image from its
+    header segments only, without decoding it. Missing or corrupt metadata is left as None.
+
+    Args:
+        source: A file path, the raw file bytes or a binary buffer holding them (its position is restored)
+
+    Returns:
+        The metadata, None if the format is not recognised
+    """
+    if isinstance(source, (bytes, bytearray)):
+        return _read_metadata(io.BytesIO(source))
+    if hasattr(source, 'read'):
+        position = source.tell()
+        try:
+            return _read_metadata(source)
+        finally:
+            source.seek(position)
+    with open(source, 'rb') as f:
+        return _read_metadata(f)
+
+
+def _read_metadata(f: BinaryIO) -> Optional[ImageMetadata]:
+    f.seek(0)
+    image_format = sniff_format(f.read(12))
+    if image_format is None:
+        return None
+    metadata = ImageMetadata(format=image_format)
+    parse = {'jpeg': _parse_jpeg, 'png': _parse_png, 'heif': _parse_heif}[image_format]
+    try:
+        parse(f, metadata)
+    except (ValueError, IndexError, struct.error) as e:
+        logger.warning(f"Could not read all the {image_format} metadata: {str(e)}")
+    return metadata
@@ -0,0 +1,43 @@
+import os
+from typing import List
+
+from PIL import Image
+
+
+# Width of the difference hash grid, the hash has PHASH_SIZE * PHASH_SIZE bits
+PHASH_SIZE = 16
+# Bits per band of the lookup index, two hashes closer than the number of bands share at least one band
+PHASH_BAND_BITS = 16
+# Images whose hashes differ by at most this many bits are the same picture (resent, recompressed, resized)
+PHASH_MAX_DISTANCE = int(os.getenv('PHASH_MAX_DISTANCE', 10))
+
+
+def dhash(image: Image.Image, hash_size: int = PHASH_SIZE) -> int:
+    """
+    Difference hash of an image: whether each pixel of a small grayscale copy is brighter than its right neighbour.
+    Survives recompression and resizing, unlike a hash of the bytes.
+    """
+    small = image.convert('L').resize((hash_size + 1, hash_size), Image.Resampling.BOX)
+    pixels = list(small.getdata())
+    value = 0
+    for row in range(hash_size):
+        for col in range(hash_size):
+            offset = row * (hash_size + 1) + col
+            value = (value << 1) | (pixels[offset] > pixels[offset + 1])
+    return value
+
+
+def hamming_distance(a: int, b: int) -> int:
+    return bin(a ^ b).count('1')
+
+
+def to_hex(phash: int, hash_size: int = PHASH_SIZE) -> str:
+    return format(phash, f'0{hash_size * hash_size // 4}x')
+
+
+def bands(phash: int, hash_size: int = PHASH_SIZE, band_bits: int = PHASH_BAND_BITS) -> List[int]:
+    """
+    Split a hash into the band values indexed by the media store
+    """
+    mask = (1 << band_bits) - 1
+    return [(phash >> shift) & mask for shift in range(0, hash_size * hash_size, band_bits)]
@@ -0,0 +1,170 @@
+import asyncio
+from datetime import datetime, date
+from typing import Optional, Any, List, Callable, AsyncContextManager
+
+import pytz
+import json_repair
+from PIL import UnidentifiedImageError
+
+from logger import logger
+from llm.gemini import AsyncGeminiProcessor, is_false_verdict
+from media.preprocess import prepare_image
+from media.metadata import read_metadata
+from media.store import MediaStore, MediaResult, same_workout
+from utils import TaskCheckResponse
+
+async_gemini = AsyncGeminiProcessor()
+
+BANGKOK_TZ = pytz.timezone('Asia/Bangkok')
+
+# The morning images, in the order they are sent
+MORNING_PROMPTS = [
+    (
+        f'You are an expert image content analyzer. '
+        f'Your tasks is to analyze the provided image and check if it depicts:\n'
+        f'- A Scots English center building\n'
+        f'- The image should contain a building with Scots English banners outside\n'
+        f'Respond ONLY with:\n'
+        f'"true" - if the image content meets the criteria\n'
+        f'"false" - otherwise'
+    ),
+    (
+        f'You are an expert image content analyzer. '
+        f'Your tasks is to analyze the provided image and check if it depicts:\n'
+        f'- A shirtless man taking a shower\n'
+        f'- The shower and running water should be visible in the frame\n'
+        f'Respond ONLY with:\n'
+        f'"true" - if the image content meets the criteria\n'
+        f'"false" - otherwise'
+    ),
+]
+
+
+def capture_day(capture_time: Optional[datetime]) -> Optional[date]:
+    """
+    Local (Bangkok) day a photo was taken, EXIF times without an offset are already local
+    """
+    if capture_time is None:
+        return None
+    if capture_time.tzinfo is not None:
+        capture_time = capture_time.astimezone(BANGKOK_TZ)
+    return capture_time.date()
+
+
+def parse_distance_km(info: Optional[str]) -> Optional[float]:
+    """
+    Distance of an extracted workout info in km, None if it cannot be read
+    """
+    try:
+        distance = json_repair.loads(info or '')['distance']
+        return float(distance.lower().replace('km', '').strip()) if 'km' in distance.lower() else None
+    except (TypeError, KeyError, AttributeError, ValueError):
+        return None
+
+
+class MediaPipeline:
+    """
+    Turns a received image, from any source, into its stored result: the criteria verdicts of a
+    morning image or the extracted info of a workout photo. Each image is downloaded and sent to
+    the LLM at most once.
+    """
+    def __init__(self, async_gemini_processor: Optional[AsyncGeminiProcessor] = None, media_store: Optional[MediaStore] = None,
+                 morning_prompts: Optional[List[str]] = None) -> None:
+        """
+        Args:
+            async_gemini_processor: Classifies the morning images and reads the workout infos, the shared module processor by default
+            media_store: Per-image verdicts and workout infos, in the data directory by default
+            morning_prompts: Criteria of the morning images in order, MORNING_PROMPTS by default
+        """
+        self.async_gemini = async_gemini_processor if async_gemini_processor is not None else async_gemini
+        self.media_store = media_store if media_store is not None else MediaStore()
+        self.morning_prompts = list(morning_prompts or MORNING_PROMPTS)
+
+
+    async def evaluate(self, file_key: str, source: str, day: date, kind: str,
+                       fetch: Callable[[], AsyncContextManager[Any]]) -> Optional[MediaResult]:
+        """
+        Compute and store the result of an image. Images already in the media store are not
+        downloaded or sent to the LLM again. A workout photo that looks like one already stored
+        is only marked as its duplicate (the same screenshot sent again, on any day) when the
+        info extracted from it also reports the same date and distance.
+
+        Args:
+            file_key: Store key of the file, see media_key
+            source: Where the image was received, e.g. 'telegram'
+            day: Local day the image was sent
+            kind: 'morning' or 'workout'
+            fetch: Opens the downloaded file (a buffer or a path) for the duration of the context
+
+        Returns:
+            The image result, None if the LLM gave no answer (asked again next time)
+        """
+        result = self.media_store.get(file_key)
+        if result is not None:
+            return result
+
+        print(f'{kind.capitalize()} image:', file_key)
+        async with fetch() as data:
+            metadata = read_metadata(data)
+            capture_time = metadata.capture_time if metadata is not None else None
+            if kind == 'morning' and capture_day(capture_time) != day:
+                # photos taken on another day never pass, rejected from the header without decoding them
+                result = MediaResult(file_key=file_key, source=source, day=day, kind=kind, capture_time=capture_time)
+                self.media_store.put(result)
+                return result
+            try:
+                prepared = await asyncio.to_thread(prepare_image, data, metadata=metadata)
+            except UnidentifiedImageError:
+                # stored without verdicts or info, so it counts as an invalid image instead of failing every check
+                logger.error(f"Could not decode {file_key} ({metadata.format if metadata is not None else 'unknown format'})")
+                result = MediaResult(file_key=file_key, source=source, day=day, kind=kind, capture_time=capture_time)
+                self.media_store.put(result)
+                return result
+        result = MediaResult(file_key=file_key, source=source, day=day, kind=kind, capture_time=capture_time, phash=prepared.phash)
+        try:
+            if kind == 'workout':
+                result.info = await self.async_gemini.get_workout_info(prepared)
+                if result.info is None: # no answer, asked again next time
+                    return None
+                result.distance_km = parse_distance_km(result.info)
+                # a look-alike screenshot is only a candidate, the same app shows every run the same way.
+                # Morning photos of the same places look alike every day, their capture time already rules out old ones
+                original = self.media_store.find_similar(prepared.phash, kind) if prepared.phash is not None else None
+                if original is not None and same_workout(result, original):
+                    logger.info(f"{file_key} is a duplicate of {original.file_key}")
+                    result.duplicate_of = original.file_key
+            else:
+                # checked against every criteria since its position among the day's messages is not known yet.
+                # One request per image as it arrives rather than one classify_batch for the day at check
+                # time: the decoded image is not kept until then, and the check itself makes no LLM call.
+                classification = await self.async_gemini.classify_image(prepared, self.morning_prompts, check_name='morning_images')
+                result.verdicts = [None if response is None else not is_false_verdict(response) for response in classification.responses]
+        finally:
+            # only the verdicts are kept, the decoded image is released right away
+            prepared.image.close()
+        self.media_store.put(result)
+        return result
+
+
+    def judge_morning_images(self, results: List[MediaResult], today: date) -> TaskCheckResponse:
+        """
+        Check that the last images of the day were taken today and each meets its criteria, in order
+
+        Args:
+            results: The results of the last len(morning_prompts) images of the day, in arrival order
+            today: Local day being checked
+        """
+        valid_images = [
+            result for result in results
+            if result.kind == 'morning' and capture_day(result.capture_time) == today
+        ]
+
+        if len(valid_images) != len(self.morning_prompts):
+            return TaskCheckResponse(result='FAIL', message='Not enough images', status='FAIL')
+
+        for i, result in enumerate(valid_images):
+            if not result.verdicts or not result.verdicts[i]:
+                print(f'Image {i} is invalid')
+                return TaskCheckResponse(result='FAIL', message='Invalid image', status='FAIL')
+
+        return TaskCheckResponse(result='PASS', message='All images are valid', status='PASS')
@@ -0,0 +1,105 @@
+import io
+import os
+import threading
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Optional, Union, Dict, Any, BinaryIO
+
+from PIL import Image, ImageOps
+
+from logger import logger
+from media.phash import dhash
+from media.metadata import ImageMetadata, read_metadata
+
+try:
+    # iPhone originals are HEIC, which Pillow cannot open by itself
+    from pillow_heif import register_heif_opener
+    register_heif_opener()
+except ImportError:
+    logger.warning("pillow-heif is not installed, HEIC images cannot be decoded")
+
+
+# Longest edge and JPEG quality of the images sent to the LLM
+IMAGE_MAX_EDGE = int(os.getenv('IMAGE_MAX_EDGE', 1536))
+IMAGE_JPEG_QUALITY = int(os.getenv('IMAGE_JPEG_QUALITY', 85))
+
+_stats_lock = threading.Lock()
+_stats = {'images': 0, 'original_bytes': 0, 'prepared_bytes': 0}
+
+
+@dataclass
+class PreparedImage:
+    """
+    An image ready for LLM upload: downscaled, re-encoded as JPEG and stripped of metadata
+    """
+    data: bytes
+    image: Image.Image
+    capture_time: Optional[datetime] # EXIF DateTimeOriginal of the source, read before stripping
+    original_bytes: int
+    mime_type: str = 'image/jpeg'
+    phash: Optional[int] = None # difference hash, to find the same picture sent again
+
+    @property
+    def bytes_saved(self) -> int:
+        return self.original_bytes - len(self.data)
+
+
+def prepare_image(source: Union[str, bytes, bytearray, BinaryIO], max_edge: int = IMAGE_MAX_EDGE, quality: int = IMAGE_JPEG_QUALITY,
+                  metadata: Optional[ImageMetadata] = None) -> PreparedImage:
+    """
+    Shrink an image before it is sent to the LLM.
+
+    Args:
+        source: A file path, the raw file bytes or a binary buffer holding them
+        max_edge: Longest edge of the output, smaller images are not upscaled
+        quality: JPEG quality of the output
+        metadata: The header metadata of the source if already read
+
+    Returns:
+        The re-encoded image, with the capture time read from the original EXIF and its perceptual hash
+    """
+    if metadata is None:
+        metadata = read_metadata(source)
+    capture_time = metadata.capture_time if metadata is not None else None
+    if isinstance(source, (bytes, bytearray)):
+        original_bytes = len(source)
+        im = Image.open(io.BytesIO(source))
+    elif hasattr(source, 'read'):
+        source.seek(0, io.SEEK_END)
+        original_bytes = source.tell()
+        source.seek(0)
+        im = Image.open(source)
+    else:
+        original_bytes = os.path.getsize(source)
+        im = Image.open(source)
+
+    with im:
+        # bake the EXIF orientation into the pixels, it is lost with the rest of the metadata
+        prepared = ImageOps.exif_transpose(im)
+        if prepared.mode != 'RGB':
+            prepared = prepared.convert('RGB')
+        prepared.thumbnail((max_edge, max_edge), Image.Resampling.LANCZOS)
+        phash = dhash(prepared)
+        buffer = io.BytesIO()
+        prepared.save(buffer, format='JPEG', quality=quality, optimize=True)
+
+    data = buffer.getvalue()
+    with _stats_lock:
+        _stats['images'] += 1
+        _stats['original_bytes'] += original_bytes
+        _stats['prepared_bytes'] += len(data)
+    logger.info(f"Prepared image: {original_bytes} -> {len(data)} bytes ({prepared.size[0]}x{prepared.size[1]})")
+    return PreparedImage(
+        data=data,
+        image=Image.open(io.BytesIO(data)),
+        capture_time=capture_time,
+        original_bytes=original_bytes,
+        phash=phash
+    )
+
+
+def get_preprocess_stats() -> Dict[str, Any]:
+    with _stats_lock:
+        stats = dict(_stats)
+    stats['bytes_saved'] = stats['original_bytes'] - stats['prepared_bytes']
+    return stats
@@ -0,0 +1,189 @@
+import json
+import time
+from dataclasses import dataclass, field
+from datetime import date, datetime
+from typing import Optional, List
+
+import json_repair
+
+from storage import data_path, sqlite_connection
+from media.phash import PHASH_MAX_DISTANCE, hamming_distance, to_hex, bands
+
+
+def media_key(source: str, file_id: str) -> str:
+    """
+    Store key of a file: a Telegram file_unique_id (the same for every copy of a file) or a Slack file id
+    """
+    return f'{source}:{file_id}'
+
+
+@dataclass
+class MediaResult:
+    """
+    What was computed for one received image, so that checks aggregate instead of recomputing
+    """
+    file_key: str # '<source>:<stable file id>', e.g. telegram:<file_unique_id>
+    source: str
+    day: date # local day the image was sent
+    kind: str # 'morning' or 'workout'
+    capture_time: Optional[datetime] = None
+    verdicts: Optional[List[Optional[bool]]] = None # morning images, per criterion
+    info: Optional[str] = None # workout images, the extracted JSON
+    distance_km: Optional[float] = None
+    processed_at: float = field(default_factory=time.time)
+    phash: Optional[int] = None
+    duplicate_of: Optional[str] = None # file_key of the earlier copy of a near-duplicate image, its results are reused
+
+
+class MediaStore:
+    """
+    Local SQLite store of per-image results (morning verdicts, workout infos), keyed by file.
+    Perceptual hashes are indexed by band, so that an image sent again as a new file (forwarded,
+    recompressed, on another day) is found without scanning every hash.
+    """
+    def __init__(self, path: Optional[str] = None) -> None:
+        self.path = path or data_path('media.sqlite3')
+        with sqlite_connection(self.path) as conn:
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS media_results ('
+                'file_key TEXT PRIMARY KEY, source TEXT NOT NULL, day TEXT NOT NULL, kind TEXT NOT NULL, '
+                'capture_time TEXT, verdicts TEXT, info TEXT, distance_km REAL, processed_at REAL NOT NULL)'
+            )
+            conn.execute('CREATE INDEX IF NOT EXISTS media_results_day ON media_results (day, kind)')
+            columns = {row[1] for row in conn.execute('PRAGMA table_info(media_results)')}
+            for column in ('phash', 'duplicate_of'):
+                if column not in columns:
+                    conn.execute(f'ALTER TABLE media_results ADD COLUMN {column} TEXT')
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS media_phash_bands ('
+                'band INTEGER NOT NULL, value INTEGER NOT NULL, file_key TEXT NOT NULL, PRIMARY KEY (band, value, file_key))'
+            )
+
+
+    def _from_row(self, row: tuple) -> MediaResult:
+        file_key, source, day, kind, capture_time, verdicts, info, distance_km, processed_at, phash, duplicate_of = row
+        return MediaResult(
+            file_key=file_key,
+            source=source,
+            day=date.fromisoformat(day),
+            kind=kind,
+            capture_time=datetime.fromisoformat(capture_time) if capture_time else None,
+            verdicts=json.loads(verdicts) if verdicts is not None else None,
+            info=info,
+            distance_km=distance_km,
+            processed_at=processed_at,
+            phash=int(phash, 16) if phash else None,
+            duplicate_of=duplicate_of
+        )
+
+
+    def get(self, file_key: str) -> Optional[MediaResult]:
+        with sqlite_connection(self.path) as conn:
+            row = conn.execute('SELECT * FROM media_results WHERE file_key = ?', (file_key,)).fetchone()
+        return self._from_row(row) if row else None
+
+
+    def put(self, result: MediaResult) -> None:
+        with sqlite_connection(self.path) as conn:
+            conn.execute(
+                'INSERT OR REPLACE INTO media_results '
+                '(file_key, source, day, kind, capture_time, verdicts, info, distance_km, processed_at, phash, duplicate_of) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                (
+                    result.file_key, result.source, result.day.isoformat(), result.kind,
+                    result.capture_time.isoformat() if result.capture_time else None,
+                    json.dumps(result.verdicts) if result.verdicts is not None else None,
+                    result.info, result.distance_km, result.processed_at,
+                    to_hex(result.phash) if result.phash is not None else None, result.duplicate_of
+                )
+            )
+            conn.execute('DELETE FROM media_phash_bands WHERE file_key = ?', (result.file_key,))
+            # only originals are indexed, so that a match always points at the first copy
+            if result.phash is not None and result.duplicate_of is None:
+                conn.executemany(
+                    'INSERT INTO media_phash_bands (band, value, file_key) VALUES (?, ?, ?)',
+                    [(band, value, result.file_key) for band, value in enumerate(bands(result.phash))]
+                )
+
+
+    def get_day(self, day: date, kind: Optional[str] = None) -> List[MediaResult]:
+        """
+        Results of the images sent on a day, oldest first
+        """
+        with sqlite_connection(self.path) as conn:
+            rows = conn.execute(
+                'SELECT * FROM media_results WHERE day = ? AND (? IS NULL OR kind = ?) ORDER BY processed_at',
+                (day.isoformat(), kind, kind)
+            ).fetchall()
+        return [self._from_row(row) for row in rows]
+
+
+    def find_similar(self, phash: int, kind: Optional[str] = None, max_distance: int = PHASH_MAX_DISTANCE) -> Optional[MediaResult]:
+        """
+        Find the stored image closest to a perceptual hash, on any day
+
+        Args:
+            phash: Difference hash of the new image
+            kind: Only match images of this kind
+            max_distance: Largest number of differing bits of a match, below the number of bands every match is found
+
+        Returns:
+            The closest (then oldest) matching original, None if no image is close enough
+        """
+        values = bands(phash)
+        condition = ' OR '.join(['(b.band = ? AND b.value = ?)'] * len(values))
+        params = [param for band, value in enumerate(values) for param in (band, value)]
+        with sqlite_connection(self.path) as conn:
+            rows = conn.execute(
+                'SELECT r.* FROM media_results r WHERE r.file_key IN ('
+                f'SELECT b.file_key FROM media_phash_bands b WHERE {condition}) '
+                'AND (? IS NULL OR r.kind = ?) ORDER BY r.processed_at',
+                params + [kind, kind]
+            ).fetchall()
+        matches = []
+        for row in rows:
+            result = self._from_row(row)
+            distance = hamming_distance(phash, result.phash)
+            if distance <= max_distance:
+                matches.append((distance, result.processed_at, result))
+        return min(matches, key=lambda match: match[:2])[2] if matches else None
+
+
+def same_workout(result: MediaResult, other: MediaResult) -> bool:
+    """
+    Whether two workout results report the same run: the same date and distance were extracted from both.
+    Screenshots of the same app look alike, so a perceptual hash match alone does not make a duplicate.
+    """
+    def workout_date(info: Optional[str]) -> Optional[str]:
+        try:
+            return str(json_repair.loads(info or '')['date']).strip() or None
+        except (TypeError, KeyError):
+            return None
+
+    date_ = workout_date(result.info)
+    return (
+        date_ is not None and date_ == workout_date(other.info)
+        and result.distance_km is not None and result.distance_km == other.distance_km
+    )
+
+
+def drop_duplicates(results: List[MediaResult], max_distance: int = PHASH_MAX_DISTANCE) -> List[MediaResult]:
+    """
+    Keep the first copy of every image: repeated files, confirmed duplicates of an image of another day
+    and near-duplicates of an earlier image of the list (evaluated at the same time) reporting the
+    same workout are dropped
+    """
+    kept = []
+    seen = set()
+    for result in results:
+        if result.file_key in seen or result.duplicate_of is not None:
+            continue
+        if result.phash is not None and any(
+            other.phash is not None and hamming_distance(result.phash, other.phash) <= max_distance
+            and same_workout(result, other)
+            for other in kept
+        ):
+            continue
+        seen.add(result.file_key)
+        kept.append(result)
+    return kept
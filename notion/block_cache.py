@@ -0,0 +1,84 @@
+import os
+import json
+import time
+from datetime import datetime, timezone, timedelta
+from typing_extensions import List, Dict, Any, Optional
+
+from storage import data_path, sqlite_connection
+
+
+# Notion rounds last_edited_time to the minute, so a page edited within this window may still change
+# without its timestamp moving. Snapshots are neither read nor written inside it.
+NOTION_EDIT_GRACE_SECONDS = int(os.getenv('NOTION_EDIT_GRACE_SECONDS', 120))
+
+
+def get_cache_version(last_edited_time: str, grace_seconds: int = NOTION_EDIT_GRACE_SECONDS) -> Optional[str]:
+    """
+    Turn a page last_edited_time into a cache version, or None if the page was edited too recently to trust it
+    """
+    edited = datetime.fromisoformat(last_edited_time.replace('Z', '+00:00'))
+    if datetime.now(timezone.utc) - edited < timedelta(seconds=grace_seconds):
+        return None
+    return last_edited_time
+
+
+class BlockCache:
+    """
+    Persistent SQLite cache of Notion block children.
+
+    Every entry is stored with a version, the last_edited_time of the page that contains the block.
+    Notion bumps the page timestamp on any edit inside it (a nested to_do being checked does not
+    change its parent toggle's own timestamp), so a matching version means the cached children are current.
+    """
+    def __init__(self, path: Optional[str] = None) -> None:
+        self.path = path or data_path('notion_blocks.sqlite3')
+        with sqlite_connection(self.path) as conn:
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS block_children ('
+                'block_id TEXT PRIMARY KEY, version TEXT NOT NULL, fetched_at REAL NOT NULL, children TEXT NOT NULL)'
+            )
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS day_blocks ('
+                'page_id TEXT NOT NULL, day TEXT NOT NULL, version TEXT NOT NULL, block TEXT NOT NULL, '
+                'PRIMARY KEY (page_id, day))'
+            )
+
+
+    def get_children(self, block_id: str, version: Optional[str]) -> Optional[List[Dict[str, Any]]]:
+        if version is None:
+            return None
+        with sqlite_connection(self.path) as conn:
+            row = conn.execute(
+                'SELECT children FROM block_children WHERE block_id = ? AND version = ?', (block_id, version)
+            ).fetchone()
+        return json.loads(row[0]) if row else None
+
+
+    def put_children(self, block_id: str, version: Optional[str], children: List[Dict[str, Any]]) -> None:
+        if version is None:
+            return
+        with sqlite_connection(self.path) as conn:
+            conn.execute(
+                'INSERT OR REPLACE INTO block_children (block_id, version, fetched_at, children) VALUES (?, ?, ?, ?)',
+                (block_id, version, time.time(), json.dumps(children, ensure_ascii=False))
+            )
+
+
+    def get_day_block(self, page_id: str, day: str, version: Optional[str]) -> Optional[Dict[str, Any]]:
+        if version is None:
+            return None
+        with sqlite_connection(self.path) as conn:
+            row = conn.execute(
+                'SELECT block FROM day_blocks WHERE page_id = ? AND day = ? AND version = ?', (page_id, day, version)
+            ).fetchone()
+        return json.loads(row[0]) if row else None
+
+
+    def put_day_block(self, page_id: str, day: str, version: Optional[str], block: Dict[str, Any]) -> None:
+        if version is None:
+            return
+        with sqlite_connection(self.path) as conn:
+            conn.execute(
+                'INSERT OR REPLACE INTO day_blocks (page_id, day, version, block) VALUES (?, ?, ?, ?)',
+                (page_id, day, version, json.dumps(block, ensure_ascii=False))
+            )
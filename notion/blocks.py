@@ -0,0 +1,124 @@
+import json
+import asyncio
+from typing_extensions import List, Dict, Any, Iterator, AsyncIterator, Optional
+
+
+TASK_EMOJIS = ['✅', '❌', '⌛']
+
+
+def clean_emoji_from_text(text: str) -> str:
+    for emoji in TASK_EMOJIS:
+        text = text.replace(emoji, '')
+    return text.strip()
+
+
+def iter_block_children(client, block_id: str, page_size: int = 100) -> Iterator[Dict[str, Any]]:
+    """
+    Lazily yield the children of a block, following has_more / next_cursor.
+    Pages are only requested as the caller consumes them, so breaking out early saves the remaining calls.
+    """
+    start_cursor: Optional[str] = None
+    while True:
+        kwargs = {'block_id': block_id, 'page_size': page_size}
+        if start_cursor is not None:
+            kwargs['start_cursor'] = start_cursor
+        response = client.blocks.children.list(**kwargs)
+        for block in response['results']:
+            yield block
+        if not response.get('has_more'):
+            return
+        start_cursor = response['next_cursor']
+
+
+async def aiter_block_children(client, block_id: str, page_size: int = 100, semaphore: Optional[asyncio.Semaphore] = None) -> AsyncIterator[Dict[str, Any]]:
+    """
+    Async version of iter_block_children, for the Notion AsyncClient.
+    If a semaphore is given, it is held only while a page is being requested.
+    """
+    start_cursor: Optional[str] = None
+    while True:
+        kwargs = {'block_id': block_id, 'page_size': page_size}
+        if start_cursor is not None:
+            kwargs['start_cursor'] = start_cursor
+        if semaphore is not None:
+            async with semaphore:
+                response = await client.blocks.children.list(**kwargs)
+        else:
+            response = await client.blocks.children.list(**kwargs)
+        for block in response['results']:
+            yield block
+        if not response.get('has_more'):
+            return
+        start_cursor = response['next_cursor']
+
+
+def get_block_text(block: Dict[str, Any]) -> str:
+    """
+    Return the plain text of the first rich text item of a toggle / to_do / paragraph block
+    """
+    return block[block['type']]["rich_text"][0]["plain_text"]
+
+
+def build_toggle_dict(toggle_block: Dict[str, Any], sub_blocks: List[Dict[str, Any]], parsed_toggles: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Build the parsed dict of a toggle block from its direct children.
+
+    Args:
+        toggle_block: The toggle block itself
+        sub_blocks: The direct children of the toggle block, in page order
+        parsed_toggles: Already parsed nested toggles, keyed by child block id
+
+    Returns:
+        A leaf {'result', 'text_content'} for an empty toggle, otherwise a dict of
+        cleaned task name -> parsed child plus the 'text_content' of the toggle
+    """
+    toggle_text = get_block_text(toggle_block)
+    d = {}
+    text_content = []
+    for sub_block in sub_blocks:
+        if sub_block['type'] == 'toggle':
+            text = clean_emoji_from_text(get_block_text(sub_block))
+            d[text] = parsed_toggles[sub_block['id']]
+        elif sub_block['type'] == 'to_do':
+            text = clean_emoji_from_text(get_block_text(sub_block))
+            checked = sub_block["to_do"]["checked"]
+            d[text] = {'result': 'PASS' if checked else 'FAIL', 'text_content': text}
+        elif sub_block['type'] == 'paragraph':
+            text = clean_emoji_from_text(get_block_text(sub_block))
+            text_content.append(text)
+
+    text_content = '\n'.join(text_content)
+    if len(d) == 0: # empty toggle
+        is_completed = '✅' in toggle_text
+        return {'result': 'PASS' if is_completed else 'FAIL', 'text_content': text_content}
+
+    d['text_content'] = text_content
+    return d
+
+
+def parse_toggle_block(client, block: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Sequentially parse a toggle block, one API call per nested toggle.
+    AsyncTreeFetcher gives the same result with sibling toggles fetched concurrently.
+    """
+    assert block["type"] == "toggle"
+    sub_blocks = list(iter_block_children(client, block["id"]))
+    parsed_toggles = {
+        sub_block['id']: parse_toggle_block(client, sub_block)
+        for sub_block in sub_blocks if sub_block['type'] == 'toggle'
+    }
+    return build_toggle_dict(block, sub_blocks, parsed_toggles)
+
+
+def record_block_tree(client, block: Dict[str, Any], path: str) -> None:
+    """
+    Save a toggle block and all its nested children as a JSON fixture for FakeNotionClient
+    """
+    children = {}
+    stack = [block]
+    while stack:
+        current = stack.pop()
+        children[current['id']] = list(iter_block_children(client, current['id']))
+        stack.extend(sub_block for sub_block in children[current['id']] if sub_block.get('has_children') or sub_block['type'] == 'toggle')
+    with open(path, 'w') as f:
+        json.dump({'root': block, 'children': children}, f, indent=4, ensure_ascii=False)
@@ -0,0 +1,192 @@
+import json
+import time
+import random
+import asyncio
+import httpx
+from datetime import datetime, timezone, timedelta
+from typing_extensions import List, Dict, Any, Optional, Tuple
+
+from notion_client import APIResponseError
+from notion_client.errors import APIErrorCode
+
+
+def _rich_text(text: str) -> Dict[str, Any]:
+    return {'rich_text': [{'type': 'text', 'plain_text': text, 'text': {'content': text}}]}
+
+
+def make_block(block_id: str, block_type: str, text: str, checked: bool = False, has_children: bool = False,
+               last_edited_time: str = '2025-06-01T00:00:00.000Z') -> Dict[str, Any]:
+    """
+    Build a block object shaped like the ones returned by the Notion API
+    """
+    content = _rich_text(text)
+    if block_type == 'to_do':
+        content['checked'] = checked
+    return {
+        'object': 'block',
+        'id': block_id,
+        'type': block_type,
+        block_type: content,
+        'has_children': has_children,
+        'archived': False,
+        'in_trash': False,
+        'last_edited_time': last_edited_time,
+    }
+
+
+def generate_day_tree(day: str, n_tasks: int, depth: int, fanout: int = 5, done_ratio: float = 0.8,
+                      seed: int = 0) -> Tuple[Dict[str, Any], Dict[str, List[Dict[str, Any]]]]:
+    """
+    Generate a synthetic day toggle with n_tasks to_dos spread over nested sections.
+
+    Args:
+        day: Text of the day toggle (dd/mm/yyyy)
+        n_tasks: Number of to_do leaves
+        depth: Number of section levels between the day toggle and the to_dos (0 puts every to_do directly under the day)
+        fanout: Number of sub-sections per section
+        done_ratio: Probability that a to_do is checked
+        seed: Random seed, the same arguments always give the same tree
+
+    Returns:
+        The day toggle block and the children of every block, keyed by block id
+    """
+    rng = random.Random(seed)
+    counter = iter(range(1, 10 ** 9))
+    root = make_block('day-0', 'toggle', day, has_children=True)
+    children: Dict[str, List[Dict[str, Any]]] = {root['id']: []}
+
+    # build the section levels breadth-first, to_dos go into the deepest sections
+    sections = [root]
+    for level in range(depth):
+        next_sections = []
+        for section in sections:
+            for i in range(fanout):
+                block = make_block(f'section-{next(counter)}', 'toggle', f'section {level}.{i}', has_children=True)
+                children[section['id']].append(block)
+                children[block['id']] = []
+                next_sections.append(block)
+        sections = next_sections
+
+    for i in range(n_tasks):
+        section = sections[i % len(sections)]
+        mark = '✅' if rng.random() < done_ratio else '❌'
+        block = make_block(f'task-{next(counter)}', 'to_do', f'{mark} task {i}', checked=mark == '✅')
+        children[section['id']].append(block)
+    for section in sections:
+        children[section['id']].append(make_block(f'note-{next(counter)}', 'paragraph', f'note of {section["id"]}'))
+    return root, children
+
+
+class _Endpoint:
+    pass
+
+
+class FakeNotionClient:
+    """
+    In-memory stand-in for notion_client.Client serving recorded or generated block trees.
+    Implements blocks.children.list, blocks.retrieve, pages.retrieve and search, with pagination
+    and an optional per-call latency, and counts every call.
+    """
+    is_async = False
+
+    def __init__(self, children: Optional[Dict[str, List[Dict[str, Any]]]] = None, latency: float = 0.0, jitter: float = 0.0,
+                 error_rate: float = 0.0, seed: int = 0) -> None:
+        """
+        Args:
+            children: Children of every block, keyed by block id
+            latency: Seconds every call takes
+            jitter: Extra random seconds added to every call, uniformly drawn from [0, jitter]
+            error_rate: Probability that a call fails with a 429 rate_limited error
+        """
+        self.children = children or {}
+        self.page_objects: Dict[str, Dict[str, Any]] = {}
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.rng = random.Random(seed)
+        self.calls: Dict[str, int] = {}
+
+        self.blocks = _Endpoint()
+        self.blocks.children = _Endpoint()
+        self.blocks.children.list = self._endpoint('blocks.children.list', self._list_children)
+        self.blocks.retrieve = self._endpoint('blocks.retrieve', self._retrieve_block)
+        self.pages = _Endpoint()
+        self.pages.retrieve = self._endpoint('pages.retrieve', self._retrieve_page)
+        self.search = self._endpoint('search', self._search)
+
+    @classmethod
+    def from_fixture(cls, path: str, **kwargs) -> Tuple['FakeNotionClient', Dict[str, Any]]:
+        """
+        Load a fixture written by record_block_tree, returns the client and the recorded root block
+        """
+        with open(path, 'r') as f:
+            fixture = json.load(f)
+        return cls(children=fixture['children'], **kwargs), fixture['root']
+
+    def add_page(self, page_id: str, title: str, children: List[Dict[str, Any]], last_edited_time: Optional[str] = None) -> None:
+        """
+        Add a month page whose children are e.g. generated day toggles
+        """
+        if last_edited_time is None:
+            last_edited_time = (datetime.now(timezone.utc) - timedelta(days=1)).strftime('%Y-%m-%dT%H:%M:00.000Z')
+        self.page_objects[page_id] = {
+            'object': 'page',
+            'id': page_id,
+            'last_edited_time': last_edited_time,
+            'archived': False,
+            'in_trash': False,
+            'properties': {'title': {'type': 'title', 'title': [{'plain_text': title}]}},
+        }
+        self.children[page_id] = children
+
+    @property
+    def total_calls(self) -> int:
+        return sum(self.calls.values())
+
+    def _delay(self, name: str) -> float:
+        self.calls[name] = self.calls.get(name, 0) + 1
+        if self.error_rate and self.rng.random() < self.error_rate:
+            raise APIResponseError(APIErrorCode.RateLimited, 429, 'Rate limited by FakeNotionClient', httpx.Headers({'retry-after': '0'}), '')
+        return self.latency + (self.rng.uniform(0, self.jitter) if self.jitter else 0.0)
+
+    def _endpoint(self, name: str, func):
+        if self.is_async:
+            async def call(*args, **kwargs):
+                await asyncio.sleep(self._delay(name))
+                return func(*args, **kwargs)
+        else:
+            def call(*args, **kwargs):
+                time.sleep(self._delay(name))
+                return func(*args, **kwargs)
+        return call
+
+    def _paginate(self, items: List[Dict[str, Any]], page_size: int, start_cursor: Optional[str]) -> Dict[str, Any]:
+        start = int(start_cursor or 0)
+        end = start + page_size
+        has_more = end < len(items)
+        return {'object': 'list', 'results': items[start:end], 'has_more': has_more, 'next_cursor': str(end) if has_more else None}
+
+    def _list_children(self, block_id: str, page_size: int = 100, start_cursor: Optional[str] = None) -> Dict[str, Any]:
+        return self._paginate(self.children.get(block_id, []), page_size, start_cursor)
+
+    def _retrieve_block(self, block_id: str) -> Dict[str, Any]:
+        for blocks in self.children.values():
+            for block in blocks:
+                if block['id'] == block_id:
+                    return block
+        raise APIResponseError(APIErrorCode.ObjectNotFound, 404, f'Could not find block {block_id}', httpx.Headers(), '')
+
+    def _retrieve_page(self, page_id: str) -> Dict[str, Any]:
+        return self.page_objects[page_id]
+
+    def _search(self, query: str = '', filter: Optional[Dict[str, Any]] = None, page_size: int = 100, start_cursor: Optional[str] = None) -> Dict[str, Any]:
+        pages = [page for page in self.page_objects.values()
+                 if query in ''.join(item['plain_text'] for item in page['properties']['title']['title'])]
+        return self._paginate(pages, page_size, start_cursor)
+
+
+class AsyncFakeNotionClient(FakeNotionClient):
+    """
+    Async version of FakeNotionClient, a stand-in for notion_client.AsyncClient
+    """
+    is_async = True
@@ -0,0 +1,183 @@
+import time
+import asyncio
+import argparse
+from datetime import datetime, date, timedelta
+from typing_extensions import List, Dict, Any, Optional, Tuple
+
+from storage import data_path, sqlite_connection
+from notion.task_tree import TaskNode, iter_tasks
+from notion.page_index import is_day_title
+from notion.block_cache import get_cache_version
+from notion.blocks import iter_block_children
+
+
+class TaskHistoryStore:
+    """
+    Local SQLite store of every day's tasks, one row per task, for history questions
+    (streaks, completion rates, failure history) that should not hit the Notion API.
+    Days are stored as ISO dates (yyyy-mm-dd) so that they sort and group by month.
+    """
+    def __init__(self, path: Optional[str] = None) -> None:
+        self.path = path or data_path('task_history.sqlite3')
+        with sqlite_connection(self.path) as conn:
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS task_rows ('
+                'day TEXT NOT NULL, path TEXT NOT NULL, section TEXT NOT NULL, task TEXT NOT NULL, passed INTEGER NOT NULL, '
+                'PRIMARY KEY (day, path))'
+            )
+            conn.execute('CREATE INDEX IF NOT EXISTS task_rows_task ON task_rows (task, day)')
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS days ('
+                'day TEXT PRIMARY KEY, passed INTEGER NOT NULL, failed INTEGER NOT NULL, stored_at REAL NOT NULL)'
+            )
+
+
+    def put_day(self, day: date, all_tasks: Optional[Dict[str, Any]]) -> None:
+        """
+        Replace the stored tasks of a day with a parsed task tree
+        """
+        rows = []
+        if all_tasks is not None:
+            root = TaskNode.from_dict(all_tasks)
+            if not root.is_leaf: # a day without any task has no rows
+                for path, node in iter_tasks(root):
+                    parts = path.strip('/').split('/')
+                    section = parts[0] if len(parts) > 1 else ''
+                    rows.append((day.isoformat(), path, section, node.name, int(node.result == 'PASS')))
+
+        passed = sum(row[4] for row in rows)
+        with sqlite_connection(self.path) as conn:
+            conn.execute('DELETE FROM task_rows WHERE day = ?', (day.isoformat(),))
+            conn.executemany('INSERT OR REPLACE INTO task_rows (day, path, section, task, passed) VALUES (?, ?, ?, ?, ?)', rows)
+            conn.execute(
+                'INSERT OR REPLACE INTO days (day, passed, failed, stored_at) VALUES (?, ?, ?, ?)',
+                (day.isoformat(), passed, len(rows) - passed, time.time())
+            )
+
+
+    def get_days(self, start: Optional[date] = None, end: Optional[date] = None) -> List[Dict[str, Any]]:
+        """
+        Per-day pass/fail counts, oldest first
+        """
+        with sqlite_connection(self.path) as conn:
+            rows = conn.execute(
+                'SELECT day, passed, failed FROM days WHERE day >= ? AND day <= ? ORDER BY day',
+                ((start or date.min).isoformat(), (end or date.max).isoformat())
+            ).fetchall()
+        return [{'day': day, 'passed': passed, 'failed': failed} for day, passed, failed in rows]
+
+
+    def monthly_completion_rates(self) -> Dict[str, float]:
+        """
+        Ratio of completed tasks per month, keyed by 'yyyy-mm'
+        """
+        with sqlite_connection(self.path) as conn:
+            rows = conn.execute(
+                'SELECT substr(day, 1, 7) AS month, SUM(passed), SUM(passed + failed) FROM days GROUP BY month ORDER BY month'
+            ).fetchall()
+        return {month: passed / total if total else 1.0 for month, passed, total in rows}
+
+
+    def streaks(self) -> Dict[str, int]:
+        """
+        Current and longest runs of consecutive stored days with every task completed
+        """
+        current, longest, previous = 0, 0, None
+        for day in self.get_days():
+            d = date.fromisoformat(day['day'])
+            if day['failed'] == 0:
+                current = current + 1 if previous is not None and d - previous == timedelta(days=1) else 1
+            else:
+                current = 0
+            longest = max(longest, current)
+            previous = d
+        return {'current': current, 'longest': longest}
+
+
+    def task_history(self, task: str) -> List[Dict[str, Any]]:
+        """
+        Every stored occurrence of a task, by name, oldest first
+        """
+        with sqlite_connection(self.path) as conn:
+            rows = conn.execute(
+                'SELECT day, path, passed FROM task_rows WHERE task = ? ORDER BY day', (task,)
+            ).fetchall()
+        return [{'day': day, 'path': path, 'passed': bool(passed)} for day, path, passed in rows]
+
+
+    def most_failed_tasks(self, limit: int = 10) -> List[Tuple[str, int, int]]:
+        """
+        (task, failures, occurrences) of the most often failed tasks
+        """
+        with sqlite_connection(self.path) as conn:
+            return conn.execute(
+                'SELECT task, SUM(1 - passed) AS failures, COUNT(*) FROM task_rows '
+                'GROUP BY task HAVING failures > 0 ORDER BY failures DESC, task LIMIT ?', (limit,)
+            ).fetchall()
+
+
+def backfill_history(processor, store: TaskHistoryStore, since: Optional[date] = None) -> int:
+    """
+    Walk every month page and day toggle and store the parsed days.
+    Month pages are listed one by one, day trees are fetched concurrently through the tree fetcher.
+
+    Args:
+        processor: A NotionProcessor, whose client, page index and tree fetcher are used
+        store: Where the days are written
+        since: Skip days before this date
+
+    Returns:
+        The number of days stored
+    """
+    month_pages = processor.page_index.discover_month_pages(processor.notion)
+    stored = 0
+    for month, page_id in sorted(month_pages.items(), key=lambda item: datetime.strptime(item[0], '%m/%Y')):
+        if since is not None and datetime.strptime(month, '%m/%Y').date() < since.replace(day=1):
+            continue
+        page = processor.notion.pages.retrieve(page_id=page_id)
+        version = get_cache_version(page['last_edited_time'])
+
+        days = []
+        for block in iter_block_children(processor.notion, page_id):
+            if block['type'] != 'toggle':
+                continue
+            text = block['toggle']['rich_text'][0]['plain_text']
+            if not is_day_title(text):
+                continue
+            processor.page_index.put_day_block(text, block['id'], page_id)
+            day = datetime.strptime(text, '%d/%m/%Y').date()
+            if since is None or day >= since:
+                days.append((day, block))
+
+        trees = asyncio.run(processor.tree_fetcher.fetch_trees([(block, version) for _, block in days]))
+        for (day, _), all_tasks in zip(days, trees):
+            store.put_day(day, all_tasks)
+        stored += len(days)
+        print(f'{month}: stored {len(days)} days')
+    return stored
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Backfill and query the local task history')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    backfill_parser = subparsers.add_parser('backfill', help='Crawl every month page into the local store')
+    backfill_parser.add_argument('--since', type=date.fromisoformat, default=None, help='First day to store (yyyy-mm-dd)')
+    subparsers.add_parser('stats', help='Print streaks, monthly rates and the most failed tasks')
+    task_parser = subparsers.add_parser('task', help='Print the history of one task')
+    task_parser.add_argument('name')
+    args = parser.parse_args()
+
+    store = TaskHistoryStore()
+    if args.command == 'backfill':
+        from notion.processor import NotionProcessor
+        from notion.rate_limiter import notion_priority, Priority
+        with notion_priority(Priority.ADHOC):
+            count = backfill_history(NotionProcessor(), store, args.since)
+        print(f'Stored {count} days')
+    elif args.command == 'stats':
+        print('Streaks:', store.streaks())
+        print('Monthly completion rates:', store.monthly_completion_rates())
+        print('Most failed tasks:', store.most_failed_tasks())
+    elif args.command == 'task':
+        for row in store.task_history(args.name):
+            print(row)
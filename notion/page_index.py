@@ -0,0 +1,140 @@
+import re
+from datetime import datetime
+from typing_extensions import Dict, Any, Optional, Iterator
+
+from storage import data_path, sqlite_connection
+
+
+def get_page_title(page: Dict[str, Any]) -> str:
+    """
+    Return the plain text title of a page, whatever its title property is called
+    """
+    for prop in page.get('properties', {}).values():
+        if prop.get('type') == 'title':
+            return ''.join(item['plain_text'] for item in prop['title'])
+    return ''
+
+
+def is_month_title(title: str, mm: str, yyyy: str) -> bool:
+    """
+    Check if a page title names the given month, e.g. '06/2025', '6/2025' or 'Tháng 6-2025'
+    """
+    pattern = rf'(?<!\d)0?{int(mm)}[/\-.]{yyyy}(?!\d)'
+    return re.search(pattern, title) is not None
+
+
+def parse_month_title(title: str) -> Optional[str]:
+    """
+    Get the month ('mm/yyyy') a page title names, if any
+    """
+    match = re.search(r'(?<!\d)(\d{1,2})[/\-.](\d{4})(?!\d)', title)
+    if match is None or not 1 <= int(match.group(1)) <= 12:
+        return None
+    return f'{int(match.group(1)):02d}/{match.group(2)}'
+
+
+def is_day_title(text: str) -> bool:
+    try:
+        datetime.strptime(text, '%d/%m/%Y')
+        return True
+    except ValueError:
+        return False
+
+
+class PageIndex:
+    """
+    Persistent index of month -> Notion page id and date (dd/mm/yyyy) -> day toggle block id.
+    Month pages are found by title search the first time they are needed, day blocks are
+    recorded whenever a month page is scanned.
+    """
+    def __init__(self, path: Optional[str] = None) -> None:
+        self.path = path or data_path('notion_index.sqlite3')
+        with sqlite_connection(self.path) as conn:
+            conn.execute('CREATE TABLE IF NOT EXISTS month_pages (month TEXT PRIMARY KEY, page_id TEXT NOT NULL)')
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS day_blocks (day TEXT PRIMARY KEY, block_id TEXT NOT NULL, page_id TEXT NOT NULL)'
+            )
+
+
+    def get_month_page(self, month: str) -> Optional[str]:
+        with sqlite_connection(self.path) as conn:
+            row = conn.execute('SELECT page_id FROM month_pages WHERE month = ?', (month,)).fetchone()
+        return row[0] if row else None
+
+
+    def put_month_page(self, month: str, page_id: str) -> None:
+        with sqlite_connection(self.path) as conn:
+            conn.execute('INSERT OR REPLACE INTO month_pages (month, page_id) VALUES (?, ?)', (month, page_id))
+
+
+    def get_month_pages(self) -> Dict[str, str]:
+        with sqlite_connection(self.path) as conn:
+            rows = conn.execute('SELECT month, page_id FROM month_pages').fetchall()
+        return dict(rows)
+
+
+    def get_day_block(self, day: str) -> Optional[str]:
+        with sqlite_connection(self.path) as conn:
+            row = conn.execute('SELECT block_id FROM day_blocks WHERE day = ?', (day,)).fetchone()
+        return row[0] if row else None
+
+
+    def put_day_block(self, day: str, block_id: str, page_id: str) -> None:
+        with sqlite_connection(self.path) as conn:
+            conn.execute(
+                'INSERT OR REPLACE INTO day_blocks (day, block_id, page_id) VALUES (?, ?, ?)', (day, block_id, page_id)
+            )
+
+
+    def forget_day_block(self, day: str) -> None:
+        with sqlite_connection(self.path) as conn:
+            conn.execute('DELETE FROM day_blocks WHERE day = ?', (day,))
+
+
+    def iter_pages(self, client, query: str) -> Iterator[Dict[str, Any]]:
+        """
+        Lazily yield the pages returned by a Notion search, following pagination cursors
+        """
+        start_cursor = None
+        while True:
+            kwargs = {'query': query, 'filter': {'property': 'object', 'value': 'page'}, 'page_size': 100}
+            if start_cursor is not None:
+                kwargs['start_cursor'] = start_cursor
+            response = client.search(**kwargs)
+            for page in response['results']:
+                yield page
+            if not response.get('has_more'):
+                return
+            start_cursor = response['next_cursor']
+
+
+    def discover_month_pages(self, client) -> Dict[str, str]:
+        """
+        Index every month page the integration can see, returns month -> page id
+        """
+        for page in self.iter_pages(client, ''):
+            if page.get('archived') or page.get('in_trash'):
+                continue
+            month = parse_month_title(get_page_title(page))
+            if month is not None and self.get_month_page(month) is None:
+                self.put_month_page(month, page['id'])
+        return self.get_month_pages()
+
+
+    def find_month_page(self, client, mm: str, yyyy: str) -> Optional[str]:
+        """
+        Get the page id of a month, searching Notion by title if it is not indexed yet.
+        Misses are not recorded, so a month page created later is picked up on the next call.
+        """
+        month = f'{mm}/{yyyy}'
+        page_id = self.get_month_page(month)
+        if page_id is not None:
+            return page_id
+
+        for page in self.iter_pages(client, yyyy):
+            if page.get('archived') or page.get('in_trash'):
+                continue
+            if is_month_title(get_page_title(page), mm, yyyy):
+                self.put_month_page(month, page['id'])
+                return page['id']
+        return None
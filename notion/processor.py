@@ -1,6 +1,7 @@
 import os
 from notion_client import Client
 import json
+import time
 from datetime import datetime
 from typing_extensions import List, Dict, Tuple, Optional, Any, Literal, Union
 from dotenv import load_dotenv
@@ -8,95 +9,118 @@ import pdb
 
 load_dotenv()
 
-from utils import get_current_date, check_and_punish, TaskCheckResponse
+from utils import get_current_date, check_and_punish, TaskCheckResponse, StagedData
+from logger import logger
 from llm.gemini import GeminiProcessor
+from notion.blocks import clean_emoji_from_text, iter_block_children, parse_toggle_block, record_block_tree
+from notion.tree_fetcher import AsyncTreeFetcher
+from notion.block_cache import BlockCache, get_cache_version
+from notion.page_index import PageIndex, is_day_title
+from notion.task_tree import TaskNode, TreeEvaluation, evaluate_tree
+from notion.rate_limiter import NotionRequestScheduler, notion_scheduler, notion_priority, Priority
+from notion.history import TaskHistoryStore
 
 
-# page ids
-PAGE_IDS = {
-    '04/2025': '1c8eb477f91a808fb882d3bf01310b8d',
-    '05/2025': '1e6eb477f91a805195c2fb2fb2551c67',
-    '06/2025': '206eb477f91a8034b579f68bc2a8d282'
-}
-
 class NotionProcessor:
-    def __init__(self) -> None:
-        self.notion = Client(auth=os.getenv('NOTION_API_KEY'))
-        self.llm = GeminiProcessor()
+    def __init__(self, client: Optional[Any] = None, async_client: Optional[Any] = None, scheduler: Optional[NotionRequestScheduler] = notion_scheduler,
+                 llm: Optional[GeminiProcessor] = None) -> None:
+        """
+        Args:
+            client: Sync Notion client, a real Client by default (e.g. a FakeNotionClient for offline runs)
+            async_client: Async Notion client for tree fetches, a new AsyncClient per fetch by default
+            scheduler: Rate limiter every call goes through, None to call the clients directly
+            llm: Gemini processor of the content checks, a new GeminiProcessor by default
+        """
+        client = client if client is not None else Client(auth=os.getenv('NOTION_API_KEY'))
+        self.notion = scheduler.wrap(client) if scheduler is not None else client
+        self.llm = llm if llm is not None else GeminiProcessor()
+        self.block_cache = BlockCache()
+        self.page_index = PageIndex()
+        self.staged_tasks: Optional[StagedData] = None
+        self.history = TaskHistoryStore()
+        self.tree_fetcher = AsyncTreeFetcher(client=async_client, cache=self.block_cache, scheduler=scheduler)
 
 
     def clean_emoji_from_text(self, text: str) -> str:
-        for emoji in ['✅', '❌', '⌛']:
-            text = text.replace(emoji, '')
-        return text.strip()
+        return clean_emoji_from_text(text)
 
     def parse_toggle_block(self, block) -> Union[bool, Dict[str, Any]]:
-        assert block["type"] == "toggle"
-        toggle_text = block["toggle"]["rich_text"][0]["plain_text"]
-        d = {}
-        sub_blocks = self.notion.blocks.children.list(block_id=block["id"])
-        text_content = []
-        for sub_block in sub_blocks['results']:
-            if sub_block['type'] == 'toggle':
-                text = sub_block["toggle"]["rich_text"][0]["plain_text"]
-                text = self.clean_emoji_from_text(text)
-                d[text] = self.parse_toggle_block(sub_block)
-            elif sub_block['type'] == 'to_do':
-                text = sub_block["to_do"]["rich_text"][0]["plain_text"]
-                text = self.clean_emoji_from_text(text)
-                checked = sub_block["to_do"]["checked"]
-                d[text] = {'result': 'PASS' if checked else 'FAIL', 'text_content': text}
-            elif sub_block['type'] == 'paragraph':
-                text = sub_block["paragraph"]["rich_text"][0]["plain_text"]
-                text = self.clean_emoji_from_text(text)
-                text_content.append(text)
-        
-        text_content = '\n'.join(text_content)
-        if len(d) == 0: # empty toggle
-            d['text_content'] = text_content
-            is_completed = '✅' in toggle_text
-            return {'result': 'PASS' if is_completed else 'FAIL', 'text_content': text_content}
-        else:
-            d['text_content'] = text_content
-
-        return d
+        """
+        Sequentially parse a toggle block, one API call per nested toggle.
+        Prefer self.tree_fetcher, which expands sibling toggles concurrently.
+        """
+        return parse_toggle_block(self.notion, block)
     
 
-    def get_today_tasks(self) -> Union[Dict[str, Any], None]:
+    def find_day_block(self, page_id: str, day: str) -> Optional[Dict[str, Any]]:
         """
-        Get today's tasks from the Notion page
+        Find the toggle block of a day (dd/mm/yyyy), going straight to it if it is indexed,
+        otherwise scanning the month page and indexing every day toggle seen on the way
         """
-        current_date = get_current_date()
-        dd, mm, yyyy = current_date.split('/')
-        page_blocks = self.notion.blocks.children.list(block_id=PAGE_IDS[f'{mm}/{yyyy}'])
+        block_id = self.page_index.get_day_block(day)
+        if block_id is not None:
+            block = self.notion.blocks.retrieve(block_id=block_id)
+            if block["type"] == "toggle" and not block.get("archived") and not block.get("in_trash") \
+                    and block["toggle"]["rich_text"][0]["plain_text"] == day:
+                return block
+            # the toggle was deleted or renamed since it was indexed
+            self.page_index.forget_day_block(day)
 
-        today_block = None
-        for block in page_blocks["results"]:
+        # stop paging through the month as soon as the day's toggle is found
+        for block in iter_block_children(self.notion, page_id):
             if block["type"] == "toggle":
                 toggle_text = block["toggle"]["rich_text"][0]["plain_text"]
-                if toggle_text == current_date:
-                    today_block = block
-                    break
-        if today_block is None:
+                if is_day_title(toggle_text):
+                    self.page_index.put_day_block(toggle_text, block["id"], page_id)
+                if toggle_text == day:
+                    return block
+        return None
+
+
+    def get_day_tasks(self, day: str) -> Union[Dict[str, Any], None]:
+        """
+        Get the tasks of a day (dd/mm/yyyy) from its month page
+        """
+        dd, mm, yyyy = day.split('/')
+        page_id = self.page_index.find_month_page(self.notion, mm, yyyy)
+        if page_id is None:
             return None
 
-        all_tasks = self.parse_toggle_block(today_block)
+        # one call tells whether anything on the month page changed since the cached snapshot
+        page = self.notion.pages.retrieve(page_id=page_id)
+        version = get_cache_version(page['last_edited_time'])
+
+        day_block = self.block_cache.get_day_block(page_id, day, version)
+        if day_block is None:
+            day_block = self.find_day_block(page_id, day)
+            if day_block is None:
+                return None
+            self.block_cache.put_day_block(page_id, day, version, day_block)
+
+        return self.tree_fetcher.sync_fetch_tree(day_block, version)
+
+
+    def get_today_tasks(self) -> Union[Dict[str, Any], None]:
+        """
+        Get today's tasks from the Notion page
+        """
+        all_tasks = self.get_day_tasks(get_current_date())
+        if all_tasks is None:
+            return None
         with open('test.json', 'w') as f:
             json.dump(all_tasks, f, indent=4, ensure_ascii=False)
         return all_tasks
 
 
+    def evaluate_tasks(self, all_tasks, prefix='') -> TreeEvaluation:
+        root = TaskNode.from_dict(all_tasks)
+        if root.is_leaf: # a day without any task has nothing left to do
+            return TreeEvaluation()
+        return evaluate_tree(root, prefix)
+
+
     def check_complete_task(self, all_tasks, prefix=''):
-        incomplete_tasks = []
-        for k, v in all_tasks.items():
-            if not isinstance(v, dict):
-                continue
-            if set(v.keys()) == {'result', 'text_content'}:
-                if v['result'] == 'FAIL':
-                    incomplete_tasks.append(f'{prefix}/{k}')
-            else:
-                incomplete_tasks.extend(self.check_complete_task(v, f'{prefix}/{k}'))
-        return incomplete_tasks
+        return self.evaluate_tasks(all_tasks, prefix).incomplete_tasks
 
 
     def check_task_content(self, task_content:str):
@@ -110,7 +134,7 @@ class NotionProcessor:
             f'Please check if the morning note is actually valid and meaningful, or it\'s just some random bullshit that I write to mark the task as completed.'
             f'If it is valid, please return "PASS", otherwise return "FAIL". The response should only contain "PASS" or "FAIL" and nothing else.'
         )
-        response = self.llm.llm_request(user_prompt=prompt)
+        response = self.llm.llm_request(user_prompt=prompt, check_name='task_content')
         result = 'PASS' if 'pass' in response.lower() else 'FAIL'
         return result
 
@@ -154,6 +178,20 @@ class NotionProcessor:
         )
 
 
+    def warm_up(self) -> None:
+        """
+        Prefetch and stage today's task tree ahead of the evening check
+        """
+        day = get_current_date()
+        try:
+            start = time.time()
+            with notion_priority(Priority.WARMUP):
+                self.staged_tasks = StagedData(day=day, data=self.get_day_tasks(day))
+            logger.info(f"Staged tasks of {day} in {time.time() - start:.2f}s")
+        except Exception as e:
+            logger.error(f"Error staging tasks of {day}: {str(e)}")
+
+
     @check_and_punish('check_tasks_completion')
     def check_tasks_completion(self) -> TaskCheckResponse:
         """
@@ -161,18 +199,31 @@ class NotionProcessor:
         Returns a result with PASS/FAIL status.
         """
         is_pass, message, status = False, 'Not complete tasks', 'SUCCESS'
+        staged = self.staged_tasks if self.staged_tasks is not None and self.staged_tasks.is_fresh() else None
+        # judge the day the warm-up ran for, even if this job starts after midnight
+        day = staged.day if staged is not None else get_current_date()
         try:
-            all_tasks = self.get_today_tasks()
+            # the warm-up filled the block cache, so this only fetches what changed since then
+            all_tasks = self.get_day_tasks(day)
         except Exception as e:
-            return TaskCheckResponse(
-                result='PASS',
-                message=f'Error checking task completion: {str(e)}',
-                status='FAIL'
-            )
+            if staged is None:
+                return TaskCheckResponse(
+                    result='PASS',
+                    message=f'Error checking task completion: {str(e)}',
+                    status='FAIL'
+                )
+            logger.warning(f"Error fetching tasks of {day}, falling back to the warm-up snapshot: {str(e)}")
+            all_tasks = staged.data
 
         if all_tasks is not None:
-            incomplete_tasks = self.check_complete_task(all_tasks)
-            if len(incomplete_tasks) == 0:
+            try:
+                self.history.put_day(datetime.strptime(day, '%d/%m/%Y').date(), all_tasks)
+            except Exception as e:
+                # the history is best effort, the verdict does not depend on it
+                logger.error(f"Error saving task history of {day}: {str(e)}")
+            evaluation = self.evaluate_tasks(all_tasks)
+            message = f'Not complete tasks: {evaluation.passed}/{evaluation.total} done, missing {evaluation.incomplete_tasks}'
+            if len(evaluation.incomplete_tasks) == 0:
                 is_pass = True
                 message = 'All tasks completed!'
                 status = 'SUCCESS'
@@ -204,7 +255,17 @@ class NotionProcessor:
 
 
 if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Print a day's tasks, optionally recording its block tree as a fixture")
+    parser.add_argument('--day', default=None, help='dd/mm/yyyy, today by default')
+    parser.add_argument('--record', default=None, help='Path of a fixture JSON file to record the day tree into')
+    args = parser.parse_args()
+
     np = NotionProcessor()
-    tasks = np.get_today_tasks()
-    pdb.set_trace()
-    print(f'done')
+    day = args.day or get_current_date()
+    print(json.dumps(np.get_day_tasks(day), indent=4, ensure_ascii=False))
+    if args.record:
+        dd, mm, yyyy = day.split('/')
+        day_block = np.find_day_block(np.page_index.find_month_page(np.notion, mm, yyyy), day)
+        record_block_tree(np.notion, day_block, args.record)
+        print(f'Recorded {day} into {args.record}')
@@ -0,0 +1,204 @@
+import os
+import time
+import heapq
+import asyncio
+import itertools
+import threading
+from enum import IntEnum
+from contextlib import contextmanager
+from contextvars import ContextVar
+from notion_client import APIResponseError
+from notion_client.errors import APIErrorCode
+from typing_extensions import Dict, Any, Optional, Callable, Iterator
+
+from logger import logger
+
+
+# Notion allows an average of 3 requests per second per integration
+NOTION_RATE_LIMIT = float(os.getenv('NOTION_RATE_LIMIT', 3))
+NOTION_BURST = int(os.getenv('NOTION_BURST', 3))
+NOTION_MAX_RETRIES = int(os.getenv('NOTION_MAX_RETRIES', 5))
+
+
+class Priority(IntEnum):
+    """Lower values are served first"""
+    DEADLINE = 0 # scheduled checks
+    WARMUP = 1
+    ADHOC = 2 # manual /check-now calls, backfills
+
+
+_request_priority: ContextVar[Priority] = ContextVar('notion_request_priority', default=Priority.DEADLINE)
+
+
+@contextmanager
+def notion_priority(priority: Priority) -> Iterator[None]:
+    """
+    Set the priority of the Notion requests made in this context, including
+    worker threads started with asyncio.to_thread and tasks created inside it
+    """
+    token = _request_priority.set(priority)
+    try:
+        yield
+    finally:
+        _request_priority.reset(token)
+
+
+def is_rate_limited(e: Exception) -> bool:
+    return isinstance(e, APIResponseError) and (e.status == 429 or e.code == APIErrorCode.RateLimited)
+
+
+def get_retry_after(e: APIResponseError, attempt: int) -> float:
+    """
+    Seconds to wait before retrying, from the Retry-After header or an exponential back-off
+    """
+    headers = getattr(e, 'headers', None)
+    value = headers.get('retry-after') if headers is not None else None
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return float(2 ** attempt)
+
+
+class NotionRequestScheduler:
+    """
+    Process-wide token bucket shared by every Notion call, sync or async, from any thread.
+    Waiting requests are served by priority, then in arrival order. A 429 pauses the whole
+    bucket for the Retry-After duration before the request is retried.
+    """
+    def __init__(self, rate: float = NOTION_RATE_LIMIT, burst: int = NOTION_BURST, max_retries: int = NOTION_MAX_RETRIES) -> None:
+        self.rate = rate
+        self.burst = burst
+        self.max_retries = max_retries
+        self._tokens = float(burst)
+        self._last_refill = time.monotonic()
+        self._blocked_until = 0.0
+        self._condition = threading.Condition()
+        self._waiters = []
+        self._counter = itertools.count()
+        self._stats = {
+            'requests': 0,
+            'rate_limited': 0,
+            'total_wait_seconds': 0.0,
+            'max_wait_seconds': 0.0,
+            'requests_by_priority': {priority.name: 0 for priority in Priority},
+        }
+
+
+    def _refill(self, now: float) -> None:
+        self._tokens = min(self.burst, self._tokens + (now - self._last_refill) * self.rate)
+        self._last_refill = now
+
+
+    def acquire(self, priority: Optional[Priority] = None) -> float:
+        """
+        Block until the request may be sent. Returns the time spent waiting in the queue.
+        """
+        priority = _request_priority.get() if priority is None else priority
+        start = time.monotonic()
+        entry = (int(priority), next(self._counter))
+        with self._condition:
+            heapq.heappush(self._waiters, entry)
+            try:
+                while True:
+                    now = time.monotonic()
+                    self._refill(now)
+                    if self._waiters[0] == entry and self._tokens >= 1 and now >= self._blocked_until:
+                        break
+                    if now < self._blocked_until:
+                        timeout = self._blocked_until - now
+                    else:
+                        timeout = max((1 - self._tokens) / self.rate, 0.001)
+                    self._condition.wait(timeout)
+                self._tokens -= 1
+            finally:
+                self._waiters.remove(entry)
+                heapq.heapify(self._waiters)
+                self._condition.notify_all()
+
+            wait = time.monotonic() - start
+            self._stats['requests'] += 1
+            self._stats['requests_by_priority'][Priority(priority).name] += 1
+            self._stats['total_wait_seconds'] += wait
+            self._stats['max_wait_seconds'] = max(self._stats['max_wait_seconds'], wait)
+        if wait > 1:
+            logger.info(f"Notion request waited {wait:.2f}s in queue", priority=Priority(priority).name)
+        return wait
+
+
+    def _on_rate_limited(self, e: APIResponseError, attempt: int) -> float:
+        retry_after = get_retry_after(e, attempt)
+        with self._condition:
+            self._stats['rate_limited'] += 1
+            self._blocked_until = max(self._blocked_until, time.monotonic() + retry_after)
+            self._tokens = 0
+            self._condition.notify_all()
+        logger.warning(f"Notion rate limited, pausing requests for {retry_after:.1f}s")
+        return retry_after
+
+
+    def call(self, func: Callable, *args, **kwargs) -> Any:
+        priority = _request_priority.get()
+        for attempt in range(self.max_retries + 1):
+            self.acquire(priority)
+            try:
+                return func(*args, **kwargs)
+            except APIResponseError as e:
+                if not is_rate_limited(e) or attempt == self.max_retries:
+                    raise
+                self._on_rate_limited(e, attempt)
+
+
+    async def acall(self, func: Callable, *args, **kwargs) -> Any:
+        priority = _request_priority.get()
+        for attempt in range(self.max_retries + 1):
+            # the bucket is shared with sync callers in other threads, so wait for it off the event loop
+            await asyncio.to_thread(self.acquire, priority)
+            try:
+                return await func(*args, **kwargs)
+            except APIResponseError as e:
+                if not is_rate_limited(e) or attempt == self.max_retries:
+                    raise
+                self._on_rate_limited(e, attempt)
+
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._condition:
+            stats = dict(self._stats, requests_by_priority=dict(self._stats['requests_by_priority']))
+            stats['queue_length'] = len(self._waiters)
+        stats['avg_wait_seconds'] = stats['total_wait_seconds'] / stats['requests'] if stats['requests'] else 0.0
+        return stats
+
+
+    def wrap(self, client: Any) -> 'ScheduledClient':
+        return ScheduledClient(client, self, is_async=False)
+
+
+    def wrap_async(self, client: Any) -> 'ScheduledClient':
+        return ScheduledClient(client, self, is_async=True)
+
+
+class ScheduledClient:
+    """
+    Proxy around a Notion client that sends every endpoint call, e.g.
+    client.blocks.children.list(...), through a NotionRequestScheduler
+    """
+    def __init__(self, target: Any, scheduler: NotionRequestScheduler, is_async: bool) -> None:
+        self._target = target
+        self._scheduler = scheduler
+        self._is_async = is_async
+
+    def __getattr__(self, name: str) -> Any:
+        attr = getattr(self._target, name)
+        if not callable(attr) or isinstance(attr, type):
+            return ScheduledClient(attr, self._scheduler, self._is_async)
+        if self._is_async:
+            async def scheduled_call(*args, **kwargs):
+                return await self._scheduler.acall(attr, *args, **kwargs)
+        else:
+            def scheduled_call(*args, **kwargs):
+                return self._scheduler.call(attr, *args, **kwargs)
+        return scheduled_call
+
+
+# Shared by every Notion client in the process
+notion_scheduler = NotionRequestScheduler()
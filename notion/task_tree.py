@@ -0,0 +1,144 @@
+from dataclasses import dataclass, field
+from typing_extensions import List, Dict, Any, Optional, Iterator, Tuple
+
+
+class TaskNode:
+    """
+    A node of a parsed task tree. Leaves (to_dos and empty toggles) carry a result,
+    sections carry children. __slots__ keeps many days of trees cheap to hold in memory.
+    """
+    __slots__ = ('name', 'result', 'text_content', 'children')
+
+    def __init__(self, name: str, result: Optional[str] = None, text_content: str = '', children: Optional[List['TaskNode']] = None) -> None:
+        self.name = name
+        self.result = result
+        self.text_content = text_content
+        self.children = children if children is not None else []
+
+    @property
+    def is_leaf(self) -> bool:
+        return self.result is not None
+
+    def __repr__(self) -> str:
+        if self.is_leaf:
+            return f'TaskNode({self.name!r}, result={self.result!r})'
+        return f'TaskNode({self.name!r}, children={len(self.children)})'
+
+
+    @classmethod
+    def from_dict(cls, tasks: Dict[str, Any], name: str = '') -> 'TaskNode':
+        """
+        Build a tree from the dict returned by NotionProcessor.get_today_tasks, without recursion
+        """
+        root = cls(name)
+        stack = [(root, tasks)]
+        while stack:
+            node, d = stack.pop()
+            if set(d.keys()) == {'result', 'text_content'}:
+                node.result = d['result']
+                node.text_content = d['text_content']
+                continue
+            node.text_content = d.get('text_content', '')
+            for k, v in d.items():
+                if not isinstance(v, dict):
+                    continue
+                child = cls(k)
+                node.children.append(child)
+                stack.append((child, v))
+        return root
+
+
+    def to_dict(self) -> Dict[str, Any]:
+        """
+        Convert back to the nested dict shape
+        """
+        root: Dict[str, Any] = {}
+        stack = [(self, root)]
+        while stack:
+            node, d = stack.pop()
+            if node.is_leaf:
+                d['result'] = node.result
+                d['text_content'] = node.text_content
+                continue
+            for child in node.children:
+                d[child.name] = {}
+                stack.append((child, d[child.name]))
+            d['text_content'] = node.text_content
+        return root
+
+
+@dataclass
+class TreeEvaluation:
+    incomplete_tasks: List[str] = field(default_factory=list)
+    passed: int = 0
+    failed: int = 0
+    section_ratios: Dict[str, float] = field(default_factory=dict) # section path -> ratio of passed tasks under it
+
+    @property
+    def total(self) -> int:
+        return self.passed + self.failed
+
+    @property
+    def completion_ratio(self) -> float:
+        return self.passed / self.total if self.total else 1.0
+
+
+def iter_tasks(root: TaskNode, prefix: str = '') -> Iterator[Tuple[str, TaskNode]]:
+    """
+    Yield (path, leaf) for every task of a tree, in page order
+    """
+    stack = [(root, prefix)]
+    while stack:
+        node, path = stack.pop()
+        if node.is_leaf:
+            yield path, node
+            continue
+        for child in reversed(node.children):
+            stack.append((child, f'{path}/{child.name}'))
+
+
+def evaluate_tree(root: TaskNode, prefix: str = '') -> TreeEvaluation:
+    """
+    Evaluate a task tree in one iterative pass.
+
+    Args:
+        root: The root of the tree (the day toggle)
+        prefix: Path prefix of the root, task paths look like '{prefix}/section/task'
+
+    Returns:
+        The incomplete task paths in page order, pass/fail counts and per-section completion ratios
+    """
+    evaluation = TreeEvaluation()
+    # per-section [passed, total], filled in when the section is left
+    counts: Dict[int, List[int]] = {}
+    # (node, path, parent counts, entered)
+    stack = [(root, prefix, None, False)]
+    while stack:
+        node, path, parent_counts, entered = stack.pop()
+        if node.is_leaf:
+            passed = node.result == 'PASS'
+            if passed:
+                evaluation.passed += 1
+            else:
+                evaluation.failed += 1
+                evaluation.incomplete_tasks.append(path)
+            if parent_counts is not None:
+                parent_counts[0] += passed
+                parent_counts[1] += 1
+            continue
+
+        if not entered:
+            node_counts = counts[id(node)] = [0, 0]
+            stack.append((node, path, parent_counts, True))
+            # reversed so that children are visited in page order
+            for child in reversed(node.children):
+                stack.append((child, f'{path}/{child.name}', node_counts, False))
+            continue
+
+        passed, total = counts.pop(id(node))
+        if node is not root:
+            evaluation.section_ratios[path] = passed / total if total else 1.0
+        if parent_counts is not None:
+            parent_counts[0] += passed
+            parent_counts[1] += total
+    return evaluation
@@ -0,0 +1,92 @@
+import os
+import asyncio
+from notion_client import AsyncClient
+from typing_extensions import List, Dict, Any, Optional, Tuple
+
+from notion.blocks import build_toggle_dict, aiter_block_children
+from notion.block_cache import BlockCache
+from notion.rate_limiter import NotionRequestScheduler, notion_scheduler
+
+
+NOTION_MAX_CONCURRENCY = int(os.getenv('NOTION_MAX_CONCURRENCY', 3))
+
+
+class AsyncTreeFetcher:
+    """
+    Fetch a toggle tree with the Notion async client, expanding sibling toggles concurrently.
+    The result has the same shape as NotionProcessor.parse_toggle_block.
+    """
+    def __init__(
+        self,
+        client: Optional[AsyncClient] = None,
+        max_concurrency: int = NOTION_MAX_CONCURRENCY,
+        cache: Optional[BlockCache] = None,
+        scheduler: Optional[NotionRequestScheduler] = notion_scheduler
+    ) -> None:
+        self.client = client
+        self.max_concurrency = max_concurrency
+        self.cache = cache
+        self.scheduler = scheduler
+
+
+    async def list_children(self, client: AsyncClient, semaphore: asyncio.Semaphore, block_id: str) -> List[Dict[str, Any]]:
+        return [block async for block in aiter_block_children(client, block_id, semaphore=semaphore)]
+
+
+    async def _get_children(self, client: AsyncClient, semaphore: asyncio.Semaphore, block_id: str, version: Optional[str]) -> List[Dict[str, Any]]:
+        if self.cache is not None:
+            children = self.cache.get_children(block_id, version)
+            if children is not None:
+                return children
+        children = await self.list_children(client, semaphore, block_id)
+        if self.cache is not None:
+            self.cache.put_children(block_id, version, children)
+        return children
+
+
+    async def _parse_toggle(self, client: AsyncClient, semaphore: asyncio.Semaphore, block: Dict[str, Any], version: Optional[str]) -> Dict[str, Any]:
+        assert block["type"] == "toggle"
+        sub_blocks = await self._get_children(client, semaphore, block["id"], version)
+        toggles = [sub_block for sub_block in sub_blocks if sub_block['type'] == 'toggle']
+        # the semaphore is only held around API calls, so recursing here cannot deadlock
+        parsed = await asyncio.gather(*[self._parse_toggle(client, semaphore, toggle, version) for toggle in toggles])
+        parsed_toggles = {toggle['id']: d for toggle, d in zip(toggles, parsed)}
+        return build_toggle_dict(block, sub_blocks, parsed_toggles)
+
+
+    async def fetch_tree(self, block: Dict[str, Any], version: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Fetch and parse the whole tree under a toggle block.
+
+        Args:
+            block: The toggle block to expand
+            version: Cache version of the containing page (see BlockCache). Children cached under
+                the same version are reused, the rest are fetched and stored. None disables the cache.
+        """
+        trees = await self.fetch_trees([(block, version)])
+        return trees[0]
+
+
+    async def fetch_trees(self, blocks: List[Tuple[Dict[str, Any], Optional[str]]]) -> List[Dict[str, Any]]:
+        """
+        Fetch several toggle trees at once, e.g. every day of a month, sharing one client and one concurrency limit
+
+        Args:
+            blocks: (toggle block, cache version) pairs, see fetch_tree
+        """
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+        if self.client is not None:
+            client = self._schedule(self.client)
+            return await asyncio.gather(*[self._parse_toggle(client, semaphore, block, version) for block, version in blocks])
+        # the async client is bound to the event loop it was created in, and every check runs its own loop
+        async with AsyncClient(auth=os.getenv('NOTION_API_KEY')) as raw_client:
+            client = self._schedule(raw_client)
+            return await asyncio.gather(*[self._parse_toggle(client, semaphore, block, version) for block, version in blocks])
+
+
+    def _schedule(self, client: AsyncClient) -> Any:
+        return self.scheduler.wrap_async(client) if self.scheduler is not None else client
+
+
+    def sync_fetch_tree(self, block: Dict[str, Any], version: Optional[str] = None) -> Dict[str, Any]:
+        return asyncio.run(self.fetch_tree(block, version))
@@ -0,0 +1,63 @@
+import threading
+from typing import Optional
+
+from web3 import Web3
+
+from logger import logger
+
+
+class NonceManager:
+    """
+    Hands out the nonces of one sender in-process, so that transfers can be submitted back-to-back
+    without a get_transaction_count round trip each, and concurrent checks never share a nonce.
+    Syncs with the node's pending nonce on first use and after every error.
+    """
+    def __init__(self, w3: Web3, address: Optional[str]) -> None:
+        self.w3 = w3
+        self.address = address
+        self._next: Optional[int] = None
+        self._lock = threading.Lock()
+
+
+    def _fetch(self) -> None:
+        # callers hold the lock
+        self._next = self.w3.eth.get_transaction_count(self.address, 'pending')
+        logger.info(f"Nonce of {self.address} synced at {self._next}")
+
+
+    def sync(self) -> int:
+        """
+        Take the next nonce from the node, counting the transactions still in the mempool
+
+        Returns:
+            The next nonce
+        """
+        with self._lock:
+            self._fetch()
+            return self._next
+
+
+    def reset(self) -> None:
+        """
+        Forget the local nonce, the next allocation syncs with the node again
+        """
+        with self._lock:
+            self._next = None
+
+
+    def rebind(self, w3: Web3) -> None:
+        """
+        Use a new connection, the next allocation syncs with its node
+        """
+        with self._lock:
+            self.w3 = w3
+            self._next = None
+
+
+    def allocate(self) -> int:
+        with self._lock:
+            if self._next is None:
+                self._fetch()
+            nonce = self._next
+            self._next += 1
+            return nonce
@@ -3,40 +3,61 @@ import web3
 from web3 import Web3
 from eth_account import Account
 import json
+from typing import Optional, Any, List, Tuple
+from concurrent.futures import ThreadPoolExecutor
+from hexbytes import HexBytes
 from dotenv import load_dotenv
 from logger import logger
+from send_token.nonce import NonceManager
 import pdb
 
 load_dotenv()
 
 
+# Arbitrum One
+CHAIN_ID = 42161
+# USDC has 6 decimal places
+USDC_DECIMALS = 6
+# ABI for USDC transfer function (simplified)
+TRANSFER_ABI = [{
+    "constant": False, "inputs": [{"name": "_to", "type": "address"}, {"name": "_value", "type": "uint256"}],
+    "name": "transfer", "outputs": [{"name": "", "type": "bool"}], "type": "function"
+}]
+USDC_RECEIPT_TIMEOUT = int(os.getenv('USDC_RECEIPT_TIMEOUT', 1200))
+
+
 class TokenProcessor:
     def __init__(self):
         self.private_key = os.getenv('PRIVATE_KEY')
         self.infura_url = os.getenv('INFURA_URL')
         self.usdc_contract_address = Web3.to_checksum_address(os.getenv('ARBITRUM_USDC_CONTRACT_ADDRESS'))
         self.w3 = Web3(Web3.HTTPProvider(self.infura_url))
+        # one manager for the life of the processor, concurrent transfers must share it
+        self._nonces = NonceManager(self.w3, Account.from_key(self.private_key).address if self.private_key else None)
 
 
     def reload(self):
         self.w3 = Web3(Web3.HTTPProvider(self.infura_url))
+        # the new connection starts from the node's pending nonce
+        self._nonces.rebind(self.w3)
 
 
-    def send_usdc(self, recipient_address: str, amount: float=0.01) -> bool:
-        """
-        Sends a specified amount of USDC to a recipient address on the Arbitrum network.
+    @property
+    def nonces(self) -> NonceManager:
+        return self._nonces
 
-        Args:
-            recipient_address: The Ethereum address of the recipient.
-            amount: The amount of USDC to send (e.g., 0.01).
 
-        Returns:
-            True if the transaction was successful, False otherwise.
+    def sync_nonce(self) -> None:
         """
-        if not self.w3.is_connected():
-            logger.error("Error: Not connected to Ethereum network.")
-            return False
+        Sync the local nonce with the node ahead of the first transfer, errors are only logged
+        """
+        try:
+            self.nonces.sync()
+        except Exception as e:
+            logger.error(f"Could not sync the nonce: {str(e)}")
 
+
+    def _validate(self, recipient_address: str, amount: float) -> bool:
         if not Web3.is_address(recipient_address):
             logger.error(f"Error: Invalid recipient address: {recipient_address}")
             return False
@@ -44,48 +65,39 @@ class TokenProcessor:
         if amount <= 0:
             logger.error(f"Error: Amount must be positive: {amount}")
             return False
+        return True
 
-        try:
-            # Ensure recipient address is checksummed
-            checksum_recipient_address = Web3.to_checksum_address(recipient_address)
-
-            # USDC has 6 decimal places
-            amount_in_units = int(amount * 10**6)
-
-            # ABI for USDC transfer function (simplified)
-            transfer_abi = [{
-                "constant": False, "inputs": [{"name": "_to", "type": "address"}, {"name": "_value", "type": "uint256"}],
-                "name": "transfer", "outputs": [{"name": "", "type": "bool"}], "type": "function"
-            }]
 
-            # Create contract instance
-            contract = self.w3.eth.contract(address=self.usdc_contract_address, abi=transfer_abi)
-
-            # Get sender account and nonce
-            account = Account.from_key(self.private_key)
-            sender_address = account.address
-            nonce = self.w3.eth.get_transaction_count(sender_address)
-
-            # Estimate Gas Limit
-            gas_estimate = contract.functions.transfer(
-                checksum_recipient_address,
-                amount_in_units
-            ).estimate_gas({'from': sender_address})
-            # Add a buffer (e.g., 20%) to the estimate for safety
-            gas_limit = int(gas_estimate * 1.2)
-
-            # Get current gas price and add buffer
-            gas_price = self.w3.eth.gas_price
-            gas_price_with_buffer = int(gas_price * 1.2) # 20% buffer
+    def _submit(self, contract: Any, sender_address: str, recipient_address: str, amount: float, gas_price: int) -> HexBytes:
+        """
+        Sign and send one transfer with the next local nonce, without waiting for it to be mined
 
+        Returns:
+            The transaction hash
+        """
+        # Ensure recipient address is checksummed
+        checksum_recipient_address = Web3.to_checksum_address(recipient_address)
+        amount_in_units = int(amount * 10**USDC_DECIMALS)
+
+        # Estimate Gas Limit
+        gas_estimate = contract.functions.transfer(
+            checksum_recipient_address,
+            amount_in_units
+        ).estimate_gas({'from': sender_address})
+        # Add a buffer (e.g., 20%) to the estimate for safety
+        gas_limit = int(gas_estimate * 1.2)
+
+        # the nonce is taken last, so that a failed estimate does not leave a gap
+        nonce = self.nonces.allocate()
+        try:
             # Build transaction
             transaction = contract.functions.transfer(
                 checksum_recipient_address,
                 amount_in_units
             ).build_transaction({
-                'chainId': 42161,  # Arbitrum One
+                'chainId': CHAIN_ID,
                 'gas': gas_limit,
-                'gasPrice': gas_price_with_buffer,
+                'gasPrice': gas_price,
                 'nonce': nonce,
                 'from': sender_address # Optional but good practice
             })
@@ -93,51 +105,121 @@ class TokenProcessor:
             # Sign and send transaction
             signed_txn = self.w3.eth.account.sign_transaction(transaction, self.private_key)
             tx_hash = self.w3.eth.send_raw_transaction(signed_txn.raw_transaction)
-            logger.info(f"Transaction submitted. Waiting for confirmation... TX Hash: {tx_hash.hex()}")
-
-            # Wait for transaction receipt with a timeout
-            receipt = self.w3.eth.wait_for_transaction_receipt(tx_hash, timeout=1200) # Wait up to 120 seconds
-
-            # Check transaction status from receipt
-            if receipt['status'] == 1:
-                gas_used = receipt['gasUsed']
-                effective_gas_price = receipt.get('effectiveGasPrice', gas_price_with_buffer) # Use effective if available (EIP-1559), else fallback
-                gas_cost_eth = Web3.from_wei(gas_used * effective_gas_price, 'ether')
-
-                print("\n--- Transaction Successful! ---")
-                print(f"  Recipient: {checksum_recipient_address}")
-                print(f"  Amount Sent: {amount} USDC")
-                print(f"  Transaction Hash: {receipt['transactionHash'].hex()}")
-                print(f"  Block Number: {receipt['blockNumber']}")
-                print(f"  Gas Used: {gas_used}")
-                print(f"  Effective Gas Price: {Web3.from_wei(effective_gas_price, 'gwei')} Gwei")
-                print(f"  Transaction Fee: {gas_cost_eth:.8f} ETH")
-                print("-----------------------------\n")
-                return True
-            else:
-                print("\n--- Transaction Failed! ---")
-                print(f"  Transaction Hash: {receipt['transactionHash'].hex()}")
-                print(f"  Status Code: {receipt['status']}")
-                print(f"  Block Number: {receipt['blockNumber']}")
-                print("  Reason: Transaction reverted by EVM.") # More specific reasons often require decoding revert messages
-                print("---------------------------\n")
-                return False
-
-        except Exception as e:
-            print(f"\n--- An Error Occurred ---")
-            print(f"  Error Type: {type(e).__name__}")
-            print(f"  Error Message: {str(e)}")
-            # Specific checks for common issues
-            if "replacement transaction underpriced" in str(e):
-                 print("  Possible Cause: Nonce conflict or insufficient gas price increase for replacement.")
-            elif "insufficient funds" in str(e):
-                 print("  Possible Cause: Not enough ETH in the sender account to cover gas fees + transaction value (if sending ETH).")
-            elif "nonce too low" in str(e):
-                 print("  Possible Cause: Trying to reuse a nonce that has already been confirmed.")
+        except Exception:
+            # the nonce may be used or skipped, take it from the node again
+            self.nonces.reset()
+            raise
+        logger.info(f"Transaction submitted with nonce {nonce}. TX Hash: {tx_hash.hex()}")
+        return tx_hash
+
+
+    def _report_receipt(self, receipt: Any, recipient_address: str, amount: float, gas_price: int) -> bool:
+        # Check transaction status from receipt
+        if receipt['status'] == 1:
+            gas_used = receipt['gasUsed']
+            effective_gas_price = receipt.get('effectiveGasPrice', gas_price) # Use effective if available (EIP-1559), else fallback
+            gas_cost_eth = Web3.from_wei(gas_used * effective_gas_price, 'ether')
+
+            print("\n--- Transaction Successful! ---")
+            print(f"  Recipient: {Web3.to_checksum_address(recipient_address)}")
+            print(f"  Amount Sent: {amount} USDC")
+            print(f"  Transaction Hash: {receipt['transactionHash'].hex()}")
+            print(f"  Block Number: {receipt['blockNumber']}")
+            print(f"  Gas Used: {gas_used}")
+            print(f"  Effective Gas Price: {Web3.from_wei(effective_gas_price, 'gwei')} Gwei")
+            print(f"  Transaction Fee: {gas_cost_eth:.8f} ETH")
+            print("-----------------------------\n")
+            return True
+        else:
+            print("\n--- Transaction Failed! ---")
+            print(f"  Transaction Hash: {receipt['transactionHash'].hex()}")
+            print(f"  Status Code: {receipt['status']}")
+            print(f"  Block Number: {receipt['blockNumber']}")
+            print("  Reason: Transaction reverted by EVM.") # More specific reasons often require decoding revert messages
             print("---------------------------\n")
             return False
 
 
+    def _report_error(self, e: Exception) -> None:
+        print(f"\n--- An Error Occurred ---")
+        print(f"  Error Type: {type(e).__name__}")
+        print(f"  Error Message: {str(e)}")
+        # Specific checks for common issues
+        if "replacement transaction underpriced" in str(e):
+             print("  Possible Cause: Nonce conflict or insufficient gas price increase for replacement.")
+        elif "insufficient funds" in str(e):
+             print("  Possible Cause: Not enough ETH in the sender account to cover gas fees + transaction value (if sending ETH).")
+        elif "nonce too low" in str(e):
+             print("  Possible Cause: Trying to reuse a nonce that has already been confirmed.")
+        print("---------------------------\n")
+
+
+    def send_usdc_batch(self, transfers: List[Tuple[str, float]]) -> List[bool]:
+        """
+        Sends several USDC transfers on the Arbitrum network: every transaction is submitted
+        back-to-back with consecutive nonces, then all the receipts are waited for together.
+
+        Args:
+            transfers: (recipient address, amount of USDC) pairs
+
+        Returns:
+            Whether each transfer was successful, in order
+        """
+        if not self.w3.is_connected():
+            logger.error("Error: Not connected to Ethereum network.")
+            return [False] * len(transfers)
+
+        succeeded = [False] * len(transfers)
+        try:
+            # Create contract instance
+            contract = self.w3.eth.contract(address=self.usdc_contract_address, abi=TRANSFER_ABI)
+            sender_address = Account.from_key(self.private_key).address
+            # Get current gas price and add buffer, once for the whole batch
+            gas_price_with_buffer = int(self.w3.eth.gas_price * 1.2) # 20% buffer
+        except Exception as e:
+            self._report_error(e)
+            return succeeded
+
+        submitted = []
+        for i, (recipient_address, amount) in enumerate(transfers):
+            if not self._validate(recipient_address, amount):
+                continue
+            try:
+                submitted.append((i, self._submit(contract, sender_address, recipient_address, amount, gas_price_with_buffer)))
+            except Exception as e:
+                self._report_error(e)
+
+        if not submitted:
+            return succeeded
+        logger.info(f"Submitted {len(submitted)} transactions. Waiting for confirmation...")
+
+        def wait(i: int, tx_hash: HexBytes) -> None:
+            recipient_address, amount = transfers[i]
+            try:
+                receipt = self.w3.eth.wait_for_transaction_receipt(tx_hash, timeout=USDC_RECEIPT_TIMEOUT)
+                succeeded[i] = self._report_receipt(receipt, recipient_address, amount, gas_price_with_buffer)
+            except Exception as e:
+                self._report_error(e)
+
+        with ThreadPoolExecutor(max_workers=len(submitted)) as pool:
+            list(pool.map(lambda item: wait(*item), submitted))
+        return succeeded
+
+
+    def send_usdc(self, recipient_address: str, amount: float=0.01) -> bool:
+        """
+        Sends a specified amount of USDC to a recipient address on the Arbitrum network.
+
+        Args:
+            recipient_address: The Ethereum address of the recipient.
+            amount: The amount of USDC to send (e.g., 0.01).
+
+        Returns:
+            True if the transaction was successful, False otherwise.
+        """
+        return self.send_usdc_batch([(recipient_address, amount)])[0]
+
+
 if __name__ == '__main__':
     # Example: Send 0.01 USDC
     tp = TokenProcessor()
@@ -2,76 +2,178 @@ from dotenv import load_dotenv
 load_dotenv()
 
 import os
-import pdb
-from datetime import datetime, timedelta, timezone
-import time
+import asyncio
+import contextlib
+import tempfile
+from datetime import datetime, date
+from typing import Optional, Any, List, Dict, BinaryIO
 from slack_sdk import WebClient
 import requests
-from PIL import Image
-from PIL.ExifTags import TAGS
+from requests.adapters import HTTPAdapter
+
+from logger import logger
+from llm.resilience import LLMUnavailableError
+from media.pipeline import MediaPipeline, BANGKOK_TZ
+from media.store import MediaResult, media_key
+from media.evidence import Evidence
+from utils import TaskCheckResponse
+
+SLACK_CHANNEL_ID = os.getenv('SLACK_CHANNEL_ID', 'C090BDZDZ27') # self-improvement channel
+# Messages per conversations.history page, Slack recommends at most 200
+SLACK_HISTORY_PAGE_SIZE = int(os.getenv('SLACK_HISTORY_PAGE_SIZE', 200))
+# Files downloaded at the same time, also the size of the connection pool
+SLACK_MAX_DOWNLOADS = int(os.getenv('SLACK_MAX_DOWNLOADS', 8))
+# Files are written in chunks of this size, to memory then to a temporary file above SLACK_SPILL_BYTES
+SLACK_DOWNLOAD_CHUNK_BYTES = 64 * 1024
+SLACK_SPILL_BYTES = int(os.getenv('SLACK_SPILL_BYTES', 10 * 1024 * 1024))
+SLACK_DOWNLOAD_TIMEOUT = int(os.getenv('SLACK_DOWNLOAD_TIMEOUT', 60))
+
+
+def make_session(token: Optional[str], pool_size: int = SLACK_MAX_DOWNLOADS) -> requests.Session:
+    """
+    HTTP session authorized for Slack file downloads, keeping up to pool_size connections open
+    """
+    session = requests.Session()
+    session.headers['Authorization'] = f'Bearer {token}'
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+    session.mount('https://', adapter)
+    return session
 
-current_dir = os.path.dirname(os.path.abspath(__file__))
-project_dir = os.path.dirname(current_dir)
 
 class SlackBot:
-    def __init__(self):
+    name = 'slack'
+
+    def __init__(self, client: Optional[Any] = None, session: Optional[requests.Session] = None,
+                 pipeline: Optional[MediaPipeline] = None):
+        """
+        Args:
+            client: A slack_sdk WebClient by default
+            session: Session used for the file downloads, a pooled one authorized with the bot token by default
+            pipeline: Evaluates the images, the same media pipeline (store, verdicts) as the Telegram checks by default
+        """
         self.bot_token = os.getenv('SLACK_BOT_TOKEN')
-        self.client = WebClient(token=self.bot_token)
-        self.channel_id = 'C090BDZDZ27' # self-improvement channel
-    
+        self.client = client if client is not None else WebClient(token=self.bot_token)
+        self.channel_id = SLACK_CHANNEL_ID
+        self.session = session if session is not None else make_session(self.bot_token)
+        self.pipeline = pipeline if pipeline is not None else MediaPipeline()
+        self.max_downloads = SLACK_MAX_DOWNLOADS
+
     def get_channel_list(self):
         response = self.client.conversations_list()
         for channel in response["channels"]:
             print(channel["name"], "=>", channel["id"])
 
-    def download_file(self, url, save_path):
-        headers = {"Authorization": f"Bearer {self.bot_token}"}
-        r = requests.get(url, headers=headers)
-        with open(save_path, "wb") as out:
-            out.write(r.content)
-
-    def get_channel_history(self):
-        # Define GMT+7 timezone
-        gmt7 = timezone(timedelta(hours=7))
-
-        # Get "today" in GMT+7
-        now = datetime.now(gmt7)
-        start_of_day = now.replace(hour=0, minute=0, second=0, microsecond=0)
-        end_of_day = now.replace(hour=23, minute=59, second=59, microsecond=999999)
-
-        # Convert to Unix timestamps (Slack uses UTC-based Unix timestamps)
-        start_ts = start_of_day.timestamp()
-        end_ts = end_of_day.timestamp()
-
-        response = self.client.conversations_history(
-            channel=self.channel_id,
-            oldest=str(start_ts),
-            latest=str(end_ts)
-        )
-        valid_images = []
-        today = datetime.now(gmt7).date()
-        for message in response["messages"]:
-            files = message.get("files", [])
-            if len(files) == 0:
+    def download_file(self, url: str, out: BinaryIO) -> int:
+        """
+        Stream a private file into out, chunk by chunk
+
+        Returns:
+            The number of bytes written
+        """
+        size = 0
+        with self.session.get(url, stream=True, timeout=SLACK_DOWNLOAD_TIMEOUT) as r:
+            r.raise_for_status()
+            for chunk in r.iter_content(chunk_size=SLACK_DOWNLOAD_CHUNK_BYTES):
+                out.write(chunk)
+                size += len(chunk)
+        return size
+
+    @contextlib.asynccontextmanager
+    async def download(self, url: str, semaphore: asyncio.Semaphore):
+        """
+        Download a file into a buffer that spills to a temporary file above SLACK_SPILL_BYTES, released on exit
+        """
+        with tempfile.SpooledTemporaryFile(max_size=SLACK_SPILL_BYTES) as out:
+            async with semaphore:
+                await asyncio.to_thread(self.download_file, url, out)
+            out.seek(0)
+            yield out
+
+    def get_messages(self, oldest: float, latest: float) -> List[Dict[str, Any]]:
+        """
+        Every message of the channel between two Unix timestamps, following the history cursor
+
+        Returns:
+            The messages, oldest first
+        """
+        messages = []
+        cursor = None
+        while True:
+            response = self.client.conversations_history(
+                channel=self.channel_id,
+                oldest=str(oldest),
+                latest=str(latest),
+                limit=SLACK_HISTORY_PAGE_SIZE,
+                cursor=cursor
+            )
+            messages.extend(response["messages"])
+            cursor = (response.get("response_metadata") or {}).get("next_cursor")
+            if not response.get("has_more") or not cursor:
+                break
+        return sorted(messages, key=lambda message: float(message["ts"]))
+
+    async def collect(self, day: Optional[date] = None) -> List[Evidence]:
+        """
+        Evidence of a local (Bangkok) day: the text of every message and file posted in the channel.
+        Only the images among the last len(morning_prompts) items can be the morning images, those
+        are evaluated (downloaded concurrently), the earlier ones are left without a result.
+
+        Returns:
+            The evidence, in posting order
+        """
+        day = day or datetime.now(BANGKOK_TZ).date()
+        start_of_day = BANGKOK_TZ.localize(datetime.combine(day, datetime.min.time()))
+        end_of_day = BANGKOK_TZ.localize(datetime.combine(day, datetime.max.time()))
+        messages = await asyncio.to_thread(self.get_messages, start_of_day.timestamp(), end_of_day.timestamp())
+
+        evidence, files = [], []
+        for message in messages:
+            sent_at = datetime.fromtimestamp(float(message["ts"]), BANGKOK_TZ)
+            images = [f for f in message.get("files", []) if f.get("mimetype", "").startswith("image/")]
+            if not images:
+                evidence.append(Evidence(source=self.name, message_id=message["ts"], sent_at=sent_at, text=message.get("text") or None))
+                files.append(None)
+            for f in images:
+                evidence.append(Evidence(source=self.name, message_id=f'{message["ts"]}/{f["id"]}', sent_at=sent_at, text=message.get("text") or None))
+                files.append(f)
+
+        semaphore = asyncio.Semaphore(self.max_downloads)
+        window = len(self.pipeline.morning_prompts)
+        with_images, evaluations = [], []
+        for item, f in zip(evidence[-window:], files[-window:]):
+            if f is None:
                 continue
-            for f in files:
-                print("File name:", f["name"])
-                print("Download URL:", f["url_private_download"])
-                save_path = os.path.join(project_dir, 'downloads', f["name"])
-                self.download_file(f["url_private_download"], save_path)
-            
-                im = Image.open(save_path)
-                exif_data = im._getexif()
-                for tag_id, value in exif_data.items():
-                    tag = TAGS.get(tag_id, tag_id)
-                    if tag == 'DateTimeOriginal':
-                        dt_bangkok = datetime.strptime(value, '%Y:%m:%d %H:%M:%S')
-                        if dt_bangkok.date() == today:
-                            valid_images.append(im)
-                            print(f'Append image to list')
-                            # os.remove(save_path)
-        pdb.set_trace()
+            print("File name:", f["name"])
+            with_images.append(item)
+            evaluations.append(self.pipeline.evaluate(
+                media_key('slack', f["id"]), 'slack', item.sent_at.date(), 'morning',
+                lambda url=f["url_private_download"]: self.download(url, semaphore)
+            ))
+        results = await asyncio.gather(*evaluations, return_exceptions=True)
+        for result in results:
+            if isinstance(result, BaseException):
+                raise result
+        for item, result in zip(with_images, results):
+            item.media = result
+        logger.info(f"Evaluated {len(results)} Slack images of {day}")
+        return evidence
+
+    async def get_channel_history(self, day: Optional[date] = None) -> List[MediaResult]:
+        """
+        Results of the images among the last messages of the channel on a local (Bangkok) day, in posting order
+        """
+        return [item.media for item in await self.collect(day) if item.media is not None]
+
+    async def check_morning_images(self) -> TaskCheckResponse:
+        today = datetime.now(BANGKOK_TZ).date()
+        try:
+            evidence = await self.collect(today)
+        except LLMUnavailableError as e:
+            return TaskCheckResponse(result='PASS', message=f'Could not classify images: {str(e)}', status='FAIL')
+        # the last messages of the day are the morning images, one per criteria in order
+        last = evidence[-len(self.pipeline.morning_prompts):]
+        return self.pipeline.judge_morning_images([item.media for item in last if item.media is not None], today)
 
 if __name__ == "__main__":
     bot = SlackBot()
-    bot.get_channel_history()
+    print(asyncio.run(bot.check_morning_images()))
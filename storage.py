@@ -0,0 +1,29 @@
+import os
+import sqlite3
+from contextlib import contextmanager
+from typing import Iterator
+
+# Local state (caches, indexes, history) lives here
+DATA_DIR = os.getenv('DATA_DIR', 'data')
+os.makedirs(DATA_DIR, exist_ok=True)
+
+
+def data_path(name: str) -> str:
+    """
+    Get the path of a file inside the data directory
+    """
+    return os.path.join(DATA_DIR, name)
+
+
+@contextmanager
+def sqlite_connection(path: str) -> Iterator[sqlite3.Connection]:
+    """
+    Open a short-lived SQLite connection that commits on success and is always closed.
+    One connection per operation keeps the stores safe to use from scheduler threads.
+    """
+    conn = sqlite3.connect(path, timeout=30)
+    try:
+        with conn:
+            yield conn
+    finally:
+        conn.close()
@@ -1,143 +1,314 @@
+import io
 import os
+import tempfile
 from dotenv import load_dotenv
 load_dotenv()
 
 import asyncio
-from datetime import datetime, timezone
-import pytz
-import pdb
+import contextlib
+import time
+import threading
+import weakref
+from datetime import datetime, timezone, date
+from typing import Optional, Any, List, Dict
 
 from telegram import Bot
-from PIL import Image
-from PIL.ExifTags import TAGS
+from telegram.request import HTTPXRequest
 from logger import logger
 import json_repair
 
-from llm.gemini import GeminiProcessor
-from utils import TaskCheckResponse, get_current_date, check_and_punish
+from llm.gemini import AsyncGeminiProcessor
+from llm.resilience import LLMUnavailableError
+from media.metadata import read_metadata
+from media.pipeline import MediaPipeline, BANGKOK_TZ
+from media.store import MediaStore, MediaResult, media_key, drop_duplicates
+from media.evidence import Evidence
+from telegram_bot.update_store import UpdateStore
+from utils import TaskCheckResponse, StagedData, get_current_date, check_and_punish
 
-gemini = GeminiProcessor()
+# Updates fetched per getUpdates call, the Bot API maximum
+TELEGRAM_UPDATES_LIMIT = 100
+# Connections kept open to the Bot API, and files downloaded at the same time
+TELEGRAM_CONNECTION_POOL_SIZE = int(os.getenv('TELEGRAM_CONNECTION_POOL_SIZE', 8))
+TELEGRAM_MAX_DOWNLOADS = int(os.getenv('TELEGRAM_MAX_DOWNLOADS', TELEGRAM_CONNECTION_POOL_SIZE))
+# Files larger than this are downloaded to a temporary file instead of memory
+TELEGRAM_SPILL_BYTES = int(os.getenv('TELEGRAM_SPILL_BYTES', 10 * 1024 * 1024))
+# How often a session waits for the bot to be released by a check running in another thread
+SESSION_LOCK_POLL_SECONDS = 0.05
+
+
+def make_bot() -> Bot:
+    return Bot(
+        token=os.getenv('TELEGRAM_BOT_TOKEN'),
+        request=HTTPXRequest(connection_pool_size=TELEGRAM_CONNECTION_POOL_SIZE)
+    )
 
-BANGKOK_TZ = pytz.timezone('Asia/Bangkok')
 
 class TelegramProcessor:
-    def __init__(self):
-        self.bot = Bot(token=os.getenv('TELEGRAM_BOT_TOKEN'))
-        
-        self.morning_prompts = [
-            (
-                f'You are an expert image content analyzer. '
-                f'Your tasks is to analyze the provided image and check if it depicts:\n'
-                f'- A Scots English center building\n'
-                f'- The image should contain a building with Scots English banners outside\n'
-                f'Respond ONLY with:\n'
-                f'"true" - if the image content meets the criteria\n'
-                f'"false" - otherwise'
-            ),
-            (
-                f'You are an expert image content analyzer. '
-                f'Your tasks is to analyze the provided image and check if it depicts:\n'
-                f'- A shirtless man taking a shower\n'
-                f'- The shower and running water should be visible in the frame\n'
-                f'Respond ONLY with:\n'
-                f'"true" - if the image content meets the criteria\n'
-                f'"false" - otherwise'
-            ),
-        ]
+    name = 'telegram'
+
+    def __init__(self, bot: Optional[Any] = None, async_gemini_processor: Optional[AsyncGeminiProcessor] = None,
+                 update_store: Optional[UpdateStore] = None, media_store: Optional[MediaStore] = None):
+        """
+        Args:
+            bot: A telegram Bot by default (e.g. a FakeTelegramBot for offline runs)
+            async_gemini_processor: Classifies the morning images and reads the workout infos, the shared module processor by default
+            update_store: Consumed updates and the getUpdates offset, in the data directory by default
+            media_store: Per-image verdicts and workout infos, in the data directory by default
+        """
+        self.bot = bot if bot is not None else make_bot()
+        self.pipeline = MediaPipeline(async_gemini_processor, media_store)
+        self.staged_workouts: Optional[StagedData] = None
+        self.update_store = update_store if update_store is not None else UpdateStore()
+        # set while an ingest worker consumes the updates, checks then read the update store without polling
+        self.streaming = False
+        self.max_downloads = TELEGRAM_MAX_DOWNLOADS
+        # open sessions per event loop, the lock guarding each loop's opening and closing of the bot,
+        # and the lock held by the loop using the bot
+        self._session_users: Dict[asyncio.AbstractEventLoop, int] = {}
+        self._session_locks = weakref.WeakKeyDictionary()
+        self._session_lock = threading.Lock()
+        self._download_semaphore = None
+        self._semaphore_loop = None
+
+
+    @contextlib.asynccontextmanager
+    async def session(self):
+        """
+        Keep the bot and its connection pool open. Sessions of the same event loop, nested or
+        concurrent, share it and the last one to exit shuts it down. The bot's pool is bound to the
+        loop that opened it and every check runs its own loop in a scheduler thread, so sessions of
+        different loops wait for each other.
+        """
+        loop = asyncio.get_running_loop()
+        async with self._session_locks.setdefault(loop, asyncio.Lock()):
+            if loop not in self._session_users:
+                # polled rather than blocking a thread, so a cancelled wait never leaves the lock taken
+                while not self._session_lock.acquire(blocking=False):
+                    await asyncio.sleep(SESSION_LOCK_POLL_SECONDS)
+                try:
+                    await self.bot.__aenter__()
+                except BaseException:
+                    self._session_lock.release()
+                    raise
+                self._session_users[loop] = 0
+            self._session_users[loop] += 1
+        try:
+            yield self.bot
+        finally:
+            self._session_users[loop] -= 1
+            if self._session_users[loop] == 0:
+                # shielded, a cancelled session still hands the bot over to the other threads
+                await asyncio.shield(self._close_session(loop))
+
+
+    async def _close_session(self, loop: asyncio.AbstractEventLoop) -> None:
+        async with self._session_locks[loop]:
+            if self._session_users.get(loop) != 0:
+                return # reused by a session that started in the meantime, or already closed
+            del self._session_users[loop]
+            try:
+                await self.bot.__aexit__(None, None, None)
+            finally:
+                self._session_lock.release()
+
+
+    def _get_download_semaphore(self) -> asyncio.Semaphore:
+        # bound to the event loop it was first used in, and every check runs its own loop
+        loop = asyncio.get_running_loop()
+        if self._download_semaphore is None or self._semaphore_loop is not loop:
+            self._download_semaphore = asyncio.Semaphore(self.max_downloads)
+            self._semaphore_loop = loop
+        return self._download_semaphore
 
-        
 
     async def get_me(self):
-        async with self.bot:
+        async with self.session():
             info = await self.bot.get_me()
             return info
 
-    async def get_today_updates(self):
-        async with self.bot:
-            updates = await self.bot.get_updates()
-            today = datetime.now(BANGKOK_TZ).date()
-            filtered = []
-            for update in updates:
-                msg = update.message
-                if msg:
-                    # Convert UTC datetime to Bangkok timezone
-                    local_dt = msg.date.astimezone(BANGKOK_TZ)
-                    if local_dt.date() == today:
-                        filtered.append(update)
-            return filtered
+    async def poll_updates(self) -> int:
+        """
+        Fetch the updates that arrived since the last poll into the update store.
+        Each call passes the stored offset, which also acknowledges the updates Telegram sent before.
+
+        Returns:
+            The number of new message updates
+        """
+        added = 0
+        async with self.session():
+            while True:
+                updates = await self.bot.get_updates(offset=self.update_store.get_offset(), limit=TELEGRAM_UPDATES_LIMIT, timeout=0)
+                if not updates:
+                    break
+                added += self.update_store.put_updates(updates)
+                if len(updates) < TELEGRAM_UPDATES_LIMIT:
+                    break
+        logger.info(f"Polled {added} new Telegram messages")
+        return added
+
+
+    async def get_today_updates(self, today: Optional[date] = None):
+        """
+        Message updates of a local (Bangkok) day, in arrival order, from the update store after a poll
+        """
+        if not self.streaming:
+            await self.poll_updates()
+        today = today or datetime.now(BANGKOK_TZ).date()
+        return self.update_store.get_day_updates(today, self.bot)
+
+
+    @contextlib.asynccontextmanager
+    async def download(self, file_id: str):
+        """
+        Download a file into a BytesIO, or into a temporary file above TELEGRAM_SPILL_BYTES,
+        released on exit. At most max_downloads files are downloaded at the same time.
+        """
+        source = None
+        try:
+            async with self._get_download_semaphore(), self.session():
+                file = await self.bot.get_file(file_id)
+                if file.file_size is None or file.file_size <= TELEGRAM_SPILL_BYTES:
+                    source = io.BytesIO()
+                    await file.download_to_memory(source)
+                else:
+                    logger.info(f"Spilling {file.file_size} bytes of {file_id} to disk")
+                    fd, source = tempfile.mkstemp(prefix='telegram-')
+                    os.close(fd)
+                    await file.download_to_drive(source)
+            yield source
+        finally:
+            if isinstance(source, str):
+                os.remove(source)
+            elif source is not None:
+                source.close()
+
+
+    async def evaluate_update(self, update) -> Optional[MediaResult]:
+        """
+        Compute and store the result of an image message through the media pipeline: the
+        criteria verdicts of a morning document, the extracted info of a workout photo.
+
+        Returns:
+            The image result, None for messages without an image to check
+        """
+        msg = update.message
+        if msg is None:
+            return None
+        if msg.photo and msg.caption == 'theduc':
+            kind, media = 'workout', msg.photo[-1]
+        elif msg.document:
+            kind, media = 'morning', msg.document
+        else:
+            return None
+
+        day = msg.date.astimezone(BANGKOK_TZ).date()
+        return await self.pipeline.evaluate(
+            media_key('telegram', media.file_unique_id), 'telegram', day, kind, lambda: self.download(media.file_id)
+        )
+
+
+    async def _evaluate_all(self, updates) -> List[Optional[MediaResult]]:
+        # concurrently in one bot session, the results stay aligned with the updates
+        async with self.session():
+            results = await asyncio.gather(*(self.evaluate_update(update) for update in updates), return_exceptions=True)
+        for result in results:
+            if isinstance(result, BaseException):
+                raise result
+        return results
+
+
+    async def evaluate_updates(self, updates) -> List[MediaResult]:
+        """
+        Evaluate the updates concurrently in one bot session
+
+        Returns:
+            The image results, in update order
+        """
+        return [result for result in await self._evaluate_all(updates) if result is not None]
+
+
+    async def collect(self, day: Optional[date] = None) -> List[Evidence]:
+        """
+        Evidence of a local (Bangkok) day: every message with its text and image result, in arrival order
+        """
+        async with self.session():
+            updates = await self.get_today_updates(day)
+            results = await self._evaluate_all(updates)
+        return [
+            Evidence(
+                source=self.name,
+                message_id=str(update.update_id),
+                sent_at=update.message.date,
+                text=update.message.text or update.message.caption,
+                media=result
+            )
+            for update, result in zip(updates, results)
+        ]
 
 
     async def check_morning_images(self):
-        updates = await self.get_today_updates()
-        valid_images = []
         today = datetime.now(BANGKOK_TZ).date()
-        for i, update in enumerate(updates):
-            if i < len(updates) - len(self.morning_prompts):
-                continue
-            # if i < len(updates) - 1:
-            #     continue
-            # pdb.set_trace()
-            msg = update.message
-            if msg.text:
-                print("Text:", msg.text)
-
-            elif msg.document:
-                file_id = msg.document.file_id
-                file_name = msg.document.file_name or f"{file_id}"
-                print('Document:', file_name)
-                save_path = f"downloads/{file_name}"
-                async with self.bot:
-                    file = await self.bot.get_file(file_id)
-                    await file.download_to_drive(save_path)
-                im = Image.open(save_path)
-                exif_data = im._getexif()
-                for tag_id, value in exif_data.items():
-                    tag = TAGS.get(tag_id, tag_id)
-                    if tag == 'DateTimeOriginal':
-                        # Parse EXIF datetime and localize to Bangkok
-                        dt_bangkok = datetime.strptime(value, '%Y:%m:%d %H:%M:%S')
-                        if dt_bangkok.date() == today:
-                            im = Image.open(save_path)
-                            valid_images.append(im)
-                            print(f'Append image to list')
-                            os.remove(save_path)
-
-        if len(valid_images) != len(self.morning_prompts):
-            return TaskCheckResponse(result='FAIL', message='Not enough images', status='FAIL')
-        
-        for i, (im, prompt) in enumerate(zip(valid_images, self.morning_prompts)):
-            result = gemini.llm_request(user_prompt=prompt, images=[im])
-            if result == 'false':
-                return TaskCheckResponse(result='FAIL', message='Invalid image', status='FAIL')
-            else:
-                print(f'Image {i} is valid')
+        # one bot session for the poll and every download
+        async with self.session():
+            updates = await self.get_today_updates(today)
+            # the last messages of the day are the morning images, one per criteria in order
+            updates = updates[-len(self.pipeline.morning_prompts):]
+            for update in updates:
+                if update.message.text:
+                    print("Text:", update.message.text)
+            try:
+                # normally already computed by the ingest worker when the images arrived
+                results = await self.evaluate_updates(updates)
+            except LLMUnavailableError as e:
+                return TaskCheckResponse(result='PASS', message=f'Could not classify images: {str(e)}', status='FAIL')
+        return self.pipeline.judge_morning_images(results, today)
+
 
-        return TaskCheckResponse(result='PASS', message='All images are valid', status='PASS')
+    async def warm_up(self) -> None:
+        """
+        Download and extract today's workout photos ahead of the evening check
+        """
+        day = get_current_date()
+        today = datetime.strptime(day, '%d/%m/%Y').date()
+        try:
+            start = time.time()
+            async with self.session():
+                updates = await self.get_today_updates(today)
+                self.staged_workouts = StagedData(day=day, data=await self.evaluate_updates(updates))
+            logger.info(f"Staged {len(self.staged_workouts.data)} images of {day} in {time.time() - start:.2f}s")
+        except Exception as e:
+            logger.error(f"Error staging workout photos of {day}: {str(e)}")
+
+
+    def sync_warm_up(self):
+        return asyncio.run(self.warm_up())
 
 
     async def check_workout_images(self):
-        updates = await self.get_today_updates()
-        today = datetime.now(BANGKOK_TZ).date()
-        result = []
-        for i, update in enumerate(updates):
-            msg = update.message
-            if msg.photo and msg.caption == 'theduc':
-                file_id = msg.photo[-1].file_id
-                print('Photo:', file_id)
-                save_path = f"downloads/{file_id}.jpg"
-                async with self.bot:
-                    file = await self.bot.get_file(file_id)
-                    await file.download_to_drive(save_path)
-                im = Image.open(save_path)
-                info = gemini.get_workout_info(im)
-                result.append(info)
+        staged = self.staged_workouts if self.staged_workouts is not None and self.staged_workouts.is_fresh() else None
+        # judge the day the warm-up ran for, even if this job starts after midnight
+        if staged is not None:
+            today = datetime.strptime(staged.day, '%d/%m/%Y').date()
+        else:
+            today = datetime.now(BANGKOK_TZ).date()
+        async with self.session():
+            updates = await self.get_today_updates(today)
+            # only photos sent after the ingest worker or the warm-up still need a download and an LLM call
+            try:
+                results = await self.evaluate_updates(updates)
+            except LLMUnavailableError as e:
+                return TaskCheckResponse(result='PASS', message=f'Could not read workout images: {str(e)}', status='FAIL')
+        # a screenshot sent twice, or already counted another day, only counts once
+        # images that could not be decoded have no info
+        result = [result.info for result in drop_duplicates([result for result in results if result.kind == 'workout']) if result.info is not None]
         
         summed_distance = 0
         for i, info in enumerate(result):
             info = json_repair.loads(info)
-            date = info['date'] # DD/MM/YYYY
+            date_str = info['date'] # DD/MM/YYYY
             try:
-                date_obj = datetime.strptime(date, '%d/%m/%Y').date()
+                date_obj = datetime.strptime(date_str, '%d/%m/%Y').date()
                 # Check if the date is today
                 if date_obj != today:
                     continue
@@ -152,7 +323,7 @@ class TelegramProcessor:
                         print(f"Could not parse distance: {distance}")
                         return TaskCheckResponse(result='PASS', message='Could not parse distance', status='FAIL')
             except ValueError:
-                print(f"Could not parse date: {date}")
+                print(f"Could not parse date: {date_str}")
                 return TaskCheckResponse(result='PASS', message='Could not parse date', status='FAIL')
         if summed_distance < 2.5:
             return TaskCheckResponse(result='FAIL', message=f'Summed distance: {summed_distance} km', status='PASS')
@@ -175,7 +346,6 @@ async def main():
     
     async with bot:
         updates = await bot.get_updates()
-        os.makedirs('downloads', exist_ok=True)
         today = datetime.now(BANGKOK_TZ).date()
         print(f'number of updates: {len(updates)}')
         for i, update in enumerate(updates):
@@ -197,16 +367,11 @@ async def main():
                         file_name = msg.document.file_name or f"{file_id}"
                         print('Document:', file_name)
                         file = await bot.get_file(file_id)
-                        await file.download_to_drive(f"downloads/{file_name}")
-                        # print(f"Downloaded file: downloads/{file_name}")
-
-                        im = Image.open(f"downloads/{file_name}")
-                        exif_data = im._getexif()
-                        for tag_id, value in exif_data.items():
-                            tag = TAGS.get(tag_id, tag_id)
-                            if tag == 'DateTimeOriginal':
-                                dt_bangkok = datetime.strptime(value, '%Y:%m:%d %H:%M:%S')
-                                print(f"{tag}: {dt_bangkok}")
+                        buffer = io.BytesIO()
+                        await file.download_to_memory(buffer)
+                        metadata = read_metadata(buffer)
+                        if metadata is not None:
+                            print(f"DateTimeOriginal: {metadata.capture_time} ({metadata.width}x{metadata.height}, {metadata.camera})")
 
 if __name__ == "__main__":
     # asyncio.run(main())
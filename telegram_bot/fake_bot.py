@@ -0,0 +1,127 @@
+import io
+import random
+import asyncio
+from datetime import datetime, timezone, timedelta
+from typing import Optional, List, Dict, Any, BinaryIO
+
+from PIL import Image
+from telegram import Update, Message, Chat, Document, PhotoSize
+
+BANGKOK_OFFSET = timedelta(hours=7)
+
+
+def make_photo_bytes(size: tuple = (3024, 4032), capture_time: Optional[datetime] = None, seed: int = 0) -> bytes:
+    """
+    JPEG bytes shaped like a phone photo: noisy pixels and an EXIF DateTimeOriginal (local time)
+    """
+    rng = random.Random(seed)
+    small = Image.frombytes('RGB', (64, 64), bytes(rng.getrandbits(8) for _ in range(64 * 64 * 3)))
+    im = small.resize(size, Image.Resampling.BILINEAR)
+    exif = im.getexif()
+    if capture_time is not None:
+        exif.get_ifd(0x8769)[0x9003] = capture_time.strftime('%Y:%m:%d %H:%M:%S')
+    buffer = io.BytesIO()
+    im.save(buffer, format='JPEG', quality=90, exif=exif)
+    return buffer.getvalue()
+
+
+class FakeFile:
+    def __init__(self, file_id: str, data: bytes, latency: float) -> None:
+        self.file_id = file_id
+        self.file_unique_id = f'unique-{file_id}'
+        self.file_size = len(data)
+        self.data = data
+        self.latency = latency
+
+    async def download_to_drive(self, custom_path: Optional[str] = None) -> str:
+        await asyncio.sleep(self.latency)
+        with open(custom_path, 'wb') as f:
+            f.write(self.data)
+        return custom_path
+
+    async def download_to_memory(self, out: BinaryIO) -> None:
+        await asyncio.sleep(self.latency)
+        out.write(self.data)
+
+    async def download_as_bytearray(self, buf: Optional[bytearray] = None) -> bytearray:
+        await asyncio.sleep(self.latency)
+        if buf is None:
+            return bytearray(self.data)
+        buf.extend(self.data)
+        return buf
+
+
+class FakeTelegramBot:
+    """
+    In-memory stand-in for telegram.Bot serving scripted updates, implementing get_me,
+    get_updates and get_file. Updates are real telegram objects, downloads sleep for latency.
+    """
+    def __init__(self, latency: float = 0.0) -> None:
+        self.latency = latency
+        self.updates: List[Update] = []
+        self.files: Dict[str, bytes] = {}
+        self.calls: Dict[str, int] = {}
+        self._chat = Chat(id=1, type=Chat.PRIVATE)
+
+    async def __aenter__(self) -> 'FakeTelegramBot':
+        # opening a session costs a round trip, like the get_me of Bot.initialize
+        self._call('initialize')
+        await asyncio.sleep(self.latency)
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        pass
+
+    def _call(self, name: str) -> None:
+        self.calls[name] = self.calls.get(name, 0) + 1
+
+    def _add_message(self, sent_at: Optional[datetime], **kwargs) -> Update:
+        update_id = len(self.updates) + 1
+        message = Message(message_id=update_id, date=sent_at or datetime.now(timezone.utc), chat=self._chat, **kwargs)
+        update = Update(update_id=update_id, message=message)
+        self.updates.append(update)
+        return update
+
+    def add_document(self, file_name: str, data: bytes, sent_at: Optional[datetime] = None) -> Update:
+        file_id = f'document-{len(self.files) + 1}'
+        self.files[file_id] = data
+        return self._add_message(sent_at, document=Document(file_id=file_id, file_unique_id=f'unique-{file_id}', file_name=file_name))
+
+    def add_photo(self, data: bytes, caption: Optional[str] = None, sent_at: Optional[datetime] = None) -> Update:
+        file_id = f'photo-{len(self.files) + 1}'
+        self.files[file_id] = data
+        photo = PhotoSize(file_id=file_id, file_unique_id=f'unique-{file_id}', width=1280, height=960)
+        return self._add_message(sent_at, photo=(photo,), caption=caption)
+
+    def add_text(self, text: str, sent_at: Optional[datetime] = None) -> Update:
+        return self._add_message(sent_at, text=text)
+
+    async def get_me(self) -> Dict[str, Any]:
+        self._call('get_me')
+        return {'id': 0, 'is_bot': True, 'first_name': 'FakeTelegramBot'}
+
+    async def get_updates(self, offset: Optional[int] = None, limit: int = 100, timeout: int = 0, **kwargs) -> List[Update]:
+        self._call('get_updates')
+        await asyncio.sleep(self.latency)
+        updates = [update for update in self.updates if offset is None or update.update_id >= offset][:limit]
+        if not updates and timeout:
+            await asyncio.sleep(timeout) # long polling without anything new
+        return updates
+
+    async def get_file(self, file_id: str, **kwargs) -> FakeFile:
+        self._call('get_file')
+        await asyncio.sleep(self.latency)
+        return FakeFile(file_id, self.files[file_id], self.latency)
+
+
+def make_day_bot(latency: float = 0.0, n_workouts: int = 2, photo_size: tuple = (3024, 4032)) -> FakeTelegramBot:
+    """
+    A bot holding a typical day: workout screenshots captioned 'theduc', then the two morning photos
+    """
+    bot = FakeTelegramBot(latency=latency)
+    local_now = datetime.now(timezone.utc) + BANGKOK_OFFSET
+    for i in range(n_workouts):
+        bot.add_photo(make_photo_bytes((1280, 960), seed=100 + i), caption='theduc')
+    for i in range(2):
+        bot.add_document(f'morning-{i}.jpg', make_photo_bytes(photo_size, capture_time=local_now.replace(tzinfo=None), seed=i))
+    return bot
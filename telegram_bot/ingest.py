@@ -0,0 +1,146 @@
+import os
+import time
+import asyncio
+from typing import Optional, List, Dict, Any, Set
+
+from telegram import Update
+
+from logger import logger
+from telegram_bot.bot import TelegramProcessor, TELEGRAM_UPDATES_LIMIT
+
+
+# 'polling' long-polls getUpdates, 'webhook' receives updates on POST /telegram/webhook, 'off' leaves it to the checks
+TELEGRAM_INGEST_MODE = os.getenv('TELEGRAM_INGEST_MODE', 'polling')
+TELEGRAM_POLL_TIMEOUT = int(os.getenv('TELEGRAM_POLL_TIMEOUT', 30))
+# Compared with the X-Telegram-Bot-Api-Secret-Token header of webhook calls when set
+TELEGRAM_WEBHOOK_SECRET = os.getenv('TELEGRAM_WEBHOOK_SECRET')
+# Public URL of POST /telegram/webhook, registered with Telegram at startup in webhook mode
+TELEGRAM_WEBHOOK_URL = os.getenv('TELEGRAM_WEBHOOK_URL')
+
+
+class IngestWorker:
+    """
+    Evaluates every Telegram image as it arrives (morning verdicts, workout infos) into the media
+    store, so that the scheduled checks only aggregate results already computed.
+    Runs on the FastAPI event loop with its own processor, bot session and LLM client.
+    """
+    def __init__(self, processor: Optional[TelegramProcessor] = None, poll_timeout: int = TELEGRAM_POLL_TIMEOUT) -> None:
+        self.processor = processor if processor is not None else TelegramProcessor()
+        self.poll_timeout = poll_timeout
+        self._stats = {'updates': 0, 'images': 0, 'errors': 0, 'last_update_at': None}
+        # evaluations started by webhook calls, referenced until they finish
+        self._tasks: Set[asyncio.Task] = set()
+
+
+    async def handle_updates(self, updates: List[Update]) -> None:
+        """
+        Store new updates then evaluate their images concurrently, a failing image is logged and retried by the next check
+        """
+        self._store_updates(updates)
+        await self._evaluate_updates(updates)
+
+
+    def _store_updates(self, updates: List[Update]) -> None:
+        self.processor.update_store.put_updates(updates)
+        self._stats['updates'] += len(updates)
+        if updates:
+            self._stats['last_update_at'] = time.time()
+
+
+    async def _evaluate_updates(self, updates: List[Update]) -> None:
+        async with self.processor.session():
+            results = await asyncio.gather(*(self.processor.evaluate_update(update) for update in updates), return_exceptions=True)
+        for update, result in zip(updates, results):
+            if isinstance(result, Exception):
+                self._stats['errors'] += 1
+                logger.error(f"Error ingesting update {update.update_id}: {str(result)}")
+            elif isinstance(result, BaseException):
+                raise result
+            elif result is not None:
+                self._stats['images'] += 1
+
+
+    async def run_polling(self) -> None:
+        """
+        Long-poll getUpdates until cancelled in one bot session, backing off and reconnecting on errors
+        """
+        logger.info(f"Telegram ingest worker polling every {self.poll_timeout}s")
+        backoff = 1
+        while True:
+            try:
+                # the session is only reopened after an error
+                async with self.processor.session() as bot:
+                    while True:
+                        updates = await bot.get_updates(
+                            offset=self.processor.update_store.get_offset(), limit=TELEGRAM_UPDATES_LIMIT, timeout=self.poll_timeout
+                        )
+                        await self.handle_updates(updates)
+                        backoff = 1
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self._stats['errors'] += 1
+                logger.error(f"Error polling Telegram updates, retrying in {backoff}s: {str(e)}")
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 2, 60)
+
+
+    async def register_webhook(self, url: Optional[str] = TELEGRAM_WEBHOOK_URL) -> bool:
+        """
+        Ask Telegram to deliver the updates to the webhook
+
+        Returns:
+            Whether the webhook is set, the checks have to keep polling otherwise
+        """
+        if not url:
+            logger.error("TELEGRAM_WEBHOOK_URL is not set, Telegram updates will not be pushed")
+            return False
+        try:
+            async with self.processor.session() as bot:
+                await bot.set_webhook(url, secret_token=TELEGRAM_WEBHOOK_SECRET)
+        except Exception as e:
+            logger.error(f"Error registering the Telegram webhook: {str(e)}")
+            return False
+        logger.info(f"Telegram webhook registered at {url}")
+        return True
+
+
+    async def delete_webhook(self) -> None:
+        try:
+            async with self.processor.session() as bot:
+                await bot.delete_webhook()
+        except Exception as e:
+            logger.error(f"Error deleting the Telegram webhook: {str(e)}")
+
+
+    async def handle_webhook(self, data: Dict[str, Any]) -> None:
+        """
+        Store a pushed update and evaluate its image in the background. Telegram resends an update
+        it gets no quick answer for, so the call returns before the download and the LLM call.
+        """
+        updates = [Update.de_json(data, self.processor.bot)]
+        self._store_updates(updates)
+        task = asyncio.create_task(self._evaluate_updates(updates))
+        self._tasks.add(task)
+        task.add_done_callback(self._on_evaluated)
+
+
+    def _on_evaluated(self, task: asyncio.Task) -> None:
+        self._tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            self._stats['errors'] += 1
+            logger.error(f"Error ingesting webhook update: {str(task.exception())}")
+
+
+    async def stop(self) -> None:
+        """
+        Cancel the evaluations still running, their images are evaluated by the next check instead
+        """
+        tasks = list(self._tasks)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+    def get_stats(self) -> Dict[str, Any]:
+        return dict(self._stats, mode=TELEGRAM_INGEST_MODE)
@@ -0,0 +1,84 @@
+import os
+import json
+from datetime import date, timedelta
+from typing import Optional, List, Any
+
+import pytz
+from telegram import Update
+
+from storage import data_path, sqlite_connection
+
+
+BANGKOK_TZ = pytz.timezone('Asia/Bangkok')
+# Indexed updates older than this are pruned
+TELEGRAM_UPDATE_RETENTION_DAYS = int(os.getenv('TELEGRAM_UPDATE_RETENTION_DAYS', 30))
+
+
+class UpdateStore:
+    """
+    Local SQLite store of consumed Telegram updates and of the getUpdates offset.
+    Updates are indexed by their local (Bangkok) day so that checks read today's messages
+    from here, and only ask Telegram for what arrived since the last poll.
+    """
+    def __init__(self, path: Optional[str] = None, retention_days: int = TELEGRAM_UPDATE_RETENTION_DAYS) -> None:
+        self.path = path or data_path('telegram_updates.sqlite3')
+        self.retention_days = retention_days
+        with sqlite_connection(self.path) as conn:
+            conn.execute('CREATE TABLE IF NOT EXISTS state (key TEXT PRIMARY KEY, value INTEGER NOT NULL)')
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS updates ('
+                'update_id INTEGER PRIMARY KEY, day TEXT NOT NULL, sent_at REAL NOT NULL, payload TEXT NOT NULL)'
+            )
+            conn.execute('CREATE INDEX IF NOT EXISTS updates_day ON updates (day, update_id)')
+
+
+    def get_offset(self) -> Optional[int]:
+        """
+        Offset of the next getUpdates call, None before the first one
+        """
+        with sqlite_connection(self.path) as conn:
+            row = conn.execute("SELECT value FROM state WHERE key = 'offset'").fetchone()
+        return row[0] if row else None
+
+
+    def put_updates(self, updates: List[Update]) -> int:
+        """
+        Index the message updates by day and move the offset past every given update, in one transaction.
+        Updates already stored are ignored, so overlapping polls are harmless.
+
+        Returns:
+            The number of new message updates
+        """
+        if not updates:
+            return 0
+        rows = []
+        for update in updates:
+            msg = update.message
+            if msg is None: # edits, reactions, ... are acknowledged but not indexed
+                continue
+            day = msg.date.astimezone(BANGKOK_TZ).date().isoformat()
+            rows.append((update.update_id, day, msg.date.timestamp(), json.dumps(update.to_dict())))
+
+        next_offset = max(update.update_id for update in updates) + 1
+        prune_before = (date.today() - timedelta(days=self.retention_days)).isoformat()
+        with sqlite_connection(self.path) as conn:
+            before = conn.total_changes
+            conn.executemany('INSERT OR IGNORE INTO updates (update_id, day, sent_at, payload) VALUES (?, ?, ?, ?)', rows)
+            added = conn.total_changes - before
+            conn.execute(
+                "INSERT INTO state (key, value) VALUES ('offset', ?) "
+                "ON CONFLICT (key) DO UPDATE SET value = MAX(value, excluded.value)", (next_offset,)
+            )
+            conn.execute('DELETE FROM updates WHERE day < ?', (prune_before,))
+        return added
+
+
+    def get_day_updates(self, day: date, bot: Optional[Any] = None) -> List[Update]:
+        """
+        Stored message updates of a local day, in arrival order
+        """
+        with sqlite_connection(self.path) as conn:
+            rows = conn.execute(
+                'SELECT payload FROM updates WHERE day = ? ORDER BY update_id', (day.isoformat(),)
+            ).fetchall()
+        return [Update.de_json(json.loads(payload), bot) for payload, in rows]
@@ -8,7 +8,7 @@ from logger import logger
 import numpy as np
 from dotenv import load_dotenv
 import time
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 import asyncio
 
 load_dotenv()
@@ -19,6 +19,8 @@ with open(f'resources/all_addresses.txt', 'r') as f:
     all_addresses = [line.strip() for line in f.readlines()]
 USDC_AMOUNT = float(os.getenv('USDC_AMOUNT', 0.01))
 logger.info(f"USDC_AMOUNT: {USDC_AMOUNT}")
+# How long data prefetched by a warm-up job stays usable by the check that follows it
+STAGE_MAX_AGE_SECONDS = int(os.getenv('STAGE_MAX_AGE_SECONDS', 30 * 60))
 
 
 @dataclass
@@ -27,6 +29,18 @@ class TaskCheckResponse:
     message: str
     status: Literal['SUCCESS', 'FAIL']
 
+@dataclass
+class StagedData:
+    """
+    Data prefetched by a warm-up job ahead of a deadline check
+    """
+    day: str # dd/mm/yyyy the data belongs to
+    data: Any
+    staged_at: float = field(default_factory=time.time)
+
+    def is_fresh(self, max_age_seconds: int = STAGE_MAX_AGE_SECONDS) -> bool:
+        return time.time() - self.staged_at <= max_age_seconds
+
 def get_current_date() -> str:
     """
     Get current date in GMT+7 timezone and return in dd/mm/yyyy format